@@ -2,10 +2,20 @@ import asyncio
 import atexit
 import subprocess
 import sys
+import threading
 import time
 
 sys.path.insert(0, "src/")
 
+AIM_ASSIST_MODES = ("thread", "process")
+
+
+def run_aim_assist():
+    # Imported on the aim assist thread, the model loads while the client starts
+    from src.client.aim_assist import run
+
+    run()
+
 
 def main():
     p = None  # subprocess reference
@@ -16,23 +26,56 @@ def main():
             if script_mode == "server":
                 from src.server.server import Server
 
+                # --sim runs the server on simulated hardware
+                sim = "--sim" in sys.argv
+                if sim:
+                    sys.argv.remove("--sim")
+
                 server = Server()
-                server.start()
+                server.start(sim=sim)
 
             elif script_mode == "client":
+                # --aim-assist=thread runs aim assist inside the client
+                aim_assist_mode = "process"
+                for arg in sys.argv[2:]:
+                    if arg.startswith("--aim-assist="):
+                        aim_assist_mode = arg.split("=", 1)[1]
+                        sys.argv.remove(arg)
+                if aim_assist_mode not in AIM_ASSIST_MODES:
+                    print(
+                        "usage: main.py client [--aim-assist={thread,process}]\n"
+                        f"Unknown aim assist mode {aim_assist_mode!r}",
+                        file=sys.stderr,
+                    )
+                    sys.exit(2)
+
                 from src.client.client import Client
                 from src.client.video import DisplayFrame
 
                 print("Starting the client...")
-                # start a python program as a subprocess
-                p = subprocess.Popen(["python", "src/client/aim_assist.py"])
-                atexit.register(
-                    p.terminate
-                )  # register the terminate function to be called on exit
+                launch = time.perf_counter()
+                if aim_assist_mode == "thread":
+                    thread = threading.Thread(
+                        target=run_aim_assist, name="aim-assist", daemon=True
+                    )
+                    thread.start()
+                    aim_assist_alive = thread.is_alive
+                else:
+                    # start a python program as a subprocess
+                    p = subprocess.Popen(["python", "-m", "src.client.aim_assist"])
+                    atexit.register(
+                        p.terminate
+                    )  # register the terminate function to be called on exit
 
-                time.sleep(4)
+                    def aim_assist_alive():
+                        return p.poll() is None
 
-                gui = DisplayFrame()
+                # Waits until aim assist says it is ready
+                gui = DisplayFrame(aim_assist_alive=aim_assist_alive)
+                print(
+                    f"Aim assist ({aim_assist_mode}) ready "
+                    f"{time.perf_counter() - launch:.2f} s after launch"
+                )
                 client = Client(gui)
 
                 async def starting():
@@ -43,10 +86,12 @@ def main():
 
                 asyncio.run(starting())
 
-            elif script_mode == "test":
-                pass
+            elif script_mode in ("bench", "test"):
+                from src.bench.harness import main as bench
+
+                bench()
         else:
-            print("script mode is not specified, options are: server, client, test")
+            print("script mode is not specified, options are: server, client, bench")
     except Exception as e:
         # kill the subprocess if an error occurred
         if p is not None:
@@ -0,0 +1,324 @@
+"""
+End-to-end command-to-actuation latency benchmark.
+
+Client and server run in one process on simulated hardware (see
+``src.server.sim``). A scripted input trace is fed into the real
+ApplicationController, the commands go over the real websocket or WebRTC
+transport (with an in-process signaling relay) to the real server, actuator
+thread and MotorController. Latency is measured from the moment the trace
+publishes a stick change to the moment motor1's PWM period is written.
+
+Commands are matched to PWM writes by motor1's step frequency, which the
+MotorController under test computes for every published state, so every
+step of the trace has to change it. Commands that never reach the PWM, for
+example because a newer one replaced them, count as dropped.
+
+Run from the Python directory::
+
+    python main.py bench --transport both --commands 500 --rate 100
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import threading
+import time
+from time import perf_counter
+
+import websockets
+from src.server.sim import Simulation
+from src.shared.clock_sync import percentile
+
+MAX_FREQUENCY = 1500
+
+
+def synthetic_trace(commands, rate):
+    """
+    Drive forward with a new motor1 frequency every step, assuming the
+    controller's full speed is ``MAX_FREQUENCY``.
+
+    1000 Hz is skipped because the PWM starts at that frequency, so it would
+    not be written again.
+    """
+    frequencies = [f for f in range(100, MAX_FREQUENCY) if f != 1000][:commands]
+    return [
+        (step / rate, (0, 1, frequency / MAX_FREQUENCY, 0))
+        for step, frequency in enumerate(frequencies)
+    ]
+
+
+def load_trace(path):
+    """Read a trace of ``{"t", "x", "y", "speed", "weapon_speed"}`` objects."""
+    with open(path) as f:
+        return [
+            (
+                entry["t"],
+                (entry["x"], entry["y"], entry["speed"], entry["weapon_speed"]),
+            )
+            for entry in json.load(f)
+        ]
+
+
+class NullGui:
+    """Receives the video frames on the client and drops them."""
+
+    def __init__(self):
+        self.frames = 0
+        self.side_frames = 0
+
+    async def send_frame(self, frame):
+        self.frames += 1
+
+    async def send_side_frame(self, frame):
+        self.side_frames += 1
+
+    def set_video_config(self, config):
+        pass
+
+
+async def signaling_relay(host="127.0.0.1"):
+    """
+    Forward every signaling message to the other peers, holding messages
+    until a second peer has connected.
+    """
+    peers = set()
+    pending = []
+
+    async def handler(websocket, path=None):
+        peers.add(websocket)
+        for message in pending:
+            await websocket.send(message)
+        pending.clear()
+        try:
+            async for message in websocket:
+                others = [peer for peer in peers if peer is not websocket]
+                if not others:
+                    pending.append(message)
+                for peer in others:
+                    await peer.send(message)
+        finally:
+            peers.discard(websocket)
+
+    server = await websockets.serve(handler, host, 0)
+    port = server.sockets[0].getsockname()[1]
+    return server, f"ws://{host}:{port}"
+
+
+def make_trace_controller(trace):
+    from src.client.inputs import InputController
+
+    class TraceController(InputController):
+        """Replays ``(t, state)`` steps from a thread, like a device would."""
+
+        def __init__(self):
+            super().__init__()
+            self.publish_times = []  # (perf_counter, state)
+            self.done = threading.Event()
+
+        def get_input(self):
+            return self.last_input or (0, 0, 0, 0)
+
+        def start(self, loop=None, events=None):
+            self.attach(loop, events)
+            threading.Thread(target=self.replay, daemon=True).start()
+
+        def replay(self):
+            start = perf_counter()
+            for offset, state in trace:
+                delay = start + offset - perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                self.publish_times.append((perf_counter(), state))
+                self.publish(state)
+            self.done.set()
+
+    return TraceController()
+
+
+def make_application_controller(controller, uri, transport, gui, max_send_rate):
+    from src.client.logic import ApplicationController
+
+    class BenchApplicationController(ApplicationController):
+        def get_control_input(self):
+            self.controller = controller
+
+        def record_input_latency(self, latency):
+            pass
+
+    return BenchApplicationController(uri, transport, gui, max_send_rate=max_send_rate)
+
+
+async def close_client(net_client):
+    async def close():
+        if hasattr(net_client, "pc"):
+            await net_client.pc.close()
+            await net_client.ws.close()
+        elif net_client.websocket is not None:
+            await net_client.websocket.close()
+
+    future = asyncio.run_coroutine_threadsafe(close(), net_client.loop)
+    try:
+        await asyncio.wrap_future(future)
+    except asyncio.CancelledError:
+        pass  # the client loop ends, cancelling close(), once it is closed
+
+
+async def run_transport(transport, trace, simulation, args):
+    from src.server.actuator import ActuatorThread
+    from src.server.communications import MotorWebRTCClient, MotorWebSocketServer
+    from src.server.motor_controller import MotorController
+
+    motor_controller = MotorController(
+        motor1_step=13,
+        motor1_dir=17,
+        motor2_step=12,
+        motor2_dir=20,
+        motor1_en=27,
+        motor2_en=1,
+        weapon_speed=18,
+        ramp_rate=None,  # measure the command path, not the ramp
+        **simulation.motor_controller_options(),
+    )
+    motor_controller.start()
+    actuator = ActuatorThread(motor_controller)
+    actuator.start()
+
+    # Instrumented motor backend: every motor1 period write
+    period_writes = []
+
+    def on_event(event):
+        timestamp, source, name, value = event
+        if source == "pwm" and name == "pwm0/period":
+            period_writes.append((timestamp, round(1e9 / value)))
+
+    simulation.log.listeners.append(on_event)
+
+    gui = NullGui()
+    server_tasks = []
+    if transport == "websocket":
+        server = MotorWebSocketServer(actuator, "127.0.0.1", 0)
+        ws_server = await websockets.serve(server.handle_client, "127.0.0.1", 0)
+        uri = f"ws://127.0.0.1:{ws_server.sockets[0].getsockname()[1]}"
+    else:
+        relay, uri = await signaling_relay()
+        server = MotorWebRTCClient(actuator, "bench", 0, signaling_url=uri)
+        server_tasks.append(asyncio.create_task(server.run()))
+
+    controller = make_trace_controller(trace)
+    app = make_application_controller(
+        controller, uri, transport, gui, args.max_send_rate
+    )
+    app_task = asyncio.create_task(app.run())
+
+    # The trace starts once the client is connected
+    while not controller.done.is_set():
+        await asyncio.sleep(0.05)
+        if app_task.done():
+            app_task.result()  # raise the client error
+    await asyncio.sleep(args.drain)
+
+    app_task.cancel()
+    await close_client(app.net_client)
+    for task in server_tasks:
+        task.cancel()
+    if transport == "websocket":
+        ws_server.close()
+        await ws_server.wait_closed()
+    else:
+        await server.pc.close()
+        relay.close()
+    simulation.log.listeners.remove(on_event)
+    actuator.cleanup()
+
+    def motor1_frequency(state):
+        x, y, speed, _ = state
+        return abs(motor_controller.target_frequencies(x, y, speed)["motor1"])
+
+    return summarize(
+        transport, controller.publish_times, period_writes, gui, motor1_frequency
+    )
+
+
+def summarize(transport, publish_times, period_writes, gui, motor1_frequency):
+    """``motor1_frequency`` maps a published state to the expected frequency."""
+    published = {}
+    for timestamp, state in publish_times:
+        published.setdefault(motor1_frequency(state), timestamp)
+
+    latencies = []
+    for timestamp, frequency in period_writes:
+        sent = published.pop(frequency, None)
+        if sent is not None and timestamp >= sent:
+            latencies.append((timestamp - sent) * 1000)
+
+    commands = len(publish_times)
+    duration = publish_times[-1][0] - publish_times[0][0] if commands > 1 else 0
+    return {
+        "transport": transport,
+        "commands": commands,
+        "actuated": len(latencies),
+        "dropped": commands - len(latencies),
+        "duration_s": round(duration, 3),
+        "commands_per_sec": round(len(latencies) / duration, 1) if duration else None,
+        "latency_ms": {
+            name: None if value is None else round(value, 3)
+            for name, value in (
+                ("p50", percentile(latencies, 0.50)),
+                ("p95", percentile(latencies, 0.95)),
+                ("p99", percentile(latencies, 0.99)),
+                ("max", max(latencies, default=None)),
+            )
+        },
+        "video_frames": gui.frames,
+        "side_video_frames": gui.side_frames,
+    }
+
+
+async def run(args):
+    simulation = Simulation()
+    simulation.install()
+
+    if args.trace:
+        trace = load_trace(args.trace)
+    else:
+        trace = synthetic_trace(args.commands, args.rate)
+
+    if args.transport == "both":
+        transports = ["websocket", "webrtc"]
+    else:
+        transports = [args.transport]
+
+    results = []
+    try:
+        for transport in transports:
+            print(f"Benchmarking {transport}...")
+            results.append(await run_transport(transport, trace, simulation, args))
+    finally:
+        simulation.cleanup()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="main.py bench")
+    parser.add_argument(
+        "--transport", choices=["websocket", "webrtc", "both"], default="both"
+    )
+    parser.add_argument("--commands", type=int, default=500)
+    parser.add_argument("--rate", type=float, default=100, help="trace steps/sec")
+    parser.add_argument("--trace", help="JSON trace file instead of the default")
+    parser.add_argument(
+        "--max-send-rate", type=float, default=100, help="client send rate limit"
+    )
+    parser.add_argument(
+        "--drain", type=float, default=0.5, help="seconds to wait after the trace"
+    )
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args(sys.argv[2:] if argv is None else argv)
+
+    results = asyncio.run(run(args))
+    report = json.dumps({"results": results}, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
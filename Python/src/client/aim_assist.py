@@ -1,17 +1,43 @@
 import asyncio
+import json
 import os
 import socket
-import struct
 import time
 
 import cv2
 import numpy as np
-import yaml
-from ultralytics import YOLO
+from src.client.detection_scheduler import DETECT, DetectionScheduler, search_region
+from src.client.detectors import create_detector
+from src.client.frame_ring import (
+    MESSAGE_ATTACH,
+    MESSAGE_FRAME,
+    SEQUENCE,
+    FrameRing,
+    ready_message,
+    receive_message,
+    result_message,
+)
+
+# A frame from the client: 1280x720 preprocessed at scale 0.5
+WARM_UP_SHAPE = (360, 640, 3)
 
 
 class AimAssist:
-    def __init__(self):
+    """
+    Detects and tracks the opponent in the frames the client puts in the
+    frame ring.
+
+    It only listens on ``port`` once the model is loaded and warmed up, and
+    tells the client it is ready with the start-up times in ``startup``.
+    Only what the configured detection needs is imported: ultralytics and
+    torch for the torch backend, neither for colour detection or an ONNX
+    model that was already exported.
+    """
+
+    def __init__(self, port=65432):
+        self.started = time.perf_counter()
+        self.port = port
+        self.startup = {}
         self.initialize_paths()
         self.load_config()
         self.initialize_model()
@@ -19,26 +45,45 @@ class AimAssist:
         self.load_aim_assist_config()
         self.initialize_tracker()
         self.frame_queue = asyncio.Queue()
+        self.frame_ring = None
+        self.frame = None  # private copy of the frame being processed
 
     def initialize_paths(self):
         self.current_dir = os.path.dirname(os.path.abspath(__file__))
-        while os.path.basename(self.current_dir) != "BattleBot":
-            self.current_dir = os.path.dirname(self.current_dir)
+        # The repository root, also when it is checked out under another name
+        while os.path.basename(self.current_dir) != "BattleBot" and not (
+            os.path.isfile(os.path.join(self.current_dir, "docs", "config.yaml"))
+        ):
+            parent = os.path.dirname(self.current_dir)
+            if parent == self.current_dir:
+                raise FileNotFoundError("docs/config.yaml not found")
+            self.current_dir = parent
 
         self.config_file_path = os.path.join(self.current_dir, "docs", "config.yaml")
         self.model_file_path = os.path.join(self.current_dir, "Models", "BotModel.pt")
 
     def load_config(self):
+        start = time.perf_counter()
+        import yaml
+
         with open(self.config_file_path, "r") as f:
             self.aim_config = yaml.load(f, Loader=yaml.FullLoader)["aim_assist"]
+        self.startup["config_s"] = round(time.perf_counter() - start, 3)
 
     def initialize_model(self):
-        self.model = YOLO(self.model_file_path)
+        start = time.perf_counter()
+        self.model = None
+        if self.aim_config["detection"] == "trained":
+            self.model = create_detector(
+                self.model_file_path,
+                self.aim_config.get("backend", "torch"),
+                self.aim_config.get("int8", False),
+            )
+        self.startup["model_s"] = round(time.perf_counter() - start, 3)
 
     def initialize_state_variables(self):
         self.tracking_started = False
         self.tracking_box = None
-        self.tracker_frames = 0
         self.steering_angle = 180
         self.x_range = 2
         self.position_ratio = 0
@@ -48,19 +93,35 @@ class AimAssist:
         self.biggest_contour = None
         self.steering_activated = False
         self.object_detected = False
+        # What the client draws: the box of this frame and how it was found
+        self.result_box = None
+        self.result_state = "lost"
+        # Where the target was last seen, for the detection to look around
+        self.search_box = None
 
     def load_aim_assist_config(self):
         config = self.aim_config
         self.tracked_frames = config["tracked_frames"]
         self.lost_frames = config["lost_frames"]
+        self.scheduler = DetectionScheduler(
+            self.tracked_frames,
+            self.lost_frames,
+            frame_budget=config.get("frame_budget_ms", 50) / 1000,
+            min_confidence=config.get("min_tracker_confidence", 0.5),
+            confidence_drop=config.get("tracker_confidence_drop", 0.1),
+        )
         self.camera_angle = config["camera_angle"]
         self.aim_assist_range = config["range"]
         self.lower = np.array(config["lower_color"], dtype=np.uint8)
         self.upper = np.array(config["upper_color"], dtype=np.uint8)
         self.contour_tracking_size = config["color_tracking_size"]
         self.detection_confidence = config["detection_confidence"]
+        self.roi_size = config.get("roi_size", 320)
+        self.roi_padding = config.get("roi_padding", 2.0)
+        self.roi_misses = config.get("roi_misses", 2)
 
     def initialize_tracker(self):
+        start = time.perf_counter()
         params = cv2.TrackerNano_Params()
         params.backbone = os.path.join(
             self.current_dir, "docs", "nanotrack_backbone.onnx"
@@ -73,12 +134,16 @@ class AimAssist:
             self.tracker = getattr(
                 cv2.legacy, f"Tracker{self.aim_config['tracker']}_create"
             )()
+        self.startup["tracker_s"] = round(time.perf_counter() - start, 3)
 
     async def init_socket(self):
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setblocking(False)
-        self.server_socket.bind(("0.0.0.0", 65432))
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind(("0.0.0.0", self.port))
         self.server_socket.listen(1)
+        self.startup["total_s"] = round(time.perf_counter() - self.started, 3)
+        print(f"Aim assist ready: {self.startup}")
         await self.accept_client()
 
     async def accept_client(self):
@@ -88,89 +153,154 @@ class AimAssist:
                 break
             except BlockingIOError:
                 await asyncio.sleep(0.1)
+
+        await self.loop.sock_sendall(self.client_socket, ready_message(self.startup))
         asyncio.create_task(self.receive_frames())
 
     async def receive_frames(self):
         while True:
-            data = await self.loop.sock_recv(self.client_socket, 4)
-            if not data:
-                break
-            frame_length = struct.unpack("!I", data)[0]
-            frame_data = b""
-            while len(frame_data) < frame_length:
-                packet = await self.loop.sock_recv(
-                    self.client_socket, frame_length - len(frame_data)
+            try:
+                message_type, payload = await receive_message(
+                    self.loop, self.client_socket
                 )
-                if not packet:
-                    break
-                frame_data += packet
-            np_frame = np.frombuffer(frame_data, dtype=np.uint8)
-            frame = cv2.imdecode(np_frame, cv2.IMREAD_COLOR)
-            await self.frame_queue.put(frame)
-
-    async def send_frame(self, frame):
-        encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), 90]
-        result, encoded_frame = cv2.imencode(".jpg", frame, encode_param)
-        data = encoded_frame.tobytes()
-        frame_length = struct.pack("!I", len(data))
-        await self.loop.sock_sendall(self.client_socket, frame_length + data)
+            except ConnectionError:
+                break
+
+            if message_type == MESSAGE_ATTACH:
+                rings = json.loads(payload)
+                self.frame_ring = FrameRing.attach(rings["frames"])
+            elif message_type == MESSAGE_FRAME:
+                await self.frame_queue.put(SEQUENCE.unpack(payload)[0])
+        # The client is gone, process_loop stops at this
+        await self.frame_queue.put(None)
+
+    def read_frame(self, sequence):
+        """
+        Copy frame ``sequence`` out of the frame ring, which the client keeps
+        writing while it is processed. Returns None when the client already
+        overwrote it.
+        """
+        frame, token = self.frame_ring.read(sequence)
+        if frame is None:
+            return None
+        if self.frame is None or self.frame.shape != frame.shape:
+            self.frame = np.empty_like(frame)
+        np.copyto(self.frame, frame)
+        if not self.frame_ring.valid(sequence, token):
+            return None
+        return self.frame
+
+    async def send_result(self, sequence, state=None):
+        # The client draws the overlay itself, on its newest frame
+        result = {
+            "sequence": sequence,
+            "box": self.result_box,
+            "state": state or self.result_state,
+            "position_ratio": self.position_ratio,
+            "steering": self.steering_activated,
+        }
+        try:
+            await self.loop.sock_sendall(self.client_socket, result_message(result))
+        except ConnectionError:
+            pass  # receive_frames notices it as well and ends process_loop
+
+    async def warm_up(self):
+        """
+        Run the model on a blank frame at both input sizes it gets, the whole
+        frame and the search region, and the tracker once: the first run of
+        each is the slowest.
+        """
+        start = time.perf_counter()
+        frame = np.zeros(WARM_UP_SHAPE, dtype=np.uint8)
+        if self.model is not None:
+            self.model(frame)
+            self.model(frame[: self.roi_size, : self.roi_size], imgsz=self.roi_size)
+        # start_tracking initializes it again on the first detection
+        self.tracker.init(frame, (0, 0, 32, 32))
+        self.tracker.update(frame)
+        self.startup["warmup_s"] = round(time.perf_counter() - start, 3)
 
     async def start(self):
         self.loop = asyncio.get_event_loop()
+        await self.warm_up()
         await asyncio.gather(self.process_loop(), self.init_socket())
+        self.client_socket.close()
+        self.server_socket.close()
 
     async def process_loop(self):
         print("Starting the aim assist.")
 
         while True:
-            frame = await self.frame_queue.get()
-            if frame is not None:
+            sequence = await self.frame_queue.get()
+            if sequence is None:
+                print("Client disconnected, stopping the aim assist.")
+                return
+            frame = self.read_frame(sequence)
+            if frame is None:
+                # The client waits for an answer before sending the next frame
+                await self.send_result(sequence, "dropped")
+            else:
                 self.main_video = frame
-                detection = await getattr(
-                    self, f"{self.aim_config['detection']}_detection"
-                )()
-                x, y, w, h = detection
-
-                if not self.tracking_started and self.object_detected:
-                    self.start_tracking(x, y, w, h)
-                elif self.tracking_started and self.object_detected:
-                    await self.update_tracking()
+                self.result_box = None
+                self.result_state = "lost"
+
+                decision = self.scheduler.decide()
+                start = time.perf_counter()
+                if decision == DETECT:
+                    await self.detect()
                 else:
-                    self.tracker_frames += 1
-                    if self.tracker_frames > self.lost_frames:
-                        self.steering_activated = False
+                    await self.update_tracking()
+                self.scheduler.record(decision, time.perf_counter() - start)
+
+                if self.result_box is not None:
+                    x, _, w, _ = self.result_box
+                    self.update_position_ratio(x, w)
+
+                await self.send_result(sequence)
 
-                self.update_position_ratio(x, w)
+                self.fps_counter += 1
+                if self.fps_counter % 100 == 0:
+                    print(f"Detection schedule: {self.scheduler.stats()}")
 
-                # Send the processed frame
-                await self.send_frame(self.main_video)
+    async def detect(self):
+        x, y, w, h = await getattr(self, f"{self.aim_config['detection']}_detection")()
+        if self.object_detected:
+            # Also corrects the tracker's drift
+            self.start_tracking(x, y, w, h)
+            self.scheduler.detected(True)
+        elif self.scheduler.detected(False):
+            self.reset_tracking()
+            self.steering_activated = False
+            self.search_box = None
 
     def process_video_frames(self, full_video):
         midpoint = full_video.shape[1] // 2
         self.main_video = full_video[:, :midpoint, :]
 
     def start_tracking(self, x, y, w, h):
-        self.tracking_box = (x, y, w, h)
+        self.tracking_box = self.search_box = (x, y, w, h)
         self.tracker.init(self.main_video, self.tracking_box)
         self.tracking_started = True
-        self.tracker_frames = 0
         self.steering_activated = True
-        cv2.rectangle(self.main_video, (x, y), (x + w, y + h), (0, 0, 255), 2)
+        self.result_box = [x, y, w, h]
+        self.result_state = "detected"
 
     async def update_tracking(self):
         success, self.tracking_box = self.tracker.update(self.main_video)
+        # Only some trackers (Nano, Vit) score their match
+        confidence = (
+            self.tracker.getTrackingScore()
+            if hasattr(self.tracker, "getTrackingScore")
+            else None
+        )
+        self.scheduler.tracked(success, confidence)
         if success:
-            self.tracker_frames -= 1
-            self.draw_tracking_box()
-            if self.tracker_frames < -self.tracked_frames:
-                self.reset_tracking()
+            self.result_box = list(map(int, self.tracking_box))
+            self.result_state = "tracking"
+            self.search_box = tuple(self.result_box)
         else:
             self.reset_tracking()
 
-    def draw_tracking_box(self):
-        x, y, w, h = map(int, self.tracking_box)
-        cv2.rectangle(self.main_video, (x, y), (x + w, y + h), (0, 255, 0), 2)
-
     def reset_tracking(self):
         self.tracking_started = False
         self.object_detected = False
@@ -178,16 +308,6 @@ class AimAssist:
     def update_position_ratio(self, x, w):
         if self.tracking_started or self.object_detected:
             self.position_ratio = (x + (w / 2)) / self.main_video.shape[1]
-            roi_width = int(self.main_video.shape[1] * 0.05)
-            side = (
-                slice(None, roi_width)
-                if self.position_ratio < 0.5
-                else slice(-roi_width, None)
-            )
-            red_ratio = abs(self.position_ratio - 0.5)
-            self.main_video[:, side, 2] = np.clip(
-                self.main_video[:, side, 2] + int(255 * red_ratio), 0, 255
-            )
 
     async def color_detection(self):
         img = cv2.cvtColor(self.main_video, cv2.COLOR_BGR2HSV)
@@ -206,12 +326,24 @@ class AimAssist:
         return 0, 0, 0, 0
 
     async def trained_detection(self):
-        results = self.model(self.main_video, verbose=False)
-        box = results[0].boxes if results[0].boxes is not None else None
+        region = None
+        if self.search_box is not None and self.scheduler.misses < self.roi_misses:
+            region = search_region(
+                self.search_box, self.main_video.shape, self.roi_size, self.roi_padding
+            )
 
-        if box and len(box.xywh) > 0 and box.conf[0] > self.detection_confidence:
-            x_center, y_center, w, h = map(int, map(round, box.xywh.tolist()[0]))
-            x, y = x_center - w // 2, y_center - h // 2
+        if region is None:
+            left, top = 0, 0
+            boxes = self.model(self.main_video)
+        else:
+            # Only around the last known target, at the model's input size
+            left, top, width, height = region
+            crop = self.main_video[top : top + height, left : left + width]
+            boxes = self.model(crop, imgsz=self.roi_size)
+
+        if len(boxes) and boxes[0, 4] > self.detection_confidence:
+            x_center, y_center, w, h = (int(round(value)) for value in boxes[0, :4])
+            x, y = left + x_center - w // 2, top + y_center - h // 2
             self.object_detected = True
             return x, y, w, h
         else:
@@ -230,9 +362,18 @@ class AimAssist:
         return x_angle
 
 
-# main start
-if __name__ == "__main__":
+def run(port=65432):
+    """Run aim assist until the client is gone, in a process or a thread."""
     print("Starting the aim assist.")
-    aim_assist = AimAssist()
+    aim_assist = AimAssist(port)
     print("Class initialized.")
-    asyncio.run(aim_assist.start())
+    try:
+        asyncio.run(aim_assist.start())
+    finally:
+        if aim_assist.frame_ring is not None:
+            aim_assist.frame_ring.close()
+
+
+# main start
+if __name__ == "__main__":
+    run()
@@ -1,45 +1,159 @@
 import asyncio
 import json
+from collections import deque
 from time import perf_counter
 
 import cv2
 import websockets
 from aiortc import RTCIceCandidate, RTCPeerConnection, RTCSessionDescription
+from aiortc.mediastreams import MediaStreamError
+from src.shared.clock_sync import ClockSync
+from src.shared.protocol import (
+    CONTROL_CHANNEL_LABEL,
+    MOTION_CHANNEL_LABEL,
+    encode_motion,
+    is_motion_command,
+)
 
 from .video import DummyVideoTrack
 
+# Motion commands are held back in the mailbox while more than this many bytes
+# are still waiting in the data channel's send buffer
+MOTION_BUFFER_THRESHOLD = 256
+
 
 class WebSocketClient:
-    def __init__(self, uri):
+    """
+    WebSocket control client.
+
+    In pipelined mode commands are sent as binary packets without waiting for
+    a reply, and the server returns cumulative acks carrying the sequence
+    number of the last applied command. Otherwise every command is sent as
+    JSON and waits for the server's status reply (stop-and-wait).
+    """
+
+    def __init__(self, uri, pipelined=True):
         self.uri = uri
         self.websocket = None
         self.connected = False
+        self.pipelined = pipelined
+        self.sequence = 0
+        self.in_flight = {}  # sequence -> send time, waiting for an ack
+        self.latencies = deque(maxlen=1000)
 
     async def connect(self):
+        self.loop = asyncio.get_running_loop()
         try:
             self.websocket = await websockets.connect(self.uri)
             print("Connected to the WebSocket server.")
         except Exception as e:
             print(f"Failed to connect to WebSocket server: {e}")
+            return
+
+        self.connected = True
+        if self.pipelined:
+            await self.receive_acks()
+        else:
+            await self.websocket.wait_closed()
+        self.connected = False
+
+    async def send_command(self, command):
+        # The input loop runs on a different event loop than the connection
+        if asyncio.get_running_loop() is self.loop:
+            await self.send_over_websocket(command)
+        else:
+            await asyncio.wrap_future(
+                asyncio.run_coroutine_threadsafe(
+                    self.send_over_websocket(command), self.loop
+                )
+            )
 
-    async def send_command(self, action, value):
-        command = json.dumps({"action": action, "value": value})
+    async def send_over_websocket(self, command):
         try:
-            await self.websocket.send(command)
-            await self.websocket.recv()
+            if self.pipelined and is_motion_command(command):
+                self.sequence += 1
+                send_time = perf_counter()
+                self.in_flight[self.sequence] = send_time
+                await self.websocket.send(
+                    encode_motion(
+                        command["x"],
+                        command["y"],
+                        command["speed"],
+                        command["weapon_speed"],
+                        self.sequence,
+                        send_time,
+                    )
+                )
+            elif self.pipelined:
+                await self.websocket.send(json.dumps(command))
+            else:
+                send_time = perf_counter()
+                await self.websocket.send(json.dumps(command))
+                await self.websocket.recv()
+                self.latencies.append((perf_counter() - send_time) * 1000)
         except Exception as e:
             print(f"Error sending command: {e}")
 
+    async def receive_acks(self):
+        async for message in self.websocket:
+            data = json.loads(message)
+            if "ack" not in data:
+                print(f"Message from server: {data}")
+                continue
+
+            # An ack covers every command up to and including its sequence
+            now = perf_counter()
+            acked = [seq for seq in self.in_flight if seq <= data["ack"]]
+            for seq in acked:
+                self.latencies.append((now - self.in_flight.pop(seq)) * 1000)
+
+
+class CommandMailbox:
+    """
+    Single-slot mailbox for motion commands.
+
+    Only the newest setpoint is kept. A command that is replaced before it was
+    sent is counted as overwritten, one that could not be sent because the
+    channel was down is counted as dropped.
+    """
+
+    def __init__(self):
+        self.command = None
+        self.sent = 0
+        self.overwritten = 0
+        self.dropped = 0
+
+    def put(self, command):
+        if self.command is not None:
+            self.overwritten += 1
+        self.command = command
+
+    def take(self):
+        command, self.command = self.command, None
+        return command
+
+    def stats(self):
+        return {
+            "sent": self.sent,
+            "overwritten": self.overwritten,
+            "dropped": self.dropped,
+        }
+
 
 class WebRTCClient:
-    def __init__(self, url, gui):
+    def __init__(self, url, gui, unreliable_motion=True, ping_interval=1.0):
         self.url = url
         self.pc = RTCPeerConnection()
         self.connected = False
+        self.unreliable_motion = unreliable_motion
         self.send_lock = asyncio.Lock()
         self.gui = gui
+        self.sequence = 0
+        self.ping_interval = ping_interval
+        self.clock = ClockSync()
 
     async def connect(self):
+        self.loop = asyncio.get_running_loop()
         async with websockets.connect(self.url) as ws:
             self.ws = ws
             await self.setup_data_channel()
@@ -50,10 +164,37 @@ class WebRTCClient:
             await self.receive_messages()
 
     async def setup_data_channel(self):
-        self.data_channel = self.pc.createDataChannel("dataChannel")
+        self.data_channel = self.pc.createDataChannel(CONTROL_CHANNEL_LABEL)
         self.data_channel.on("open", self.data_channel_open)
         self.data_channel.on("message", self.on_data_channel_message)
-        self.command_queue = asyncio.Queue()  # Queue for sending commands to the server
+
+        # A lost packet on the unordered channel is never retransmitted, so it
+        # cannot hold back newer setpoints
+        if self.unreliable_motion:
+            self.motion_channel = self.pc.createDataChannel(
+                MOTION_CHANNEL_LABEL, ordered=False, maxRetransmits=0
+            )
+        else:
+            self.motion_channel = self.data_channel
+        self.motion_channel.bufferedAmountLowThreshold = MOTION_BUFFER_THRESHOLD
+        self.motion_channel.on("bufferedamountlow", self.on_buffered_amount_low)
+        self.channel_drained = asyncio.Event()
+        # Control messages (ping, config) are sent in order, motion commands
+        # only ever send the newest setpoint
+        self.command_queue = asyncio.Queue()
+        self.motion_mailbox = CommandMailbox()
+        self.send_event = asyncio.Event()
+
+    def on_buffered_amount_low(self):
+        self.channel_drained.set()
+
+    async def wait_for_channel_drain(self):
+        while self.motion_channel.bufferedAmount > MOTION_BUFFER_THRESHOLD:
+            self.channel_drained.clear()
+            try:
+                await asyncio.wait_for(self.channel_drained.wait(), 0.1)
+            except asyncio.TimeoutError:
+                pass
 
     async def data_channel_open(self):
         print("Data Channel is open")
@@ -61,39 +202,61 @@ class WebRTCClient:
         asyncio.create_task(self.send_command_queue())  # create the task here
 
     async def on_data_channel_message(self, message):
+        received = perf_counter()
         message = json.loads(message)
 
         if "pong" in message:
-            current_time = perf_counter()
-            pong_time = message["pong"]
-
-            ping_time = (current_time - pong_time) * 1000  # convert to milliseconds
-
-            print(f"pong received. {ping_time} ms")
+            self.clock.add_pong(message, received)
+        elif "ping" in message:
+            await self.send_command(ClockSync.pong_message(message, received))
+        elif "video" in message:
+            self.gui.set_video_config(message["video"])
         else:
             print(f"Message from Data Channel: {message}")
 
     async def ping_timer(self):
+        pings = 0
         while True:
-            await asyncio.sleep(10)
-            current_time = perf_counter()
-            await self.send_command({"ping": current_time})
+            await asyncio.sleep(self.ping_interval)
+            await self.send_command(ClockSync.ping_message())
+
+            pings += 1
+            if pings % 10 == 0:
+                print(f"Clock: {self.clock.stats()}")
+                print(f"Motion commands: {self.motion_mailbox.stats()}")
 
-    async def receive_frame(self, track):
+    async def receive_frame(self, track, send_frame):
         while True:
-            frame = await track.recv()
-            await self.gui.send_frame(frame)
+            try:
+                frame = await track.recv()
+            except MediaStreamError:
+                print("Video track ended")
+                return
+            await send_frame(frame)
 
     async def on_track(self, track):
-        while True:
-            print("Track received:", track.kind)
-            if track.kind == "video":
-                self.video_channel = track
-                await self.receive_frame(track)
+        print("Track received:", track.kind)
+        if track.kind != "video":
+            return
+
+        # The server sends the driving camera on the first video transceiver
+        # and the second camera, at a low frame rate, on the next one
+        receivers = [
+            transceiver.receiver.track
+            for transceiver in self.pc.getTransceivers()
+            if transceiver.kind == "video"
+        ]
+        if track in receivers[1:]:
+            await self.receive_frame(track, self.gui.send_side_frame)
+        else:
+            self.video_channel = track
+            await self.receive_frame(track, self.gui.send_frame)
 
     async def create_and_send_offer(self):
         dummy_track = DummyVideoTrack()
         self.pc.addTrack(dummy_track)
+        # Room for the second camera's track
+        self.pc.addTransceiver("video", direction="recvonly")
 
         offer = await self.pc.createOffer()
         await self.pc.setLocalDescription(offer)
@@ -131,28 +294,78 @@ class WebRTCClient:
         await self.pc.addIceCandidate(candidate)
 
     async def send_command(self, command):
-        await self.command_queue.put(command)
+        # The input loop runs on a different event loop than the connection
+        if asyncio.get_running_loop() is self.loop:
+            self.post_command(command)
+        else:
+            self.loop.call_soon_threadsafe(self.post_command, command)
+
+    def post_command(self, command):
+        if is_motion_command(command):
+            self.motion_mailbox.put(command)
+        else:
+            self.command_queue.put_nowait(command)
+        self.send_event.set()
+
+    def encode_command(self, command):
+        # Motion setpoints use the binary packet format, anything else is JSON
+        if is_motion_command(command):
+            self.sequence += 1
+            return encode_motion(
+                command["x"],
+                command["y"],
+                command["speed"],
+                command["weapon_speed"],
+                self.sequence,
+                perf_counter(),
+            )
+        return json.dumps(command)
 
     async def send_command_queue(self):
         while True:
-            command = await self.command_queue.get()
-
-            if hasattr(self, "data_channel") and self.data_channel.readyState == "open":
-                async with self.send_lock:
-                    try:
-                        self.data_channel.send(json.dumps(command))
-                    except Exception as e:
-                        print(
-                            f"Error sending message: {e}, traceback: {e.__traceback__}"
-                        )
-                        self.ws.send(json.dumps({"disconnect"}))
+            await self.send_event.wait()
+            self.send_event.clear()
+
+            while not self.command_queue.empty():
+                await self.send_over_channel(
+                    self.data_channel, self.command_queue.get_nowait()
+                )
+
+            # While the channel is backed up newer commands replace the pending
+            # one instead of queueing behind it
+            await self.wait_for_channel_drain()
+            # Until the motion channel is open setpoints use the reliable channel
+            if self.motion_channel.readyState == "open":
+                channel = self.motion_channel
             else:
-                print("Data channel is not open or not set up yet.")
+                channel = self.data_channel
+
+            command = self.motion_mailbox.take()
+            if command is not None:
+                if await self.send_over_channel(channel, command):
+                    self.motion_mailbox.sent += 1
+                else:
+                    self.motion_mailbox.dropped += 1
+
+    async def send_over_channel(self, channel, command):
+        if channel.readyState == "open":
+            async with self.send_lock:
+                try:
+                    channel.send(self.encode_command(command))
+                    return True
+                except Exception as e:
+                    print(f"Error sending message: {e}, traceback: {e.__traceback__}")
+                    self.ws.send(json.dumps({"disconnect"}))
+        else:
+            print("Data channel is not open or not set up yet.")
+        return False
 
     async def close(self):
         if self.ping_task:
             self.ping_task.cancel()
 
+        print(f"Motion commands: {self.motion_mailbox.stats()}")
+
         cv2.destroyAllWindows()  # Close video display window
         await self.pc.close()
         await self.ws.close()
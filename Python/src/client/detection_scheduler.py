@@ -0,0 +1,148 @@
+"""
+Choose per frame between the detector (YOLO or colour) and the tracker.
+
+The detector is what finds the opponent, but it costs many times more than a
+tracker update, so while the tracker follows the target the detector only
+runs when it is needed:
+
+- nothing is tracked yet, or the tracker lost the target
+- the tracker's confidence dropped below ``min_confidence``, or by more than
+  ``confidence_drop`` from the best it had since the last detection (only
+  for trackers that report one, like Nano, whose score stays fairly high
+  on an empty background)
+- ``tracked_frames`` frames were tracked since the last detection, to
+  re-verify the target and correct the tracker's drift
+- a re-verification missed, then every frame until it is found again or
+  ``lost_frames`` detections in a row missed
+
+When the detector fits in ``frame_budget`` seconds anyway, for example with
+colour detection, it runs on every frame like before.
+
+``search_region`` is where a detection looks while the target is known: a
+crop around its last box, which the YOLO detection runs on instead of the
+whole frame until ``misses`` says it slipped out of it.
+"""
+
+from collections import Counter
+
+DETECT = "detect"
+TRACK = "track"
+
+
+class DetectionScheduler:
+    def __init__(
+        self,
+        tracked_frames=30,
+        lost_frames=6,
+        frame_budget=0.05,
+        min_confidence=0.5,
+        confidence_drop=0.1,
+    ):
+        self.tracked_frames = tracked_frames
+        self.lost_frames = lost_frames
+        self.frame_budget = frame_budget
+        self.min_confidence = min_confidence
+        self.confidence_drop = confidence_drop
+
+        self.tracking = False
+        self.frames_since_detection = 0
+        self.misses = 0
+        self.confidence = None
+        self.best_confidence = None
+        self.costs = {DETECT: None, TRACK: None}  # moving average, in seconds
+        self.counts = Counter()
+
+    def decide(self):
+        """``DETECT`` or ``TRACK`` for the next frame."""
+        if not self.tracking or self.misses:
+            return DETECT
+        if self.confidence is not None and (
+            self.confidence < self.min_confidence
+            or self.confidence < self.best_confidence * (1 - self.confidence_drop)
+        ):
+            return DETECT
+        if self.frames_since_detection >= self.tracked_frames:
+            return DETECT
+
+        detect_cost = self.costs[DETECT]
+        if detect_cost is not None and detect_cost <= self.frame_budget:
+            return DETECT
+        return TRACK
+
+    def detected(self, found):
+        """
+        Record a detection. Returns True when ``lost_frames`` detections in a
+        row missed, so the target counts as lost.
+        """
+        self.frames_since_detection = 0
+        self.confidence = self.best_confidence = None
+        if found:
+            self.tracking = True
+            self.misses = 0
+            return False
+
+        self.misses += 1
+        if self.misses > self.lost_frames:
+            self.tracking = False
+            return True
+        return False
+
+    def tracked(self, success, confidence=None):
+        """Record a tracker update and the tracker's confidence, if it has one."""
+        self.frames_since_detection += 1
+        self.confidence = confidence
+        if confidence is not None:
+            self.best_confidence = max(self.best_confidence or 0, confidence)
+        if not success:
+            self.tracking = False
+
+    def record(self, decision, seconds, smoothing=0.2):
+        self.counts[decision] += 1
+        cost = self.costs[decision]
+        self.costs[decision] = (
+            seconds if cost is None else cost + smoothing * (seconds - cost)
+        )
+
+    def stats(self):
+        return {
+            "detect": self.counts[DETECT],
+            "track": self.counts[TRACK],
+            **{
+                f"{decision}_ms": None if cost is None else round(cost * 1000, 2)
+                for decision, cost in self.costs.items()
+            },
+        }
+
+
+def search_region(box, frame_shape, size=320, padding=2.0):
+    """
+    Crop of the frame to search for the target last seen at ``box``.
+
+    Parameters
+    ----------
+    box : tuple
+        ``(x, y, w, h)`` of the target in the frame.
+    frame_shape : tuple
+        Shape of the frame, height and width first.
+    size : int
+        Smallest side of the crop, the detector's input size.
+    padding : float
+        Side of the crop relative to the larger side of ``box``, so a big or
+        close target still fits with room to move.
+
+    Returns
+    -------
+    tuple or None
+        ``(x, y, w, h)`` of the crop, centred on ``box`` and shifted to lie
+        inside the frame, or None when it would cover the whole frame.
+    """
+    x, y, w, h = box
+    height, width = frame_shape[:2]
+    side = max(size, int(padding * max(w, h)))
+    crop_width, crop_height = min(side, width), min(side, height)
+    if crop_width == width and crop_height == height:
+        return None
+
+    left = min(max(x + w // 2 - crop_width // 2, 0), width - crop_width)
+    top = min(max(y + h // 2 - crop_height // 2, 0), height - crop_height)
+    return left, top, crop_width, crop_height
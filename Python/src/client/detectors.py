@@ -0,0 +1,232 @@
+"""
+YOLO backends for the trained detection of aim assist.
+
+``torch`` runs the ``.pt`` model through ultralytics like before, with its
+layers fused ahead of time by ``fused_model``. The ``onnxruntime`` and
+``opencv_dnn`` backends run an ONNX export of it from ``export_model``, so
+they do not import torch at all once it exists. ``onnxruntime`` can also run
+an int8 variant with dynamically quantized weights. Both cache their files
+next to the ``.pt``, named after its hash so a retrained model is converted
+again.
+
+Every backend returns the boxes of an image as an (N, 5) float array of
+``x_center, y_center, width, height, confidence`` in pixels of that image,
+best first, like ultralytics' ``boxes.xywh`` and ``boxes.conf``.
+"""
+
+import abc
+import hashlib
+import math
+import os
+
+import cv2
+import numpy as np
+
+BACKENDS = ("torch", "onnxruntime", "opencv_dnn")
+NO_BOXES = np.zeros((0, 5), dtype=np.float32)
+
+
+def file_hash(path, length=16):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:length]
+
+
+def cache_path(model_path, suffix):
+    """``<model>.<hash>.<suffix>`` next to ``model_path``."""
+    return f"{os.path.splitext(model_path)[0]}.{file_hash(model_path)}.{suffix}"
+
+
+def import_yolo():
+    """
+    ultralytics' YOLO, offline: otherwise it checks for a connection on import
+    and sends usage events with ``requests`` while inference is set up.
+    """
+    os.environ.setdefault("YOLO_OFFLINE", "true")
+    from ultralytics import YOLO
+
+    return YOLO
+
+
+def fused_model(model_path):
+    """
+    Path of ``model_path`` with its convolutions and batch norms fused, which
+    ultralytics would otherwise do at the first inference of every start.
+    Cached as ``<model>.<hash>.fused.pt``.
+    """
+    fused_path = cache_path(model_path, "fused.pt")
+    if not os.path.isfile(fused_path):
+        print(f"Fusing {model_path} to {fused_path}...")
+        model = import_yolo()(model_path)
+        model.fuse(verbose=False)
+        model.save(f"{fused_path}.tmp")
+        os.replace(f"{fused_path}.tmp", fused_path)
+    return fused_path
+
+
+def export_model(model_path, int8=False, imgsz=640):
+    """
+    Path of the ONNX export of ``model_path``, exporting it on first use.
+
+    The export has dynamic input sizes so the crops of the search region run
+    at their own size, and is cached as ``<model>.<hash>.onnx``, or
+    ``<model>.<hash>.int8.onnx`` for the quantized variant.
+    """
+    onnx_path = cache_path(model_path, "onnx")
+    if not os.path.isfile(onnx_path):
+        YOLO = import_yolo()
+
+        print(f"Exporting {model_path} to {onnx_path}...")
+        exported = YOLO(model_path).export(format="onnx", imgsz=imgsz, dynamic=True)
+        os.replace(exported, onnx_path)
+    if not int8:
+        return onnx_path
+
+    int8_path = cache_path(model_path, "int8.onnx")
+    if not os.path.isfile(int8_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        print(f"Quantizing {onnx_path} to {int8_path}...")
+        quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QUInt8)
+    return int8_path
+
+
+def letterbox(image, size, stride=32, square=False):
+    """
+    Scale ``image`` to fit ``size`` and pad it with grey like ultralytics:
+    to a multiple of ``stride``, or to a ``size`` square.
+
+    Returns the padded image, the scale and the ``(left, top)`` padding.
+    """
+    height, width = image.shape[:2]
+    scale = min(size / height, size / width)
+    new_width, new_height = round(width * scale), round(height * scale)
+    if square:
+        padded_width = padded_height = size
+    else:
+        padded_width = math.ceil(new_width / stride) * stride
+        padded_height = math.ceil(new_height / stride) * stride
+
+    if (new_width, new_height) != (width, height):
+        image = cv2.resize(
+            image, (new_width, new_height), interpolation=cv2.INTER_LINEAR
+        )
+    left = (padded_width - new_width) // 2
+    top = (padded_height - new_height) // 2
+    padded = cv2.copyMakeBorder(
+        image,
+        top,
+        padded_height - new_height - top,
+        left,
+        padded_width - new_width - left,
+        cv2.BORDER_CONSTANT,
+        value=(114, 114, 114),
+    )
+    return padded, scale, (left, top)
+
+
+def postprocess(output, scale, padding, confidence=0.25, iou=0.7):
+    """
+    Boxes from the raw YOLOv8 ``output`` of shape (1, 4 + classes, anchors),
+    mapped back from the letterboxed image and with overlaps suppressed.
+    """
+    predictions = output[0].T
+    scores = predictions[:, 4:].max(axis=1)
+    predictions, scores = predictions[scores > confidence], scores[scores > confidence]
+    if not len(scores):
+        return NO_BOXES
+
+    left, top = padding
+    boxes = predictions[:, :4].copy()
+    boxes[:, 0] -= left
+    boxes[:, 1] -= top
+    boxes /= scale
+
+    corners = boxes.copy()
+    corners[:, :2] -= corners[:, 2:] / 2
+    keep = cv2.dnn.NMSBoxes(corners.tolist(), scores.tolist(), confidence, iou)
+    keep = np.asarray(keep, dtype=int).reshape(-1)
+    keep = keep[np.argsort(-scores[keep])]
+    return np.hstack((boxes[keep], scores[keep, np.newaxis])).astype(np.float32)
+
+
+class TorchDetector:
+    def __init__(self, model_path, imgsz=640):
+        self.model = import_yolo()(fused_model(model_path))
+        self.imgsz = imgsz
+
+    def __call__(self, image, imgsz=None):
+        boxes = self.model(image, imgsz=imgsz or self.imgsz, verbose=False)[0].boxes
+        if boxes is None or not len(boxes):
+            return NO_BOXES
+        return np.hstack(
+            (boxes.xywh.cpu().numpy(), boxes.conf.cpu().numpy()[:, np.newaxis])
+        )
+
+
+class OnnxDetector(abc.ABC):
+    """Letterboxing and decoding around the ``infer`` of an ONNX backend."""
+
+    square = False
+
+    def __init__(self, model_path, imgsz=640):
+        self.model_path = model_path
+        self.imgsz = imgsz
+
+    def __call__(self, image, imgsz=None):
+        padded, scale, padding = letterbox(
+            image, imgsz or self.imgsz, square=self.square
+        )
+        # BGR to RGB like ultralytics does with arrays
+        blob = cv2.dnn.blobFromImage(padded, 1 / 255, swapRB=True)
+        return postprocess(self.infer(blob), scale, padding)
+
+    @abc.abstractmethod
+    def infer(self, blob):
+        """The raw model output for an NCHW float ``blob``."""
+
+
+class OnnxRuntimeDetector(OnnxDetector):
+    def __init__(self, model_path, imgsz=640):
+        import onnxruntime
+
+        super().__init__(model_path, imgsz)
+        self.session = onnxruntime.InferenceSession(
+            model_path, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def infer(self, blob):
+        return self.session.run(None, {self.input_name: blob})[0]
+
+
+class OpenCvDnnDetector(OnnxDetector):
+    # OpenCV does not reliably reshape dynamic ONNX inputs to any size
+    square = True
+
+    def __init__(self, model_path, imgsz=640):
+        super().__init__(model_path, imgsz)
+        self.net = cv2.dnn.readNetFromONNX(model_path)
+
+    def infer(self, blob):
+        self.net.setInput(blob)
+        return self.net.forward()
+
+
+def create_detector(model_path, backend="torch", int8=False, imgsz=640):
+    """The detector for ``backend``, exporting the model first if it needs to."""
+    if backend not in BACKENDS:
+        raise ValueError(
+            f"Unknown detection backend {backend!r}, use one of {BACKENDS}"
+        )
+    if int8 and backend != "onnxruntime":
+        raise ValueError("The int8 model only runs on the onnxruntime backend")
+
+    if backend == "torch":
+        return TorchDetector(model_path, imgsz)
+    onnx_path = export_model(model_path, int8, imgsz)
+    if backend == "onnxruntime":
+        return OnnxRuntimeDetector(onnx_path, imgsz)
+    return OpenCvDnnDetector(onnx_path, imgsz)
@@ -0,0 +1,255 @@
+"""
+Frames between the client and the aim assist process without encoding them.
+
+A ``FrameRing`` is a ``multiprocessing.shared_memory`` block of fixed-size
+slots. The single writer fills slot ``sequence % slots`` in place and only
+announces the sequence number over the control socket; the reader maps the
+same memory and looks the frame up by that number. Every slot has a seqlock
+counter that is odd while the slot is written, so a reader can tell that a
+slot it is looking at was overwritten in the meantime.
+
+Control messages are ``!BI`` (type, payload length) followed by the payload:
+
+    MESSAGE_ATTACH  JSON with the ``describe()`` of the frame ring
+    MESSAGE_FRAME   ``!Q`` sequence number of a frame in the ring
+    MESSAGE_RESULT  JSON with aim assist's result for a frame: ``sequence``,
+                    ``box`` ([x, y, w, h] or None), ``state`` (detected,
+                    tracking, lost or dropped), ``position_ratio`` and
+                    ``steering``
+    MESSAGE_READY   JSON with aim assist's start-up times, sent once it
+                    accepted the client with the model loaded and warmed up
+"""
+
+import json
+import os
+import socket
+import struct
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+MESSAGE_ATTACH = 1
+MESSAGE_FRAME = 2
+MESSAGE_RESULT = 3
+MESSAGE_READY = 4
+
+MESSAGE_HEADER = struct.Struct("!BI")
+SEQUENCE = struct.Struct("!Q")
+
+# Per slot: seqlock counter, sequence, height, width, channels, padding
+HEADER_FIELDS = 8
+COUNTER, FRAME_SEQUENCE, HEIGHT, WIDTH, CHANNELS = range(5)
+
+
+class FrameRing:
+    """
+    ``slots`` frames of up to ``capacity`` bytes in shared memory.
+
+    The creating side owns the memory and unlinks it in ``close``; the other
+    side attaches with the ``name`` from ``describe()``. ``pid`` is the
+    owner's process, which also attaches when aim assist runs as a thread.
+    """
+
+    def __init__(
+        self, name=None, slots=4, capacity=1280 * 720 * 3, create=False, pid=None
+    ):
+        self.slots = slots
+        self.capacity = capacity
+        self.owner = create
+        self.pid = os.getpid() if create else pid
+        header_size = slots * HEADER_FIELDS * 8
+        # The resource tracker would unlink the owner's memory when another
+        # process attached to it exits. Within the owner's process the
+        # registration is the owner's, which its unlink removes.
+        track = create or self.pid == os.getpid()
+        if track or sys.version_info < (3, 13):
+            self.shm = shared_memory.SharedMemory(
+                name=name, create=create, size=header_size + slots * capacity
+            )
+            if not track:
+                resource_tracker.unregister(self.shm._name, "shared_memory")
+        else:
+            self.shm = shared_memory.SharedMemory(
+                name=name, size=header_size + slots * capacity, track=False
+            )
+
+        self.headers = np.ndarray(
+            (slots, HEADER_FIELDS), dtype=np.uint64, buffer=self.shm.buf
+        )
+        self.data = np.ndarray(
+            (slots, capacity), dtype=np.uint8, buffer=self.shm.buf, offset=header_size
+        )
+        if create:
+            self.headers[:] = 0
+        self.sequence = 0
+
+    @classmethod
+    def attach(cls, description):
+        return cls(
+            description["name"],
+            description["slots"],
+            description["capacity"],
+            pid=description["pid"],
+        )
+
+    def describe(self):
+        return {
+            "name": self.shm.name,
+            "slots": self.slots,
+            "capacity": self.capacity,
+            "pid": self.pid,
+        }
+
+    def begin_write(self, shape, sequence=None):
+        """
+        Start writing a frame of ``shape`` (height, width, channels) and return
+        ``(sequence, view)``; the view has to be filled before ``commit``.
+        """
+        height, width, channels = shape
+        if height * width * channels > self.capacity:
+            raise ValueError(f"Frame {shape} does not fit in {self.capacity} bytes")
+        if sequence is None:
+            sequence = self.sequence + 1
+        self.sequence = sequence
+
+        header = self.headers[sequence % self.slots]
+        header[COUNTER] += 1  # odd: being written
+        header[FRAME_SEQUENCE] = sequence
+        header[HEIGHT], header[WIDTH], header[CHANNELS] = shape
+        view = self.data[sequence % self.slots, : height * width * channels]
+        return sequence, view.reshape(shape)
+
+    def commit(self, sequence):
+        self.headers[sequence % self.slots, COUNTER] += 1  # even: complete
+
+    def abort(self, sequence):
+        """Give up on a frame started with ``begin_write``."""
+        header = self.headers[sequence % self.slots]
+        header[FRAME_SEQUENCE] = 0
+        header[COUNTER] += 1
+
+    def write(self, image, sequence=None):
+        sequence, view = self.begin_write(image.shape, sequence)
+        np.copyto(view, image)
+        self.commit(sequence)
+        return sequence
+
+    def read(self, sequence):
+        """
+        View of frame ``sequence`` and a token for ``valid``, or
+        ``(None, None)`` when the slot holds something else by now.
+
+        The view is not a copy; check ``valid`` once done with it.
+        """
+        header = self.headers[sequence % self.slots]
+        token = int(header[COUNTER])
+        if token % 2 or header[FRAME_SEQUENCE] != sequence:
+            return None, None
+
+        shape = tuple(int(value) for value in header[HEIGHT : CHANNELS + 1])
+        view = self.data[sequence % self.slots, : shape[0] * shape[1] * shape[2]]
+        return view.reshape(shape), token
+
+    def valid(self, sequence, token):
+        """Whether frame ``sequence`` was left alone since ``read``."""
+        return self.headers[sequence % self.slots, COUNTER] == token
+
+    def close(self):
+        # Views into the buffer have to go before the memory can be closed
+        self.headers = self.data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def pack_message(message_type, payload):
+    return MESSAGE_HEADER.pack(message_type, len(payload)) + payload
+
+
+def attach_message(frames):
+    payload = json.dumps({"frames": frames.describe()})
+    return pack_message(MESSAGE_ATTACH, payload.encode())
+
+
+def frame_message(sequence):
+    return pack_message(MESSAGE_FRAME, SEQUENCE.pack(sequence))
+
+
+def result_message(result):
+    return pack_message(MESSAGE_RESULT, json.dumps(result).encode())
+
+
+def ready_message(startup):
+    return pack_message(MESSAGE_READY, json.dumps(startup).encode())
+
+
+def read_exactly(sock, size):
+    data = b""
+    while len(data) < size:
+        packet = sock.recv(size - len(data))
+        if not packet:
+            raise ConnectionError("Control socket closed")
+        data += packet
+    return data
+
+
+def read_message(sock):
+    """Blocking ``receive_message``."""
+    message_type, length = MESSAGE_HEADER.unpack(
+        read_exactly(sock, MESSAGE_HEADER.size)
+    )
+    return message_type, read_exactly(sock, length)
+
+
+def connect_to_aim_assist(port=65432, timeout=60, alive=None):
+    """
+    Connect to aim assist once it listens and wait for its ready message.
+
+    Aim assist only listens once its model is loaded and warmed up, so the
+    connection is retried until then. ``alive`` tells whether aim assist is
+    still starting, to fail early instead of at the ``timeout``.
+
+    Returns
+    -------
+    tuple
+        ``(socket, startup)``, the connected blocking socket and the start-up
+        times aim assist reported.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            sock = socket.create_connection(("localhost", port), timeout=timeout)
+            break
+        except ConnectionRefusedError:
+            if alive is not None and not alive():
+                raise RuntimeError("Aim assist stopped before it was ready")
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Aim assist not ready after {timeout} s")
+            time.sleep(0.02)
+
+    message_type, payload = read_message(sock)
+    if message_type != MESSAGE_READY:
+        sock.close()
+        raise ConnectionError(f"Expected a ready message, got type {message_type}")
+    sock.settimeout(None)
+    return sock, json.loads(payload)
+
+
+async def receive_exactly(loop, sock, size):
+    data = b""
+    while len(data) < size:
+        packet = await loop.sock_recv(sock, size - len(data))
+        if not packet:
+            raise ConnectionError("Control socket closed")
+        data += packet
+    return data
+
+
+async def receive_message(loop, sock):
+    """The next ``(type, payload)`` from the control socket."""
+    message_type, length = MESSAGE_HEADER.unpack(
+        await receive_exactly(loop, sock, MESSAGE_HEADER.size)
+    )
+    return message_type, await receive_exactly(loop, sock, length)
@@ -1,11 +1,50 @@
+import threading
+from time import perf_counter
+
 import pygame
-from pynput import keyboard
 
 
-class KeyboardController:
+class InputController:
+    """
+    Base for the input controllers.
+
+    Once started with an event loop and a queue, a controller pushes
+    ``(timestamp, (x, y, speed, weapon_speed))`` into the queue every time the
+    input changes. The timestamp is ``perf_counter()`` at the moment the change
+    was read from the device.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.events = None
+        self.last_input = None
+
+    def attach(self, loop, events):
+        self.loop = loop
+        self.events = events
+
+    def publish(self, state):
+        if state == self.last_input:
+            return
+        self.last_input = state
+
+        if self.events is not None:
+            # Called from the device thread, hand the event to the asyncio loop
+            self.loop.call_soon_threadsafe(
+                self.events.put_nowait, (perf_counter(), state)
+            )
+
+
+class KeyboardController(InputController):
     def __init__(self):
+        super().__init__()
         self.key_flags = {"w": False, "s": False, "a": False, "d": False}
         self.active_keys = []
+
+        # pynput needs a display, so it is only imported when the keyboard is
+        # used
+        from pynput import keyboard
+
         self.listener = keyboard.Listener(
             on_press=self.on_press, on_release=self.on_release
         )
@@ -16,6 +55,7 @@ class KeyboardController:
             if key in self.key_flags and not self.key_flags[key]:
                 self.key_flags[key] = True
                 self.active_keys.append(key)
+                self.publish(self.get_input())
         except AttributeError:
             pass
 
@@ -26,6 +66,7 @@ class KeyboardController:
                 self.key_flags[key] = False
                 if key in self.active_keys:
                     self.active_keys.remove(key)
+                self.publish(self.get_input())
         except AttributeError:
             pass
 
@@ -33,6 +74,7 @@ class KeyboardController:
         x = 0
         y = 0
         speed = 1
+        weapon_speed = 0
 
         # Process vertical keys
         for key in self.active_keys:
@@ -52,14 +94,30 @@ class KeyboardController:
                 x = 1
                 break
 
-        return x, y, speed
+        return x, y, speed, weapon_speed
 
-    def start(self):
+    def start(self, loop=None, events=None):
+        if events is not None:
+            self.attach(loop, events)
         self.listener.start()
 
 
-class JoystickController:
+class JoystickController(InputController):
+    JOYSTICK_EVENTS = (
+        pygame.JOYAXISMOTION,
+        pygame.JOYBUTTONDOWN,
+        pygame.JOYBUTTONUP,
+        pygame.JOYHATMOTION,
+    )
+
     def __init__(self):
+        super().__init__()
+        self.joystick = None
+        self.listener = None
+        self.running = False
+
+    def init_joystick(self):
+        # SDL events have to be read on the thread that initialised pygame
         pygame.init()
         pygame.joystick.init()  # Initialize the joystick module
         self.joystick = pygame.joystick.Joystick(0)  # Initialize the first joystick
@@ -129,11 +187,50 @@ class JoystickController:
         return x_axis, y_axis, speed, weapon_speed
 
     def get_input(self):
+        if self.joystick is None:
+            self.init_joystick()
         x, y, speed, weapon_speed = self.get_joystick_position_and_speed()
         return x, y, speed, weapon_speed
 
-    def start(self):
-        pass
+    def start(self, loop=None, events=None):
+        if events is None:
+            return  # polled through get_input
+
+        self.attach(loop, events)
+        self.running = True
+        ready = threading.Event()
+        errors = []
+        self.listener = threading.Thread(
+            target=self.listen, args=(ready, errors), daemon=True
+        )
+        self.listener.start()
+        ready.wait()
+        if errors:
+            raise errors[0]
+
+    def listen(self, ready, errors):
+        try:
+            self.init_joystick()
+            self.publish(self.get_joystick_position_and_speed())
+        except Exception as e:
+            errors.append(e)
+            return
+        finally:
+            ready.set()
+
+        while self.running:
+            # Block until the joystick moves instead of polling it
+            event = pygame.event.wait(100)
+            if event.type == pygame.NOEVENT:
+                continue
+
+            # Several axis events usually arrive together, read the state once
+            events = [event] + pygame.event.get()
+            if any(e.type in self.JOYSTICK_EVENTS for e in events):
+                self.publish(self.get_joystick_position_and_speed())
 
     def close(self):
+        self.running = False
+        if self.listener is not None:
+            self.listener.join()
         pygame.quit()
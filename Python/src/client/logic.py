@@ -1,17 +1,36 @@
 import asyncio
 import sys
 import threading
+from time import perf_counter
 
 from src.client.communications import WebRTCClient, WebSocketClient
 from src.client.inputs import JoystickController, KeyboardController
 
 
 class ApplicationController:
-    def __init__(self, uri, communication_type, gui):
+    """
+    Forward stick changes to the bot.
+
+    Input changes are sent as soon as they arrive, but at most ``max_send_rate``
+    times per second; changes in between are coalesced into the newest one.
+    When nothing changes the last input is repeated every
+    ``keepalive_interval`` seconds.
+    """
+
+    def __init__(
+        self,
+        uri,
+        communication_type,
+        gui,
+        max_send_rate=100,
+        keepalive_interval=0.5,
+    ):
         self.communication_type = communication_type
         self.gui = gui
+        self.min_send_interval = 1 / max_send_rate
+        self.keepalive_interval = keepalive_interval
 
-        self.old_data = ""
+        self.input_latencies = []
 
         self.get_control_input()
         self.set_net_client(uri)
@@ -54,19 +73,46 @@ class ApplicationController:
 
         print("Connected to the server.")
 
-        self.controller.start()
+        await self.forward_input()
+
+    async def forward_input(self):
+        events = asyncio.Queue()
+        self.controller.start(asyncio.get_running_loop(), events)
+
+        state = None
+        last_send = 0
         while True:
-            x, y, speed, weapon_speed = self.controller.get_input()
+            try:
+                timestamp, state = await asyncio.wait_for(
+                    events.get(), self.keepalive_interval
+                )
+            except asyncio.TimeoutError:
+                if state is None:
+                    continue
+                timestamp = None  # keepalive, resend the last input
+
+            # Respect the max send rate, newer input replaces older input
+            delay = self.min_send_interval - (perf_counter() - last_send)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            while not events.empty():
+                timestamp, state = events.get_nowait()
+
+            x, y, speed, weapon_speed = state
 
             # x = self.fly_by_wire.get_aim_assist(x)
 
-            data = f"{x}, {y}, {speed}, {weapon_speed}"
+            await self.net_client.send_command(
+                {"x": x, "y": y, "speed": speed, "weapon_speed": weapon_speed}
+            )
+            last_send = perf_counter()
+            if timestamp is not None:
+                self.record_input_latency(last_send - timestamp)
 
-            if self.old_data != data:
-                print(f"Sending data: {x}, {y}, {speed}, {weapon_speed}")
+    def record_input_latency(self, latency):
+        self.input_latencies.append(latency * 1000)
 
-                await self.net_client.send_command(
-                    {"x": x, "y": y, "speed": speed, "weapon_speed": weapon_speed}
-                )
-                self.old_data = data
-            await asyncio.sleep(0.01)
+        if len(self.input_latencies) == 50:
+            average = sum(self.input_latencies) / 50
+            print(f"Average input to send latency in ms: {average}")
+            self.input_latencies.clear()
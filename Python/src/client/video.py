@@ -1,35 +1,193 @@
 import asyncio
-import socket
-import struct
+import json
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
 
 import cv2
 import numpy as np
 from aiortc import VideoStreamTrack
 from av import VideoFrame
+from av.video.reformatter import VideoReformatter
+from src.client.frame_ring import (
+    MESSAGE_RESULT,
+    FrameRing,
+    attach_message,
+    connect_to_aim_assist,
+    frame_message,
+    receive_message,
+)
 
 print("Video module loaded.")
 
 
+def stereo_eye(frame, stereo, index):
+    """View of one camera's image in a packed stereo frame."""
+    height, width = frame.shape[:2]
+    if stereo == "side_by_side":
+        return frame[:, index * width // 2 : (index + 1) * width // 2]
+    if stereo == "top_bottom":
+        return frame[index * height // 2 : (index + 1) * height // 2]
+    return frame
+
+
+def draw_aim_overlay(image, result):
+    """
+    Draw aim assist's ``result`` onto ``image`` in place: the box, red while
+    detected and green while tracked, and a red bar on the side the target is
+    on that gets stronger the further it is off centre.
+    """
+    if result is None or result["box"] is None:
+        return
+    x, y, w, h = result["box"]
+    color = (0, 255, 0) if result["state"] == "tracking" else (0, 0, 255)
+    cv2.rectangle(image, (x, y), (x + w, y + h), color, 2)
+
+    ratio = result["position_ratio"]
+    roi_width = int(image.shape[1] * 0.05)
+    side = slice(None, roi_width) if ratio < 0.5 else slice(-roi_width, None)
+    red = int(255 * abs(ratio - 0.5))
+    channel = image[:, side, 2]
+    np.minimum(channel, 255 - red, out=channel)  # saturate instead of wrapping
+    channel += red
+
+
+class FramePreprocessor:
+    """
+    Turn a received frame into the first camera's RGB image at ``scale`` of
+    the frame size, the way aim assist gets it.
+
+    A mono frame is converted by OpenCV into a reused full-size array and
+    scaled straight into the output, then flipped in place; both are
+    multithreaded. A packed stereo frame is converted and scaled in one
+    swscale pass so the first eye comes out at the final size, which beats
+    converting both eyes, and is then only sliced and flipped or copied into
+    the output. The output is ``out``, or one of ``buffers`` preallocated
+    arrays reused in turn, so a returned image is valid until ``buffers``
+    more frames have been processed.
+    """
+
+    STAGES = ("reformat", "copy", "total")
+
+    def __init__(self, scale=0.5, buffers=2):
+        self.scale = scale
+        self.reformatter = VideoReformatter()
+        self.buffers = [None] * buffers
+        self.index = 0
+        self.converted = None
+        self.timings = {stage: deque(maxlen=100) for stage in self.STAGES}
+
+    def output_size(self, frame):
+        """The size of the image ``process`` returns for ``frame``."""
+        return round(frame.width * self.scale), round(frame.height * self.scale)
+
+    def buffer(self, shape):
+        self.index = (self.index + 1) % len(self.buffers)
+        if self.buffers[self.index] is None or self.buffers[self.index].shape != shape:
+            self.buffers[self.index] = np.empty(shape, dtype=np.uint8)
+        return self.buffers[self.index]
+
+    def process(self, frame, stereo="mono", rotation=0, out=None):
+        start = perf_counter()
+
+        width, height = self.output_size(frame)
+        if stereo == "mono":
+            if out is None:
+                out = self.buffer((height, width, 3))
+            shape = frame.height, frame.width, 3
+            if self.converted is None or self.converted.shape != shape:
+                self.converted = np.empty(shape, dtype=np.uint8)
+            yuv = frame.to_ndarray(format="yuv420p")
+            cv2.cvtColor(yuv, cv2.COLOR_YUV2RGB_I420, dst=self.converted)
+            cv2.resize(
+                self.converted, (width, height), dst=out, interpolation=cv2.INTER_AREA
+            )
+            reformatted = perf_counter()
+            if rotation == 180:
+                cv2.flip(out, -1, dst=out)
+        else:
+            # Scale the whole frame so that one eye ends up width x height
+            if stereo == "side_by_side":
+                scaled_size = width * 2, height
+            else:
+                scaled_size = width, height * 2
+            scaled = self.reformatter.reformat(
+                frame, *scaled_size, format="rgb24", interpolation="AREA"
+            )
+            img_rgb = stereo_eye(scaled.to_ndarray(), stereo, 0)
+            reformatted = perf_counter()
+
+            if rotation == 180:
+                if out is None:
+                    out = self.buffer(img_rgb.shape)
+                cv2.flip(img_rgb, -1, dst=out)
+            elif out is not None:
+                np.copyto(out, img_rgb)
+            else:
+                out = img_rgb  # a view of the reformatted frame, nothing to copy
+        done = perf_counter()
+
+        self.timings["reformat"].append((reformatted - start) * 1000)
+        self.timings["copy"].append((done - reformatted) * 1000)
+        self.timings["total"].append((done - start) * 1000)
+        return out
+
+    def stats(self):
+        """Mean time of every stage over the last 100 frames, in ms."""
+        return {
+            stage: round(sum(times) / len(times), 3) if times else None
+            for stage, times in self.timings.items()
+        }
+
+
 class VideoWindow:
     print("VideoWindow class loaded.")
 
-    def __init__(self, window_name="Video"):
+    def __init__(
+        self,
+        window_name="Video",
+        rotation=180,
+        aim_assist_port=65432,
+        aim_assist_alive=None,
+    ):
         self.window_name = window_name
+        # Degrees to rotate the received frames by, until the server says
+        # otherwise
+        self.rotation = rotation
         self.win_error = False
         self.depth_map = False
         self.pre_frame_queue = asyncio.Queue()
         self.post_frame_queue = asyncio.Queue()
         self.frame_count = 0
         self.start_time = time.time()
-        self.last_frame2 = None
-        self.width = 1280
-
-        self.init_socket()
-
-    def init_socket(self):
-        self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.client_socket.connect(("localhost", 65432))
+        self.stereo = "mono"
+        # Newest frame of the second camera's track, shown beside the main one
+        self.side_frame = None
+        # Preprocessing runs on its own thread, off the event loop
+        self.preprocessor = FramePreprocessor(scale=0.5)
+        self.preprocess_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="preprocess"
+        )
+        # Frames to aim assist in shared memory, it only sends back what it
+        # found. One frame at a time is with aim assist, always the newest.
+        self.frame_ring = FrameRing(create=True)
+        self.aim_result = None
+        self.aim_assist_busy = False
+        self.aim_results = 0
+        self.display_buffer = None
+
+        self.init_socket(aim_assist_port, aim_assist_alive)
+
+    def init_socket(self, port=65432, alive=None):
+        # Waits until aim assist has its model loaded and warmed up
+        start = perf_counter()
+        self.client_socket, startup = connect_to_aim_assist(port, alive=alive)
+        print(
+            f"Aim assist ready after waiting {perf_counter() - start:.2f} s, "
+            f"its start-up: {startup}"
+        )
+        self.client_socket.sendall(attach_message(self.frame_ring))
         self.client_socket.setblocking(False)
 
     async def add_frame_queue(self, frame):
@@ -50,31 +208,55 @@ class VideoWindow:
             if not self.pre_frame_queue.empty():
                 continue
 
-            img_yuv = frame.to_ndarray(format="yuv420p")
-            img_rgb = cv2.cvtColor(img_yuv, cv2.COLOR_YUV2RGB_I420)
-
-            img_rgb = img_rgb[:, : self.width]
-            if img_rgb.shape[1] == self.width * 2:
-                frame2 = img_rgb[:, self.width :]
-                self.last_frame2 = frame2
-            elif self.last_frame2 is not None:
-                img_rgb = np.hstack((img_rgb, self.last_frame2))
-
-            img_rgb_flipped = cv2.flip(img_rgb, -1)
-
-            scale_percent = 50  # percent of original size
-            width = int(img_rgb.shape[1] * scale_percent / 100)
-            height = int(img_rgb.shape[0] * scale_percent / 100)
-            dim = (width, height)
-            img_rgb = cv2.resize(img_rgb_flipped, dim, interpolation=cv2.INTER_AREA)
-
-            # Send frame to the socket
-            await self.send_frame_to_socket(img_rgb)
-
-            # Receive processed frame from the socket
-            processed_frame = await self.receive_frame_from_socket()
-
-            await self.post_frame_queue.put(processed_frame)
+            # The size of the packed frame never changes, the first camera is
+            # the one that is shown, at half the size of the packed frame.
+            # It is written straight into the next slot of the frame ring.
+            width, height = self.preprocessor.output_size(frame)
+            sequence, slot = self.frame_ring.begin_write((height, width, 3))
+            try:
+                await asyncio.get_running_loop().run_in_executor(
+                    self.preprocess_executor,
+                    self.preprocessor.process,
+                    frame,
+                    self.stereo,
+                    self.rotation,
+                    slot,
+                )
+            except Exception as e:
+                # Otherwise the slot would stay marked as being written
+                self.frame_ring.abort(sequence)
+                print(f"Error preprocessing a frame: {e}")
+                continue
+            self.frame_ring.commit(sequence)
+
+            self.frame_count += 1
+            if self.frame_count % 100 == 0:
+                elapsed = time.time() - self.start_time
+                print(f"Preprocessing in ms: {self.preprocessor.stats()}")
+                print(
+                    f"Display {self.frame_count / elapsed:.1f} fps, "
+                    f"aim assist {self.aim_results / elapsed:.1f} fps"
+                )
+
+            # Only the sequence number goes over the socket. The display does
+            # not wait for aim assist, it draws the newest result it has.
+            if not self.aim_assist_busy:
+                self.aim_assist_busy = True
+                await self.send_frame_to_socket(sequence)
+
+            await self.post_frame_queue.put(sequence)
+
+    async def receive_results(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            message_type, payload = await receive_message(loop, self.client_socket)
+            if message_type != MESSAGE_RESULT:
+                continue
+            result = json.loads(payload)
+            self.aim_assist_busy = False
+            if result["state"] != "dropped":
+                self.aim_result = result
+                self.aim_results += 1
 
     async def display_frame(self):
         print("       Displaying frame.")
@@ -82,39 +264,47 @@ class VideoWindow:
         Display the video frame inside of a window.
         """
         while True:
-            frame = await self.post_frame_queue.get()
+            sequence = await self.post_frame_queue.get()
+            if not self.post_frame_queue.empty():
+                continue
+            frame, token = self.frame_ring.read(sequence)
+            if frame is None:
+                continue
 
-            # Display the image in a separate thread
-            cv2.imshow(self.window_name, frame)
+            # Aim assist may still be reading the ring, draw on a copy
+            if self.display_buffer is None or self.display_buffer.shape != frame.shape:
+                self.display_buffer = np.empty_like(frame)
+            np.copyto(self.display_buffer, frame)
+            if not self.frame_ring.valid(sequence, token):
+                continue
+            draw_aim_overlay(self.display_buffer, self.aim_result)
 
-            if cv2.waitKey(1) & 0xFF == ord("q"):
+            if self.show(self.display_buffer):
                 return True  # Indicate that the window should close
 
-    async def send_frame_to_socket(self, frame):
-        encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), 90]
-        result, encoded_frame = cv2.imencode(".jpg", frame, encode_param)
-        data = encoded_frame.tobytes()
-        frame_length = struct.pack("!I", len(data))
-        loop = asyncio.get_event_loop()
-        await loop.sock_sendall(self.client_socket, frame_length + data)
+    def show(self, frame):
+        """Show ``frame``, True when the window should close."""
+        # Display the image in a separate thread
+        cv2.imshow(self.window_name, frame)
+        self.display_side_frame()
+
+        return cv2.waitKey(1) & 0xFF == ord("q")
+
+    def display_side_frame(self):
+        if self.side_frame is None:
+            return
+        frame, self.side_frame = self.side_frame, None
 
-    async def receive_frame_from_socket(self):
+        img = frame.to_ndarray(format="bgr24")
+        if self.rotation == 180:
+            img = cv2.flip(img, -1)
+        height, width = img.shape[:2]
+        img = cv2.resize(img, (width // 2, height // 2), interpolation=cv2.INTER_AREA)
+        cv2.imshow(f"{self.window_name} camera 2", img)
+
+    async def send_frame_to_socket(self, sequence):
         loop = asyncio.get_event_loop()
-        data = await loop.sock_recv(self.client_socket, 4)
-        if not data:
-            return None
-        frame_length = struct.unpack("!I", data)[0]
-        frame_data = b""
-        while len(frame_data) < frame_length:
-            packet = await loop.sock_recv(
-                self.client_socket, frame_length - len(frame_data)
-            )
-            if not packet:
-                break
-            frame_data += packet
-        np_frame = np.frombuffer(frame_data, dtype=np.uint8)
-        frame = cv2.imdecode(np_frame, cv2.IMREAD_COLOR)
-        return frame
+        await loop.sock_sendall(self.client_socket, frame_message(sequence))
 
     def _get_system_metrics(self):
         print("       _get_system_metrics function loaded.")
@@ -136,6 +326,9 @@ class VideoWindow:
         Close the video window.
         """
         cv2.destroyWindow(self.window_name)
+        self.preprocess_executor.shutdown(wait=False)
+        self.client_socket.close()
+        self.frame_ring.close()
 
     async def start(self):
         print("     Starting video display 1.")
@@ -146,7 +339,9 @@ class VideoWindow:
 
         print("       Video window created.")
         # start the process_frames coroutine
-        tasks = asyncio.gather(self.process_frames(), self.display_frame())
+        tasks = asyncio.gather(
+            self.process_frames(), self.display_frame(), self.receive_results()
+        )
         print("       Process frames and display frame tasks started.")
 
         # start the tasks
@@ -156,8 +351,15 @@ class VideoWindow:
 class DisplayFrame:
     print("DisplayFrame class loaded.")
 
-    def __init__(self, window_name="Video"):
-        self.video_window = VideoWindow(window_name)
+    def __init__(self, window_name="Video", rotation=180, aim_assist_alive=None):
+        self.video_window = VideoWindow(
+            window_name, rotation, aim_assist_alive=aim_assist_alive
+        )
+
+    def set_video_config(self, config):
+        """Apply the video settings the server sent over the data channel."""
+        self.video_window.rotation = config.get("rotation", 180)
+        self.video_window.stereo = config.get("stereo", "mono")
 
     async def send_frame(self, frame):
         # print("     Sending frame to video window.")
@@ -168,6 +370,10 @@ class DisplayFrame:
         if should_close:
             print("Quitting video display.")
 
+    async def send_side_frame(self, frame):
+        """Show a frame of the second camera, replacing one not shown yet."""
+        self.video_window.side_frame = frame
+
     async def send_frame_threadsafe(self, frame):
         await self.video_window.add_frame_queue(frame)
 
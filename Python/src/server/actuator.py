@@ -0,0 +1,96 @@
+import threading
+
+
+class ActuatorThread:
+    """
+    Apply motor setpoints on a dedicated thread.
+
+    The thread owns the MotorController, so gpiod and sysfs calls never run
+    on the asyncio loop that also carries the WebRTC traffic. ``action`` and
+    ``stop`` have the same signature as on MotorController but only publish:
+    the newest action goes into a single slot and older ones that were not
+    applied yet are skipped. A stop is not part of the slot. It stays pending
+    until ``MotorController.stop`` has run, and actions published before
+    then are dropped, so a late motion packet cannot undo the failsafe.
+    """
+
+    def __init__(self, motor_controller):
+        self.motor_controller = motor_controller
+        # (generation, request); replaced as a whole, which is atomic
+        self.slot = (0, None)
+        self.stops_requested = 0
+        self.wakeup = threading.Event()
+        self.running = False
+        self.thread = None
+        self.published = 0
+        self.applied = 0
+        self.errors = 0
+
+    def action(self, x, y, speed, weapon_speed):
+        self.publish((x, y, speed, weapon_speed))
+
+    def stop(self):
+        self.published += 1
+        self.stops_requested += 1
+        self.wakeup.set()
+
+    def publish(self, request):
+        self.published += 1
+        self.slot = (self.published, request)
+        self.wakeup.set()
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        applied_generation = 0
+        stops_applied = 0
+        while self.running:
+            self.wakeup.wait()
+            self.wakeup.clear()
+
+            stops_requested = self.stops_requested
+            generation, request = self.slot
+            if stops_requested != stops_applied:
+                try:
+                    self.motor_controller.stop()
+                except Exception as e:
+                    # Still pending, tried again before the next action
+                    print(f"Error stopping the motors: {e}")
+                    continue
+                stops_applied = stops_requested
+                applied_generation = generation
+                self.applied += 1
+                continue
+
+            if generation == applied_generation:
+                continue
+            applied_generation = generation
+
+            try:
+                self.motor_controller.action(*request)
+                self.applied += 1
+            except Exception as e:
+                self.errors += 1
+                print(f"Error applying setpoint {request}: {e}")
+
+    def stats(self):
+        return {
+            "published": self.published,
+            "applied": self.applied,
+            "skipped": self.published - self.applied - self.errors,
+            "errors": self.errors,
+        }
+
+    def cleanup(self):
+        self.running = False
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        print(f"Actuator: {self.stats()}")
+        self.motor_controller.cleanup()
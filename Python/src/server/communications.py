@@ -2,45 +2,85 @@ import asyncio
 import json
 import socket
 import traceback
+from collections import deque
+from time import perf_counter
 
 import websockets
 from aiortc import RTCPeerConnection, RTCSessionDescription
-
-from .video import Camera, CameraStreamTrack
+from src.shared.clock_sync import ClockSync, percentile
+from src.shared.protocol import (
+    MOTION_CHANNEL_LABEL,
+    MotionCommand,
+    SequenceFilter,
+    decode_message,
+)
 
 
 class MotorWebSocketServer:
-    def __init__(self, motor_controller, host, port):
+    """
+    WebSocket control server.
+
+    JSON commands get a status reply each (stop-and-wait clients). Binary
+    motion packets from pipelined clients are not answered one by one; instead
+    a cumulative ack with the last applied sequence number is sent at most
+    every ``ack_interval`` seconds.
+    """
+
+    def __init__(self, motor_controller, host, port, ack_interval=0.02):
         self.motor_controller = motor_controller
         self.host = host
         self.port = port
+        self.ack_interval = ack_interval
 
     async def handle_client(self, websocket, path):
-        async for message in websocket:
-            try:
-                command = json.loads(message)
-                if "action" in command and "value" in command:
-                    self.motor_controller.action(command["action"], command["value"])
-                    await websocket.send(json.dumps({"status": "success"}))
-                else:
-                    await websocket.send(
-                        json.dumps(
-                            {"status": "error", "message": "Invalid command format"}
-                        )
+        sequence_filter = SequenceFilter()
+        ack_task = asyncio.create_task(self.send_acks(websocket, sequence_filter))
+
+        try:
+            async for message in websocket:
+                await self.handle_message(websocket, message, sequence_filter)
+        finally:
+            ack_task.cancel()
+
+            # Stop the motor controller when the connection is lost
+            self.motor_controller.stop()
+
+    async def handle_message(self, websocket, message, sequence_filter):
+        try:
+            command = decode_message(message)
+            if isinstance(command, MotionCommand):
+                if sequence_filter.accept(command.sequence):
+                    self.motor_controller.action(
+                        command.x, command.y, command.speed, command.weapon_speed
                     )
-            except Exception as e:
+                if command.sequence is None:
+                    await websocket.send(json.dumps({"status": "success"}))
+            elif isinstance(command, dict) and "ping" in command:
                 await websocket.send(
-                    json.dumps(
-                        {
-                            "status": "error",
-                            "message": str(e),
-                            "traceback": traceback.format_exc(),
-                        }
-                    )
+                    json.dumps(ClockSync.pong_message(command, perf_counter()))
+                )
+            else:
+                await websocket.send(
+                    json.dumps({"status": "error", "message": "Invalid command format"})
                 )
+        except Exception as e:
+            await websocket.send(
+                json.dumps(
+                    {
+                        "status": "error",
+                        "message": str(e),
+                        "traceback": traceback.format_exc(),
+                    }
+                )
+            )
 
-        # Stop the motor controller when the connection is lost
-        await self.motor_controller.stop()
+    async def send_acks(self, websocket, sequence_filter):
+        last_acked = None
+        while True:
+            await asyncio.sleep(self.ack_interval)
+            if sequence_filter.last_sequence != last_acked:
+                last_acked = sequence_filter.last_sequence
+                await websocket.send(json.dumps({"ack": last_acked}))
 
     def print_server_info(self):
         # Determine the actual IP when the server is bound to '0.0.0.0'
@@ -66,23 +106,44 @@ class MotorWebSocketServer:
 
 
 class MotorWebRTCClient:
-    def __init__(self, motor_controller, battlebot_name, camera_source):
+    def __init__(
+        self,
+        motor_controller,
+        battlebot_name,
+        camera_source,
+        ping_interval=1.0,
+        signaling_url=None,
+        camera2_bitrate=500_000,
+    ):
         self.motor_controller = motor_controller
         self.battlebot_name = battlebot_name
+        self.signaling_url = (
+            signaling_url
+            or f"wss://butrosgroot.com/ws/battle_bot/signal/{battlebot_name}/"
+        )
         self.camera_source = camera_source  # Camera source for video streaming
         self.pc = RTCPeerConnection()
         self.websocket = None
+        # Only the WebRTC client streams video, the WebSocket server runs
+        # without picamera2
+        from .video import Camera
+
         self.camera = Camera()
+        self.camera2_bitrate = camera2_bitrate  # bits/s cap of the second track
         self.data_channel = None  # Initialize data_channel attribute
+        self.motion_channel = None
+        self.sequence_filter = SequenceFilter()
+        self.ping_interval = ping_interval
+        self.ping_task = None
+        self.clock = ClockSync()
+        self.command_latencies = deque(maxlen=1000)  # one-way, in ms
 
         # Set up event listener for data channel as soon as the peer connection
         # is created
         self.pc.on("datachannel", self.on_data_channel)
 
     async def connect_to_signal_server(self):
-        self.ws_url = (
-            f"wss://butrosgroot.com/ws/battle_bot/signal/{self.battlebot_name}/"
-        )
+        self.ws_url = self.signaling_url
         print(f"Connecting to signaling server at {self.ws_url}")
         self.websocket = await websockets.connect(self.ws_url)
         print("Connected to signaling server.")
@@ -109,9 +170,10 @@ class MotorWebRTCClient:
         if description.type == "offer":
             # Check if a camera is available and add video track if it is
             if self.camera.is_camera_available():
-                print("Camera found, adding video track.")
                 self.camera.start()
-                self.pc.addTrack(CameraStreamTrack(self.camera))
+                for track in self.camera_tracks():
+                    print(f"Camera found, adding video track {track.name}.")
+                    track.sender = self.pc.addTrack(track)
             else:
                 print("No camera found, proceeding without video.")
 
@@ -125,29 +187,94 @@ class MotorWebRTCClient:
                 )
             )
 
+    def camera_tracks(self):
+        """
+        One track per camera with the ``"tracks"`` layout, the second at the
+        camera's low frame rate and bitrate, as far as the offer has video
+        transceivers for them.
+        """
+        from .video import CameraStreamTrack
+
+        if self.camera.stereo != "tracks":
+            return [CameraStreamTrack(self.camera)]
+
+        tracks = [
+            CameraStreamTrack(self.camera, eye=0, name="camera1"),
+            CameraStreamTrack(
+                self.camera,
+                eye=1,
+                fps=self.camera.stereo_fps,
+                max_bitrate=self.camera2_bitrate,
+                name="camera2",
+            ),
+        ]
+        # Tracks without a transceiver in the offer would not be in the answer
+        slots = sum(
+            transceiver.kind == "video" for transceiver in self.pc.getTransceivers()
+        )
+        return tracks[: max(slots, 1)]
+
     async def handle_ice(self, data):
         candidate = data["candidate"]
         await self.pc.addIceCandidate(candidate)
 
     async def on_data_channel(self, event):
-        print("Data channel event triggered")
+        print(f"Data channel event triggered: {event.label}")
+        if event.label == MOTION_CHANNEL_LABEL:
+            self.motion_channel = event
+            self.motion_channel.on("message", self.on_data_channel_message)
+            return
+
         self.data_channel = event
         self.data_channel.on("open", self.on_data_channel_open)
         self.data_channel.on("message", self.on_data_channel_message)
         self.pc.on("statechange", self.on_ice_connection_state_change)
+        if self.data_channel.readyState == "open":
+            await self.on_data_channel_open()
+
+        if self.ping_task is None:
+            self.ping_task = asyncio.create_task(self.ping_timer())
 
     async def on_data_channel_open(self):
         print("Data Channel is open")
+        # The client needs to know whether the frames are already rotated
+        await self.send_data(self.camera.video_config_message())
 
     async def on_data_channel_message(self, message):
-        data = json.loads(message)
-        if "ping" in data:
-            await self.send_data({"pong": data["ping"]})
-        if "x" in data and "y" in data and "speed" in data and "weapon_speed" in data:
-            print(f"Received data: {data}")
-            self.motor_controller.action(
-                data["x"], data["y"], data["speed"], data["weapon_speed"]
-            )
+        received = perf_counter()
+        try:
+            data = decode_message(message)
+        except ValueError as e:  # ProtocolError or invalid JSON
+            print(f"Dropping invalid message: {e}")
+            return
+
+        if isinstance(data, MotionCommand):
+            # Packets on the unordered channel can overtake each other
+            if not self.sequence_filter.accept(data.sequence):
+                return
+            self.motor_controller.action(data.x, data.y, data.speed, data.weapon_speed)
+
+            if data.timestamp is not None:
+                latency = self.clock.one_way_latency(data.timestamp, received)
+                if latency is not None:
+                    self.command_latencies.append(latency * 1000)
+        elif "ping" in data:
+            await self.send_data(ClockSync.pong_message(data, received))
+        elif "pong" in data:
+            self.clock.add_pong(data, received)
+
+    async def ping_timer(self):
+        pings = 0
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            if self.data_channel and self.data_channel.readyState == "open":
+                await self.send_data(ClockSync.ping_message())
+
+                pings += 1
+                if pings % 10 == 0:
+                    print(f"Clock: {self.clock.stats()}")
+                    latency = percentile(self.command_latencies, 0.50)
+                    print(f"One-way command latency p50: {latency} ms")
 
     async def on_ice_connection_state_change(self, event=None):
         print(f"ICE connection state is {self.pc.iceConnectionState}")
@@ -158,6 +285,12 @@ class MotorWebRTCClient:
         self.motor_controller.stop()
         self.camera.stop()
         print("ICE connection lost, setting up for reconnect...")
+        print(f"Out-of-order motion packets dropped: {self.sequence_filter.dropped}")
+        self.sequence_filter.reset()
+        if self.ping_task is not None:
+            self.ping_task.cancel()
+            self.ping_task = None
+        self.clock = ClockSync()  # the next client has its own clock
         self.pc = RTCPeerConnection()
         self.pc.on("datachannel", self.on_data_channel)
 
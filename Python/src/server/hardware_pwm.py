@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 import os
 import os.path
+from typing import Callable, Optional
 
 
 class HardwarePWMException(Exception):
@@ -36,6 +37,9 @@ class HardwarePWM:
      before changing period
      - /sys/ pwm interface described here:
      https://jumpnowtek.com/rpi/Using-the-Raspberry-Pi-Hardware-PWM-timers.html
+     - The attribute files are kept open and only written when their value
+     changes; `sysfs_root` can point at a fake tree for testing
+     - `on_write` is called with (pwm_dir, name, value) after every write
 
     """
 
@@ -43,17 +47,33 @@ class HardwarePWM:
     _hz: float
     chippath: str = "/sys/class/pwm/pwmchip0"  # mostly here for testing
 
-    def __init__(self, pwm_channel: int, hz: float, chip: int = 0) -> None:
+    def __init__(
+        self,
+        pwm_channel: int,
+        hz: float,
+        chip: int = 0,
+        sysfs_root: str = "/sys/class/pwm",
+        on_write: Optional[Callable[[str, str, int], None]] = None,
+    ) -> None:
 
         if pwm_channel not in {0, 1, 2, 3}:
             raise HardwarePWMException(
                 "Only channel 0 and 1 and 2 and 3 are available on the Rpi."
             )
 
-        self.chippath: str = f"/sys/class/pwm/pwmchip{chip}"
+        self.chippath: str = f"{sysfs_root}/pwmchip{chip}"
         self.pwm_channel = pwm_channel
         self.pwm_dir = f"{self.chippath}/pwm{self.pwm_channel}"
         self._duty_cycle = 0
+        self._hz = None
+        self._period_ns = None
+
+        # The period, duty_cycle and enable files stay open for the lifetime of
+        # the object, together with the last value written to each of them
+        self._fds: dict = {}
+        self._written: dict = {}
+        self.write_count = 0
+        self.on_write = on_write
 
         if not self.is_overlay_loaded():
             raise HardwarePWMException(
@@ -71,6 +91,7 @@ class HardwarePWM:
                 self.change_frequency(hz)
                 break
             except PermissionError:
+                # udev may not have fixed the permissions of the new pwmX yet
                 continue
 
     def is_overlay_loaded(self) -> bool:
@@ -86,16 +107,41 @@ class HardwarePWM:
         with open(file, "w") as f:
             f.write(f"{message}\n")
 
+    def write(self, name: str, value: int) -> None:
+        """
+        Write a value to one of the pwmX attribute files, unless that value is
+        already the last one written.
+        """
+        if self._written.get(name) == value:
+            return
+
+        fd = self._fds.get(name)
+        if fd is None:
+            fd = os.open(os.path.join(self.pwm_dir, name), os.O_WRONLY)
+            self._fds[name] = fd
+
+        os.pwrite(fd, f"{value}\n".encode(), 0)
+        self.write_count += 1
+        self._written[name] = value
+        if self.on_write is not None:
+            self.on_write(self.pwm_dir, name, value)
+
     def create_pwmX(self) -> None:
         self.echo(self.pwm_channel, os.path.join(self.chippath, "export"))
 
     def start(self, initial_duty_cycle: float) -> None:
         self.change_duty_cycle(initial_duty_cycle)
-        self.echo(1, os.path.join(self.pwm_dir, "enable"))
+        self.write("enable", 1)
 
     def stop(self) -> None:
         self.change_duty_cycle(0)
-        self.echo(0, os.path.join(self.pwm_dir, "enable"))
+        self.write("enable", 0)
+
+    def close(self) -> None:
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds.clear()
+        self._written.clear()
 
     def change_duty_cycle(self, duty_cycle: float) -> None:
         """
@@ -108,19 +154,27 @@ class HardwarePWM:
                 "Duty cycle must be between 0 and 100 (inclusive)."
             )
         self._duty_cycle = duty_cycle
-        per = 1 / float(self._hz)
-        per *= 1000  # now in milliseconds
-        per *= 1_000_000  # now in nanoseconds
-        dc = int(per * duty_cycle / 100)
-        self.echo(dc, os.path.join(self.pwm_dir, "duty_cycle"))
+        self.write("duty_cycle", int(self._period_ns * duty_cycle / 100))
 
     def change_frequency(self, hz: float) -> None:
         if hz < 0.1:
             raise HardwarePWMException("Frequency can't be lower than 0.1 on the Rpi.")
 
-        self._hz = hz
+        if hz == self._hz:
+            return
+
+        period_ns = 1_000_000_000 / float(hz)
+        duty_cycle_ns = int(period_ns * self._duty_cycle / 100)
 
-        per = 1 / float(self._hz)
-        per *= 1000  # now in milliseconds
-        per *= 1_000_000  # now in nanoseconds
-        self.echo(int(per), os.path.join(self.pwm_dir, "period"))
+        # The kernel rejects a period shorter than the current duty cycle, so
+        # shrink the duty cycle first when the period gets shorter (or when the
+        # current period is unknown)
+        if self._period_ns is None or period_ns < self._period_ns:
+            self.write("duty_cycle", duty_cycle_ns)
+            self.write("period", int(period_ns))
+        else:
+            self.write("period", int(period_ns))
+            self.write("duty_cycle", duty_cycle_ns)
+
+        self._hz = hz
+        self._period_ns = period_ns
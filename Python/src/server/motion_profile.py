@@ -0,0 +1,182 @@
+import threading
+import time
+
+
+def linear_curve(frequency, max_frequency):
+    """Constant acceleration over the whole speed range."""
+    return 1.0
+
+
+def torque_curve(frequency, max_frequency):
+    """
+    Halve the acceleration towards top speed, where a stepper has the least
+    torque left.
+    """
+    return 1.0 - 0.5 * min(abs(frequency) / max_frequency, 1.0)
+
+
+ACCELERATION_CURVES = {"linear": linear_curve, "torque": torque_curve}
+
+
+class RampScheduler:
+    """
+    Ramp the step frequency of each motor towards its target at a fixed rate.
+
+    ``set_target`` only stores the newest signed target frequency (negative is
+    backward); a background thread moves the applied frequency towards it every
+    tick, limited by the motor's max acceleration in Hz per second. A reversal
+    first ramps down to zero, where the direction line is switched. Below
+    ``start_frequency`` a stepper can start and stop without ramping, so that
+    part of the range is skipped.
+
+    If applying a tick fails, the motors are stopped and the thread ends;
+    ``set_target`` then raises instead of storing targets nobody applies,
+    until the scheduler is started again.
+
+    Parameters
+    ----------
+    motor_controller : MotorController
+        Owner of the step controllers and direction lines.
+    rate : float
+        Scheduler ticks per second.
+    max_acceleration : float or dict
+        Hz per second, either for all motors or per motor name.
+    acceleration_curve : str
+        Name in ``ACCELERATION_CURVES``, scales the acceleration by speed.
+    start_frequency : float
+        Highest frequency the motors can start from or stop at directly.
+    """
+
+    def __init__(
+        self,
+        motor_controller,
+        rate=200,
+        max_acceleration=4000,
+        acceleration_curve="linear",
+        start_frequency=100,
+        max_frequency=1500,
+    ):
+        self.motor_controller = motor_controller
+        self.step_controllers = motor_controller.step_controllers
+        self.interval = 1 / rate
+        self.curve = ACCELERATION_CURVES[acceleration_curve]
+        self.start_frequency = start_frequency
+        self.max_frequency = max_frequency
+
+        if isinstance(max_acceleration, dict):
+            self.max_acceleration = dict(max_acceleration)
+        else:
+            self.max_acceleration = {
+                motor: max_acceleration for motor in self.step_controllers
+            }
+
+        self.targets = {motor: 0.0 for motor in self.step_controllers}
+        self.current = {motor: 0.0 for motor in self.step_controllers}
+
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+        self.late_ticks = 0
+        self.error = None
+
+    def set_target(self, motor, frequency):
+        if self.error is not None:
+            raise RuntimeError(
+                f"Motor ramp stopped after an error: {self.error}"
+            ) from self.error
+        with self.lock:
+            self.targets[motor] = frequency
+
+    def emergency_stop(self):
+        """Stop all motors immediately, bypassing the ramp."""
+        with self.lock:
+            for motor in self.step_controllers:
+                self.targets[motor] = 0.0
+                self.current[motor] = 0.0
+            self.motor_controller.apply_frequencies(
+                {motor: 0 for motor in self.step_controllers}
+            )
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        next_tick = time.perf_counter()
+        while self.running:
+            try:
+                self.tick(self.interval)
+            except Exception as e:
+                self.fail(e)
+                return
+
+            # Fixed rate: schedule from the previous deadline, not from now
+            next_tick += self.interval
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.late_ticks += 1
+                next_tick = time.perf_counter()
+
+    def fail(self, error):
+        """Stop the motors after a failed tick and refuse new targets."""
+        print(f"Error ramping the motors, stopping them: {error}")
+        self.error = error
+        self.running = False
+        try:
+            self.emergency_stop()
+        except Exception as e:
+            print(f"Error stopping the motors: {e}")
+
+    def tick(self, dt):
+        """Advance all motors by ``dt`` and apply the changed frequencies."""
+        with self.lock:
+            changed = {}
+            for motor in self.step_controllers:
+                frequency = self.step(motor, dt)
+                if frequency is not None:
+                    changed[motor] = round(frequency)
+            if changed:
+                self.motor_controller.apply_frequencies(changed)
+
+    def step(self, motor, dt):
+        """Return the new signed frequency of ``motor``, None if unchanged."""
+        target = self.targets[motor]
+        current = self.current[motor]
+        if target == current:
+            return None
+
+        # A reversal has to pass through standstill first
+        if current != 0 and (target > 0) != (current > 0):
+            goal = 0.0
+        else:
+            goal = target
+
+        max_change = (
+            self.max_acceleration[motor] * self.curve(current, self.max_frequency) * dt
+        )
+
+        if abs(current) < self.start_frequency and abs(goal) >= abs(current):
+            # Start from standstill at the start frequency
+            current = min(abs(goal), self.start_frequency) * (1 if goal > 0 else -1)
+        elif goal > current:
+            current = min(current + max_change, goal)
+        else:
+            current = max(current - max_change, goal)
+
+        if abs(current) < self.start_frequency and abs(goal) < abs(current):
+            current = goal  # slow enough to stop or settle directly
+
+        self.current[motor] = current
+        return current
@@ -1,9 +1,8 @@
-import time
-
 import gpiod
-import serial
 from gpiod.line import Direction, Value
 from src.server.hardware_pwm import HardwarePWM
+from src.server.motion_profile import RampScheduler
+from src.server.weapon_serial import ArduinoPWMController
 
 
 class MotorController:
@@ -16,7 +15,16 @@ class MotorController:
         motor1_en=None,
         motor2_en=None,
         weapon_speed=None,
+        pwm_sysfs_root="/sys/class/pwm",
+        pwm_on_write=None,
+        ramp_rate=200,
+        max_acceleration=4000,
+        acceleration_curve="linear",
+        weapon_port="/dev/ttyACM0",
+        weapon_baudrate=115200,
     ):
+        self.pwm_sysfs_root = pwm_sysfs_root
+        self.pwm_on_write = pwm_on_write
         self.raspberry_pi_version = self.get_raspberry_pi_version()
 
         if self.raspberry_pi_version == "c03115":
@@ -36,14 +44,27 @@ class MotorController:
         if motor2_en is not None:
             self.pins["motor2_en"] = motor2_en
 
-        self.lines_request = {}
+        self.pwm_controller = ArduinoPWMController(weapon_port, weapon_baudrate)
+
+        # Everything cleanup() reads, since _init_lines calls it on failure
+        self.motion_profile = None
+        self.lines = None
+        self.line_values = {}
+        self.step_controllers = {}
         self._init_lines()
         self.step_controllers = {
             "motor1": StepController(self, "motor1", pwm_channel=0),
             "motor2": StepController(self, "motor2", pwm_channel=1),
         }
 
-        self.pwm_controller = ArduinoPWMController(1)
+        # Without a ramp rate the step frequency jumps straight to the target
+        if ramp_rate:
+            self.motion_profile = RampScheduler(
+                self,
+                rate=ramp_rate,
+                max_acceleration=max_acceleration,
+                acceleration_curve=acceleration_curve,
+            )
 
     def get_raspberry_pi_version(self):
         with open("/proc/cpuinfo", "r") as cpuinfo:
@@ -53,117 +74,132 @@ class MotorController:
         return None
 
     def _init_lines(self):
+        # Direction and weapon lines start low, the active low enables high
+        self.line_values = {
+            name: Value.ACTIVE if name.endswith("_en") else Value.INACTIVE
+            for name, pin in self.pins.items()
+            if pin is not None and not name.endswith("_step")
+        }
         try:
-            self._release_lines()  # Ensure any previously held lines are released
-            self.lines_request["motor1_dir"] = gpiod.request_lines(
-                self.CHIP_NAME,
-                consumer="motor1_dir",
-                config={
-                    self.pins["motor1_dir"]: gpiod.LineSettings(
-                        direction=Direction.OUTPUT, output_value=Value.INACTIVE
-                    )
-                },
-            )
-            self.lines_request["motor2_dir"] = gpiod.request_lines(
-                self.CHIP_NAME,
-                consumer="motor2_dir",
-                config={
-                    self.pins["motor2_dir"]: gpiod.LineSettings(
-                        direction=Direction.OUTPUT, output_value=Value.INACTIVE
-                    )
-                },
-            )
-
-            self.lines_request["weapon_speed"] = gpiod.request_lines(
-                self.CHIP_NAME,
-                consumer="weapon_speed",
-                config={
-                    self.pins["weapon_speed"]: gpiod.LineSettings(
-                        direction=Direction.OUTPUT, output_value=Value.INACTIVE
-                    )
-                },
-            )
-
-            if "motor1_en" in self.pins:
-                self.lines_request["motor1_en"] = gpiod.request_lines(
-                    self.CHIP_NAME,
-                    consumer="motor1_en",
-                    config={
-                        self.pins["motor1_en"]: gpiod.LineSettings(
-                            direction=Direction.OUTPUT, output_value=Value.ACTIVE
-                        )
-                    },
-                )
-            if "motor2_en" in self.pins:
-                self.lines_request["motor2_en"] = gpiod.request_lines(
-                    self.CHIP_NAME,
-                    consumer="motor2_en",
-                    config={
-                        self.pins["motor2_en"]: gpiod.LineSettings(
-                            direction=Direction.OUTPUT, output_value=Value.ACTIVE
-                        )
-                    },
-                )
+            self._request_lines()
         except OSError as e:
             print(f"Error requesting GPIO lines: {e}")
             self.cleanup()
             raise
 
-    def _release_lines(self):
-        for key, line in self.lines_request.items():
-            try:
-                line.release()
-            except gpiod.exception.RequestReleasedError:
-                print(f"GPIO line {key} already released")
-            except Exception as e:
-                print(f"Error releasing GPIO line {key}: {e}")
+    def _request_lines(self):
+        """
+        Request all output lines in a single request, starting at the values
+        in ``line_values`` so a re-request keeps the current state.
+        """
+        self._release_lines()  # Ensure any previously held lines are released
+        self.lines = gpiod.request_lines(
+            self.CHIP_NAME,
+            consumer="battlebot",
+            config={
+                self.pins[name]: gpiod.LineSettings(
+                    direction=Direction.OUTPUT, output_value=value
+                )
+                for name, value in self.line_values.items()
+            },
+        )
 
-    def _reinit_lines(self):
+    def _release_lines(self):
+        if self.lines is None:
+            return
         try:
-            self._release_lines()  # Release all lines before reinitializing
-            self._init_lines()
+            self.lines.release()
+        except gpiod.exception.RequestReleasedError:
+            print("GPIO lines already released")
         except Exception as e:
-            print(f"Error reinitializing GPIO lines: {e}")
+            print(f"Error releasing GPIO lines: {e}")
+        self.lines = None
+
+    def set_lines(self, values):
+        """
+        Set output lines by name with a single ioctl, skipping lines that
+        already have the value.
+        """
+        changed = {
+            name: value
+            for name, value in values.items()
+            if self.line_values.get(name) != value
+        }
+        if not changed:
+            return
 
-    def set_motor_direction(self, motor, direction):
+        offsets = {self.pins[name]: value for name, value in changed.items()}
         try:
-            request_dir = self.lines_request[f"{motor}_dir"]
-            pin_dir = self.pins[f"{motor}_dir"]
-            if direction == "forward":
-                request_dir.set_value(pin_dir, Value.INACTIVE)
-            elif direction == "backward":
-                request_dir.set_value(pin_dir, Value.ACTIVE)
+            self.lines.set_values(offsets)
         except gpiod.exception.RequestReleasedError:
-            print(f"GPIO lines for {motor}_dir have been released, re-requesting...")
-            self._reinit_lines()  # Re-request the GPIO lines
-            self.set_motor_direction(motor, direction)  # Retry setting the direction
+            # The re-request starts the lines at line_values, so it gets the
+            # new values first; a second failure is raised to the caller
+            print("GPIO lines have been released, re-requesting...")
+            previous = self.line_values
+            self.line_values = {**previous, **changed}
+            try:
+                self._request_lines()
+            except Exception:
+                self.line_values = previous
+                raise
+            return
+        # Only once the lines have the values, or identical requests would be
+        # skipped after a failure
+        self.line_values.update(changed)
+
+    def motor_lines(self, motor, direction=None, enable=None):
+        """Line values for one motor, to be combined into one ``set_lines``."""
+        values = {}
+        if direction is not None:
+            values[f"{motor}_dir"] = (
+                Value.ACTIVE if direction == "backward" else Value.INACTIVE
+            )
+        if enable is not None and f"{motor}_en" in self.pins:
+            # Active low
+            values[f"{motor}_en"] = Value.INACTIVE if enable else Value.ACTIVE
+        return values
 
-    def enable_motor(self, motor, enable):
-        try:
-            if f"{motor}_en" in self.lines_request:
-                request_en = self.lines_request[f"{motor}_en"]
-                pin_en = self.pins[f"{motor}_en"]
-                if enable:
-                    request_en.set_value(pin_en, Value.INACTIVE)  # Active low
-                else:
-                    request_en.set_value(pin_en, Value.ACTIVE)
-        except gpiod.exception.RequestReleasedError:
-            print(f"GPIO lines for {motor}_en have been released, re-requesting...")
-            self._reinit_lines()  # Re-request the GPIO lines
-            self.enable_motor(motor, enable)  # Retry enabling the motor
+    def set_motor_direction(self, motor, direction):
+        self.set_lines(self.motor_lines(motor, direction=direction))
 
-    def set_motor_speed(self, motor, speed):
-        step_controller = self.step_controllers[motor]
-        step_controller.update_speed(speed)
+    def enable_motor(self, motor, enable):
+        self.set_lines(self.motor_lines(motor, enable=enable))
+
+    def apply_frequencies(self, frequencies):
+        """
+        Apply signed step frequencies per motor, negative is backward.
+
+        The direction and enable lines of all motors are updated together
+        before the PWM outputs change.
+        """
+        lines = {}
+        for motor, frequency in frequencies.items():
+            if frequency == 0:
+                lines.update(self.motor_lines(motor, enable=False))
+            else:
+                direction = "forward" if frequency > 0 else "backward"
+                lines.update(self.motor_lines(motor, direction, enable=True))
+        self.set_lines(lines)
+
+        for motor, frequency in frequencies.items():
+            self.step_controllers[motor].apply_frequency(abs(frequency))
+
+    def signed_frequency(self, motor, direction, speed):
+        frequency = self.step_controllers[motor].speed_to_frequency(speed)
+        return -frequency if direction == "backward" else frequency
 
     def motor_data(self, motor, direction, speed):
-        self.set_motor_direction(motor, direction)
-        self.set_motor_speed(motor, speed)
+        frequency = self.signed_frequency(motor, direction, speed)
+        if self.motion_profile is not None:
+            self.motion_profile.set_target(motor, frequency)
+        else:
+            self.apply_frequencies({motor: frequency})
 
     def weapon_data(self, speed):
         self.pwm_controller.update_speed(speed)
 
-    def action(self, x, y, speed, weapon_speed):
+    def target_frequencies(self, x, y, speed):
+        """Signed step frequency per motor for a stick position and speed."""
         # Normalize x and y to be between -1 and 1
         x = max(min(x, 1), -1)
         y = max(min(y, 1), -1)
@@ -180,18 +216,41 @@ class MotorController:
         left_direction = "forward" if left >= 0 else "backward"
         right_direction = "forward" if right >= 0 else "backward"
 
+        return {
+            "motor1": self.signed_frequency("motor1", left_direction, abs(left)),
+            "motor2": self.signed_frequency("motor2", right_direction, abs(right)),
+        }
+
+    def action(self, x, y, speed, weapon_speed):
         # Send the motor commands
-        self.motor_data("motor1", left_direction, abs(left))
-        self.motor_data("motor2", right_direction, abs(right))
+        frequencies = self.target_frequencies(x, y, speed)
+        if self.motion_profile is not None:
+            for motor, frequency in frequencies.items():
+                self.motion_profile.set_target(motor, frequency)
+        else:
+            self.apply_frequencies(frequencies)
 
         self.weapon_data(weapon_speed)
 
+    def start(self):
+        self.pwm_controller.connect()
+        if self.motion_profile is not None:
+            self.motion_profile.start()
+
     def stop(self):
-        self.step_controllers["motor1"].stop()
-        self.step_controllers["motor2"].stop()
+        if self.motion_profile is not None:
+            self.motion_profile.emergency_stop()
+            return
+
+        self.apply_frequencies({motor: 0 for motor in self.step_controllers})
 
     def cleanup(self):
+        if self.motion_profile is not None:
+            self.motion_profile.close()
+        self.pwm_controller.disconnect()
         self._release_lines()
+        for step_controller in self.step_controllers.values():
+            step_controller.pwm.close()
 
     def calibrate(self):
         pass
@@ -201,69 +260,37 @@ class StepController:
     def __init__(self, motor_controller, motor_name, pwm_channel):
         self.motor_controller = motor_controller
         self.motor_name = motor_name
-        self.pwm = HardwarePWM(pwm_channel=pwm_channel, hz=1000, chip=2)
+        self.pwm = HardwarePWM(
+            pwm_channel=pwm_channel,
+            hz=1000,
+            chip=2,
+            sysfs_root=motor_controller.pwm_sysfs_root,
+            on_write=motor_controller.pwm_on_write,
+        )
         self.pwm.start(0)  # Start with 50% duty cycle (stopped)
-        self.dir_line_request = motor_controller.lines_request[f"{motor_name}_dir"]
-        self.dir_pin = motor_controller.pins[f"{motor_name}_dir"]
-        self.en_line_request = motor_controller.lines_request.get(f"{motor_name}_en")
-        self.en_pin = motor_controller.pins.get(f"{motor_name}_en")
 
         self.current_frequency = 0.1
 
-    def update_speed(self, speed):
+    def speed_to_frequency(self, speed):
+        if speed <= 0:
+            return 0
+
         # Convert the speed to the target frequency
         # (ensure the speed is within the range)
-        self.target_frequency = round(
+        return round(
             min(max(1500 * speed, 10), 1500), 0
         )  # 10 kHz frequency max speed, minimum frequency is 10
 
-        self.pwm.change_frequency(self.target_frequency)
-
-        # Control the motor enable line based on the target frequency
-        if speed > 0:
-            if self.en_line_request:
-                self.en_line_request.set_value(self.en_pin, Value.INACTIVE)
+    def apply_frequency(self, frequency):
+        """
+        Set the step frequency of the PWM output. The enable and direction
+        lines are set by MotorController.apply_frequencies.
+        """
+        if frequency > 0:
+            self.pwm.change_frequency(frequency)
             duty_cycle = 50  # Set the duty cycle appropriately for your setup
         else:
             duty_cycle = 0
-            if self.en_line_request:
-                self.en_line_request.set_value(self.en_pin, Value.ACTIVE)
 
         self.pwm.change_duty_cycle(duty_cycle)
-        print(f"Motor {self.motor_name} duty_cycle set to {self.target_frequency}%")
-
-    def stop(self):
-        self.pwm.change_duty_cycle(0)
-        if self.en_line_request:
-            self.en_line_request.set_value(self.en_pin, Value.ACTIVE)
-
-
-class ArduinoPWMController:
-    def __init__(self, port, baudrate=9600, timeout=1):
-        self.port = port
-        self.baudrate = baudrate
-        self.timeout = timeout
-        self.serial_connection = None
-
-    def connect(self):
-        try:
-            self.serial_connection = serial.Serial(
-                self.port, self.baudrate, timeout=self.timeout
-            )
-            time.sleep(2)  # Wait for the connection to establish
-            print("Connected to Arduino on port", self.port)
-        except serial.SerialException as e:
-            print("Error connecting to Arduino:", e)
-
-    def update_speed(self, hz, duty_cycle):
-        if self.serial_connection and self.serial_connection.is_open:
-            data = f"{hz},{duty_cycle}\n"
-            self.serial_connection.write(data.encode())
-            print(f"Sent: {data.strip()}")
-        else:
-            print("Serial connection is not open")
-
-    def disconnect(self):
-        if self.serial_connection and self.serial_connection.is_open:
-            self.serial_connection.close()
-            print("Disconnected from Arduino")
+        self.current_frequency = frequency
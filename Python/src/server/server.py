@@ -1,9 +1,6 @@
 import asyncio
 import sys
 
-from src.server.communications import MotorWebRTCClient, MotorWebSocketServer
-from src.server.motor_controller import MotorController
-
 
 class Server:
     def get_conmunication_type(self):
@@ -26,7 +23,22 @@ class Server:
 
         return input("Enter the ip and port of the server (ip:port): ").split(":")
 
-    def start(self):
+    def start(self, sim=False):
+        # The hardware modules are imported here, after the simulated
+        # backends have replaced gpiod, serial and picamera2
+        simulation = None
+        motor_options = {}
+        if sim:
+            from src.server.sim import Simulation
+
+            simulation = Simulation()
+            simulation.install()
+            motor_options = simulation.motor_controller_options()
+
+        from src.server.actuator import ActuatorThread
+        from src.server.communications import MotorWebRTCClient, MotorWebSocketServer
+        from src.server.motor_controller import MotorController
+
         motor_controller = MotorController(
             motor1_step=13,
             motor1_dir=17,
@@ -35,20 +47,25 @@ class Server:
             motor1_en=27,
             motor2_en=1,
             weapon_speed=18,
+            **motor_options,
         )
 
         # motor callibration
         motor_controller.calibrate()
+        motor_controller.start()
+
+        # The network side only publishes setpoints, the actuator thread
+        # applies them to the hardware
+        actuator = ActuatorThread(motor_controller)
+        actuator.start()
 
         comunication_type = self.get_conmunication_type()
 
         if comunication_type == "webrtc":
-            websocket_server = MotorWebRTCClient(
-                motor_controller, self.get_battlebot_name(), 0
-            )
+            websocket_server = MotorWebRTCClient(actuator, self.get_battlebot_name(), 0)
         elif comunication_type == "websocket":
             ip, port = self.get_server_ip_port()
-            websocket_server = MotorWebSocketServer(motor_controller, ip, port)
+            websocket_server = MotorWebSocketServer(actuator, ip, port)
 
         loop = asyncio.get_event_loop()
         try:
@@ -56,4 +73,6 @@ class Server:
         except KeyboardInterrupt:
             print("WebSocket server shutting down.")
         finally:
-            motor_controller.cleanup()
+            actuator.cleanup()
+            if simulation is not None:
+                simulation.cleanup()
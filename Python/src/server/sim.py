@@ -0,0 +1,263 @@
+"""
+Simulated hardware for running the server on a machine without the robot.
+
+``Simulation.install()`` puts stand-ins for ``gpiod``, ``serial``,
+``picamera2`` and ``libcamera`` into ``sys.modules`` and creates a fake sysfs
+PWM tree in a temporary directory, so it has to run before the server modules
+are imported. Every GPIO line change, PWM attribute write and weapon frame is
+recorded in an ``ActuationLog`` with its ``perf_counter`` timestamp.
+"""
+
+import enum
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+from collections import Counter, deque
+from time import perf_counter
+
+import numpy as np
+
+
+class ActuationLog:
+    """
+    Timestamped actuation events as ``(perf_counter, source, name, value)``.
+
+    Listeners are called with every event from the thread that caused it.
+    """
+
+    def __init__(self, maxlen=100_000):
+        self.events = deque(maxlen=maxlen)
+        self.listeners = []
+
+    def record(self, source, name, value):
+        event = (perf_counter(), source, name, value)
+        self.events.append(event)
+        for listener in self.listeners:
+            listener(event)
+
+    def counts(self):
+        return dict(Counter(source for _, source, _, _ in self.events))
+
+
+def create_pwm_tree(root, chip=2, channels=2):
+    chippath = os.path.join(root, f"pwmchip{chip}")
+    for channel in range(channels):
+        os.makedirs(os.path.join(chippath, f"pwm{channel}"), exist_ok=True)
+        for name in ("period", "duty_cycle", "enable"):
+            with open(os.path.join(chippath, f"pwm{channel}", name), "w") as f:
+                f.write("0\n")
+    with open(os.path.join(chippath, "export"), "w") as f:
+        f.write("")
+
+
+def fake_gpiod(log):
+    class Value(enum.Enum):
+        INACTIVE = 0
+        ACTIVE = 1
+
+    class Direction(enum.Enum):
+        INPUT = 1
+        OUTPUT = 2
+
+    class RequestReleasedError(Exception):
+        pass
+
+    class LineRequest:
+        def __init__(self, consumer, config):
+            self.consumer = consumer
+            self.released = False
+            for offset, settings in config.items():
+                log.record("gpio", offset, settings["output_value"].value)
+
+        def set_value(self, offset, value):
+            self.set_values({offset: value})
+
+        def set_values(self, values):
+            if self.released:
+                raise RequestReleasedError()
+            for offset, value in values.items():
+                log.record("gpio", offset, value.value)
+
+        def release(self):
+            self.released = True
+
+    gpiod = types.ModuleType("gpiod")
+    gpiod.Chip = lambda path: None
+    gpiod.LineSettings = lambda **kwargs: kwargs
+    gpiod.request_lines = lambda path, consumer, config: LineRequest(consumer, config)
+    gpiod.line = types.ModuleType("gpiod.line")
+    gpiod.line.Value = Value
+    gpiod.line.Direction = Direction
+    gpiod.exception = types.ModuleType("gpiod.exception")
+    gpiod.exception.RequestReleasedError = RequestReleasedError
+    return gpiod
+
+
+def fake_serial(log):
+    class SerialException(OSError):
+        pass
+
+    class Serial:
+        """A pipe with a reader thread that decodes weapon frames."""
+
+        def __init__(self, port, baudrate=9600, timeout=None, write_timeout=None):
+            self.port = port
+            self.baudrate = baudrate
+            self.read_fd, self.write_fd = os.pipe()
+            self.is_open = True
+            self.thread = threading.Thread(target=self.read_frames, daemon=True)
+            self.thread.start()
+
+        def fileno(self):
+            return self.write_fd
+
+        def write(self, data):
+            return os.write(self.write_fd, data)
+
+        def read_frames(self):
+            # Imported late so weapon_serial picks up this serial module
+            from src.server.weapon_serial import decode_frames
+
+            buffer = b""
+            while True:
+                data = os.read(self.read_fd, 256)
+                if not data:
+                    break
+                frames, buffer = decode_frames(buffer + data)
+                for frame_type, _, speed in frames:
+                    log.record("weapon", frame_type, speed)
+            os.close(self.read_fd)
+
+        def close(self):
+            if self.is_open:
+                self.is_open = False
+                os.close(self.write_fd)
+
+    serial = types.ModuleType("serial")
+    serial.Serial = Serial
+    serial.SerialException = SerialException
+    return serial
+
+
+def fake_picamera2(log, fps=30):
+    class Picamera2:
+        """Synthetic frames: a square moving over a gradient, paced at the fps."""
+
+        def __init__(self, camera_num=0):
+            self.camera_num = camera_num
+            self.size = (640, 480)
+            self.format = "RGB888"
+            self.started = False
+            self.frame_count = 0
+            self.next_frame = perf_counter()
+            self.fps = fps
+            self.background = None
+            self.camera_properties = {
+                "PixelArraySize": (4608, 2592),
+                "ScalerCropMaximum": (0, 0, 4608, 2592),
+            }
+            self.controls = {}
+
+        def create_video_configuration(self, main=None, **kwargs):
+            return {"main": dict(main or {}), **kwargs}
+
+        def configure(self, config):
+            main = config.get("main", {})
+            self.fps = config.get("controls", {}).get("FrameRate", fps)
+            self.size = tuple(main.get("size", self.size))
+            self.format = main.get("format", self.format)
+            width, height = self.size
+            gradient = np.tile(np.linspace(0, 255, width, dtype=np.uint8), (height, 1))
+            if self.format == "YUV420":
+                # Y plane followed by the U and V planes at half resolution
+                chroma = np.full((height // 2, width), 128, dtype=np.uint8)
+                self.background = np.vstack((gradient, chroma))
+            else:
+                self.background = np.repeat(gradient[:, :, np.newaxis], 3, axis=2)
+
+        def set_controls(self, controls):
+            self.controls.update(controls)
+            log.record("camera", self.camera_num, controls)
+
+        def start(self):
+            if self.background is None:
+                self.configure({})
+            self.started = True
+            log.record("camera", self.camera_num, "start")
+
+        def stop(self):
+            self.started = False
+            log.record("camera", self.camera_num, "stop")
+
+        def capture_array(self, name="main"):
+            if not self.started:
+                self.start()
+
+            delay = self.next_frame - perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self.next_frame = max(self.next_frame, perf_counter()) + 1 / self.fps
+
+            width, height = self.size
+            frame = self.background.copy()
+            side = height // 4
+            x = (self.frame_count * 8) % (width - side)
+            square = frame[height // 3 : height // 3 + side, x : x + side]
+            square[...] = 255 if self.format == "YUV420" else (0, 0, 255)
+            self.frame_count += 1
+            return frame
+
+    picamera2 = types.ModuleType("picamera2")
+    picamera2.Picamera2 = Picamera2
+    return picamera2
+
+
+def fake_libcamera():
+    class Transform:
+        def __init__(self, hflip=0, vflip=0, transpose=0):
+            self.hflip = int(hflip)
+            self.vflip = int(vflip)
+            self.transpose = int(transpose)
+
+    libcamera = types.ModuleType("libcamera")
+    libcamera.Transform = Transform
+    return libcamera
+
+
+class Simulation:
+    def __init__(self, camera_fps=30):
+        self.log = ActuationLog()
+        self.camera_fps = camera_fps
+        self.pwm_root = None
+
+    def install(self):
+        sys.modules["gpiod"] = gpiod = fake_gpiod(self.log)
+        sys.modules["gpiod.line"] = gpiod.line
+        sys.modules["gpiod.exception"] = gpiod.exception
+        sys.modules["serial"] = fake_serial(self.log)
+        sys.modules["picamera2"] = fake_picamera2(self.log, self.camera_fps)
+        sys.modules["libcamera"] = fake_libcamera()
+
+        self.pwm_root = tempfile.mkdtemp(prefix="battlebot-pwm-")
+        create_pwm_tree(self.pwm_root)
+
+    def record_pwm(self, pwm_dir, name, value):
+        self.log.record("pwm", f"{os.path.basename(pwm_dir)}/{name}", value)
+
+    def motor_controller_options(self):
+        """Keyword arguments that point MotorController at the fakes."""
+        return {
+            "pwm_sysfs_root": self.pwm_root,
+            "pwm_on_write": self.record_pwm,
+            "weapon_port": "sim",
+        }
+
+    def cleanup(self):
+        print(f"Simulated actuation events: {self.log.counts()}")
+        if self.pwm_root is not None:
+            shutil.rmtree(self.pwm_root, ignore_errors=True)
+            self.pwm_root = None
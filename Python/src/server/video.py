@@ -1,75 +1,388 @@
 import asyncio
+import threading
 import time
+from collections import deque
 
+import aiortc
 import cv2
+import numpy as np
 from aiortc import VideoStreamTrack
+from aiortc.mediastreams import VIDEO_CLOCK_RATE, VIDEO_TIME_BASE, MediaStreamError
 from av import VideoFrame
+from libcamera import Transform
 from picamera2 import Picamera2
 
+# The RTCRtpSender's encoder, private but there since aiortc 1.0
+ENCODER_ATTRIBUTE = "_RTCRtpSender__encoder"
+
+
+class CaptureThread:
+    """
+    Capture frames from one Picamera2 on a background thread.
+
+    Every frame is converted (or copied) straight into the next slot of a
+    small ring of buffers that are allocated once, on the first frame.
+    ``latest`` hands out the newest complete frame without waiting; the slot
+    it returns is not written again until the next ``latest`` call, so there
+    is one reader.
+    """
+
+    def __init__(self, camera, slots=3, convert=cv2.COLOR_RGB2BGR):
+        self.camera = camera
+        self.slots = slots
+        self.convert = convert  # cv2 colour conversion, None to copy as is
+        self.buffers = None
+        self.lock = threading.Lock()
+        self.latest_slot = None
+        self.reader_slot = None
+        self.sequence = 0  # frames captured
+        self.read_sequence = 0  # sequence of the frame handed out last
+        self.dropped = 0  # captured but never handed out
+        self.repeated = 0  # handed out more than once
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+            self.thread = None
+
+    def next_slot(self):
+        with self.lock:
+            for slot in range(self.slots):
+                if slot != self.latest_slot and slot != self.reader_slot:
+                    return slot
+
+    def run(self):
+        while self.running:
+            try:
+                frame = self.camera.capture_array("main")
+            except Exception as e:
+                print(f"Capture failed: {e}")
+                self.running = False
+                break
+
+            if self.buffers is None:
+                self.buffers = [np.empty_like(frame) for _ in range(self.slots)]
+
+            slot = self.next_slot()
+            if self.convert is None:
+                np.copyto(self.buffers[slot], frame)
+            else:
+                cv2.cvtColor(frame, self.convert, dst=self.buffers[slot])
+
+            with self.lock:
+                self.latest_slot = slot
+                self.sequence += 1
+
+    def latest(self):
+        """Return the newest frame, or None before the first one."""
+        with self.lock:
+            if self.latest_slot is None:
+                return None
+
+            if self.sequence == self.read_sequence:
+                self.repeated += 1
+            else:
+                self.dropped += self.sequence - self.read_sequence - 1
+                self.read_sequence = self.sequence
+            self.reader_slot = self.latest_slot
+            return self.buffers[self.reader_slot]
+
+    def stats(self):
+        return {
+            "captured": self.sequence,
+            "dropped": self.dropped,
+            "repeated": self.repeated,
+        }
+
+
+def plane_view(plane):
+    """Writable numpy view of a VideoFrame plane, without the line padding."""
+    view = np.frombuffer(plane, np.uint8).reshape(plane.height, plane.line_size)
+    return view[:, : plane.width]
+
+
+def split_i420(image, width, height):
+    """
+    Y, U and V planes of a YUV420 capture. Picamera2 returns the planes one
+    after the other in a (height * 3 / 2, width) array, the width has to be
+    a multiple of 64 so there is no row padding.
+    """
+    flat = image.reshape(-1)
+    luma = width * height
+    chroma = luma // 4
+    return (
+        flat[:luma].reshape(height, width),
+        flat[luma : luma + chroma].reshape(height // 2, width // 2),
+        flat[luma + chroma : luma + 2 * chroma].reshape(height // 2, width // 2),
+    )
+
+
+STEREO_LAYOUTS = ("mono", "side_by_side", "top_bottom", "tracks")
+
+
+def eye_size(size, stereo):
+    """Capture size per camera so the packed frame is always ``size``."""
+    width, height = size
+    if stereo == "side_by_side":
+        return width // 2, height
+    if stereo == "top_bottom":
+        return width, height // 2
+    return width, height
+
+
+def eye_offset(index, size, stereo):
+    """Top left corner (x, y) of eye ``index`` in the packed frame."""
+    width, height = eye_size(size, stereo)
+    if stereo == "side_by_side":
+        return index * width, 0
+    if stereo == "top_bottom":
+        return 0, index * height
+    return 0, 0
+
+
+class FramePool:
+    """
+    A few yuv420p VideoFrames of one size that are filled in turn, instead of
+    allocating a frame per capture. The encoder is done with a frame long
+    before it comes round again.
+    """
+
+    def __init__(self, width, height, size=4):
+        self.frames = [VideoFrame(width, height, "yuv420p") for _ in range(size)]
+        self.planes = [
+            [plane_view(plane) for plane in frame.planes] for frame in self.frames
+        ]
+        # Capture sequence of each eye in each frame, to skip unchanged copies
+        self.contents = [{} for _ in self.frames]
+        self.index = 0
+
+    def get(self):
+        self.index = (self.index + 1) % len(self.frames)
+        return (
+            self.frames[self.index],
+            self.planes[self.index],
+            self.contents[self.index],
+        )
+
 
 class Camera:
-    def __init__(self):
+    """
+    The two Picamera2 cameras, packed into frames of a constant ``size``.
+
+    With ``capture_format="yuv420"`` the ISP delivers YUV420, already rotated
+    by ``rotation`` degrees, and the planes are copied straight into pooled
+    VideoFrames the encoder takes as is. ``"rgb"`` captures RGB888 and
+    converts it to BGR like before.
+
+    ``stereo`` is one of ``STEREO_LAYOUTS``. The ISP scales each camera to
+    half the width (side by side) or half the height (top bottom), so the
+    frame size never changes and the encoder is never reinitialised. The
+    ``ScalerCrop`` is set to the whole sensor, so the eye is squeezed rather
+    than cropped to its aspect ratio and keeps the full field of view that
+    aim assist's ``camera_angle`` assumes. The
+    second camera runs at ``stereo_fps``; in between its last frame is
+    reused. With ``"tracks"`` nothing is packed: every camera keeps the full
+    ``size`` and is sent as its own track, see ``get_video_frame(eye)``.
+    """
+
+    def __init__(
+        self,
+        capture_format="yuv420",
+        rotation=180,
+        size=(1280, 720),
+        stereo="tracks",
+        stereo_fps=3,
+    ):
+        if stereo not in STEREO_LAYOUTS:
+            raise ValueError(f"Unknown stereo layout {stereo}")
+        self.capture_format = capture_format
+        self.rotation = rotation
+        self.size = size
+        self.stereo = stereo
+        self.stereo_fps = stereo_fps
+        self.eyes = 1 if stereo == "mono" else 2
+        self.frame_pools = {}  # per eye, None for the packed frame
+        self.packed = None
         try:
             self.picamera1 = Picamera2(0)
             self.picamera2 = Picamera2(1)
+
+            transform = Transform(hflip=rotation == 180, vflip=rotation == 180)
+            if capture_format == "yuv420":
+                main = {"size": eye_size(size, stereo), "format": "YUV420"}
+                convert = None
+            else:
+                main = {"size": eye_size(size, stereo), "format": "RGB888"}
+                convert = cv2.COLOR_RGB2BGR
             # Create a video configuration. Adjust the configuration as per your needs.
-            video_config = self.picamera1.create_video_configuration(
-                main={"size": (1280, 720), "format": "RGB888"}
+            self.picamera1.configure(
+                self.picamera1.create_video_configuration(
+                    main=main, transform=transform
+                )
+            )
+            self.picamera2.configure(
+                self.picamera2.create_video_configuration(
+                    main=main, transform=transform, controls={"FrameRate": stereo_fps}
+                )
             )
-            self.picamera1.configure(video_config)
-            self.picamera2.configure(video_config)
+            for picamera in (self.picamera1, self.picamera2):
+                # libcamera would crop the sensor to the eye's aspect ratio
+                picamera.set_controls(
+                    {"ScalerCrop": picamera.camera_properties["ScalerCropMaximum"]}
+                )
+
+            self.captures = [
+                CaptureThread(self.picamera1, convert=convert),
+                CaptureThread(self.picamera2, convert=convert),
+            ][: self.eyes]
 
             self.depth_map = False
             self.frame_counter = 0
-            self.last_frame2 = None
             self.frame_times = []
 
         except Exception as e:
             print(f"Camera initialization failed: {e}")
 
+    def video_config_message(self):
+        """Tell the client how to show the frames; the ISP already rotated them."""
+        return {
+            "video": {
+                "rotation": 0,
+                "format": self.capture_format,
+                "stereo": self.stereo,
+            }
+        }
+
     def start(self):
-        # Start the camera
-        pass
+        # Start capturing, the cameras themselves are started by
+        # is_camera_available
+        for capture in self.captures:
+            capture.start()
 
     def stop(self):
-        # Stop the camera
+        # Stop the capture threads before the cameras they read from
+        for capture in self.captures:
+            capture.stop()
         self.picamera1.stop()
         self.picamera2.stop()
 
-    def capture_frame(self, camera):
-        return camera.capture_array("main")
-
-    def get_frame(self):
-        start_time = time.perf_counter()
-
-        # Capture frame from the first camera
-        frame1 = self.capture_frame(self.picamera1)
-        img1 = cv2.cvtColor(
-            frame1, cv2.COLOR_RGB2BGR
-        )  # Convert immediately to reduce conversions
+    def latest_images(self, eye=None):
+        """
+        The newest image of every eye (or only of ``eye``) with its capture
+        sequence, or None until every eye captured something.
+        """
+        captures = self.captures if eye is None else [self.captures[eye]]
+        images = []
+        for capture in captures:
+            image = capture.latest()
+            if image is None:
+                return None
+            images.append((capture.read_sequence, image))
 
         # Update frame counter
         self.frame_counter += 1
+        return images
+
+    def get_frame(self, eye=None):
+        """
+        Return the newest packed frame (or the image of camera ``eye``) as an
+        ndarray without waiting for the camera, or None when nothing was
+        captured yet. The frame is valid until the next call.
+        """
+        if self.capture_format == "yuv420":
+            raise ValueError("YUV420 frames are only available as VideoFrames")
+
+        images = self.latest_images(eye)
+        if images is None:
+            return None
+        if len(images) == 1:
+            return images[0][1]
+
+        if self.packed is None:
+            width, height = self.size
+            self.packed = np.empty((height, width, 3), dtype=np.uint8)
+        for index, (_, image) in enumerate(images):
+            x, y = eye_offset(index, self.size, self.stereo)
+            self.packed[y : y + image.shape[0], x : x + image.shape[1]] = image
+        return self.packed
 
-        # Capture and convert frame from the second camera only when needed
-        if self.frame_counter % 10 == 0:
-            frame2 = self.capture_frame(self.picamera2)
-            self.last_frame2 = cv2.cvtColor(frame2, cv2.COLOR_RGB2BGR)
-            # Concatenate the images horizontally
-            combined_img = cv2.hconcat([img1, self.last_frame2])
+    def get_video_frame(self, eye=None):
+        """
+        Return the newest frame as a VideoFrame, or None before the first.
+
+        ``eye`` selects one camera for the ``"tracks"`` layout, which defaults
+        to the first.
+        """
+        start_time = time.perf_counter()
+        if eye is None and self.stereo == "tracks":
+            eye = 0
+
+        if self.capture_format == "yuv420":
+            video_frame = self.get_yuv_frame(eye)
         else:
-            combined_img = img1
+            frame = self.get_frame(eye)
+            if frame is None:
+                return None
+            # Since your image is in RGBA format, specify "rgba" here
+            if self.depth_map:
+                video_frame = VideoFrame.from_ndarray(frame, format="rgba")
+            else:
+                video_frame = VideoFrame.from_ndarray(frame, format="bgr24")
+        if video_frame is None:
+            return None
 
         elapsed_time_ms = (time.perf_counter() - start_time) * 1000
         self.frame_times.append(elapsed_time_ms)
 
         # Calculate and print the average frame time every 50 frames efficiently
         if self.frame_counter % 50 == 0:
-            avg_time_ms = sum(self.frame_times) / 50
+            avg_time_ms = sum(self.frame_times) / len(self.frame_times)
             print(f"Average time to get frame in ms: {avg_time_ms}")
+            print(f"Capture: {self.stats()}")
             self.frame_times.clear()  # More efficient reset of the list
 
-        return combined_img
+        return video_frame
+
+    def get_yuv_frame(self, eye=None):
+        images = self.latest_images(eye)
+        if images is None:
+            return None
+
+        if eye not in self.frame_pools:
+            self.frame_pools[eye] = FramePool(*self.size)
+        video_frame, planes, contents = self.frame_pools[eye].get()
+
+        width, height = eye_size(self.size, self.stereo)
+        for index, (sequence, image) in enumerate(images):
+            if contents.get(index) == sequence:
+                continue  # this pooled frame already holds that capture
+            contents[index] = sequence
+
+            x, y = eye_offset(index, self.size, self.stereo)
+            for plane_index, source in enumerate(split_i420(image, width, height)):
+                scale = 1 if plane_index == 0 else 2  # chroma is half size
+                plane_x, plane_y = x // scale, y // scale
+                planes[plane_index][
+                    plane_y : plane_y + source.shape[0],
+                    plane_x : plane_x + source.shape[1],
+                ] = source
+        return video_frame
+
+    def stats(self):
+        return {
+            f"camera{index + 1}": capture.stats()
+            for index, capture in enumerate(self.captures)
+        }
 
     def is_camera_available(self):
         """Check if the camera is available."""
@@ -83,41 +396,146 @@ class Camera:
 
 
 class CameraStreamTrack(VideoStreamTrack):
+    """
+    A video track of ``camera``: the packed frame, or with the ``"tracks"``
+    layout the frame of camera ``eye``.
+
+    The track is paced at ``fps``. ``max_bitrate`` caps the encoder's target
+    bitrate, which aiortc otherwise raises up to the receiver's estimate.
+    aiortc only exposes the encoder as a private attribute of the
+    RTCRtpSender, so ``sender`` has to be set once the track is added; the
+    encoder is also timed through it. Setting a sender of an aiortc without
+    that attribute raises RuntimeError instead of silently not capping.
+    """
+
     kind = "video"
 
-    def __init__(self, camera):
+    def __init__(
+        self,
+        camera,
+        eye=None,
+        fps=30,
+        max_bitrate=None,
+        name="camera1",
+        stats_interval=5,
+    ):
         super().__init__()  # Initialize base class
         self.camera = camera
+        self.eye = eye
+        self.fps = fps
+        self.max_bitrate = max_bitrate
+        self.name = name
+        self.stats_interval = stats_interval
+        self._sender = None
+        self.encoder = None
         self.send_lock = asyncio.Lock()
-        self.last_frame2 = None
-        self.frame_times = []
+        self.frame_times = deque(maxlen=100)
+        self.encode_times = deque(maxlen=100)  # appended from the encode thread
         self.frame_counter = 0
+        self.stats_frames = 0
+        self.stats_start = time.perf_counter()
+
+    @property
+    def sender(self):
+        return self._sender
+
+    @sender.setter
+    def sender(self, sender):
+        if sender is not None and not hasattr(sender, ENCODER_ATTRIBUTE):
+            raise RuntimeError(
+                f"aiortc {aiortc.__version__} has no {ENCODER_ATTRIBUTE}, the "
+                "encoder of the video tracks cannot be capped or timed"
+            )
+        self._sender = sender
+
+    async def next_timestamp(self):
+        # VideoStreamTrack.next_timestamp, at this track's frame rate
+        if self.readyState != "live":
+            raise MediaStreamError
+
+        if hasattr(self, "_timestamp"):
+            self._timestamp += int(VIDEO_CLOCK_RATE / self.fps)
+            wait = self._start + (self._timestamp / VIDEO_CLOCK_RATE) - time.time()
+            await asyncio.sleep(wait)
+        else:
+            self._start = time.time()
+            self._timestamp = 0
+        return self._timestamp, VIDEO_TIME_BASE
 
     async def recv(self):
         async with self.send_lock:
-            start_time = time.perf_counter()
-            # Ensure this doesn't block the event loop
-            frame = await asyncio.get_event_loop().run_in_executor(
-                None, self.camera.get_frame
-            )
+            video_frame_pts, video_frame_time_base = await self.next_timestamp()
 
-            # Since your image is in RGBA format, specify "rgba" here
-            if self.camera.depth_map:
-                video_frame = VideoFrame.from_ndarray(frame, format="rgba")
-            else:
-                video_frame = VideoFrame.from_ndarray(frame, format="bgr24")
+            start_time = time.perf_counter()
+            # The capture threads keep the newest frame ready, only the
+            # first one has to be waited for
+            video_frame = self.camera.get_video_frame(self.eye)
+            while video_frame is None:
+                await asyncio.sleep(0.005)
+                video_frame = self.camera.get_video_frame(self.eye)
 
-            video_frame.pts, video_frame.time_base = await self.next_timestamp()
+            video_frame.pts = video_frame_pts
+            video_frame.time_base = video_frame_time_base
 
             # Update frame counter
             self.frame_counter += 1
+            self.frame_times.append((time.perf_counter() - start_time) * 1000)
+            self.watch_encoder()
 
-            elapsed_time_ms = (time.perf_counter() - start_time) * 1000
-            self.frame_times.append(elapsed_time_ms)
-
-            if self.frame_counter % 50 == 0:
-                avg_time_ms = sum(self.frame_times) / 50
-                print(f"Average time to get frame in ms: {avg_time_ms}")
-                self.frame_times.clear()
+            if time.perf_counter() - self.stats_start >= self.stats_interval:
+                print(f"Video track {self.name}: {self.stats()}")
 
             return video_frame
+
+    def watch_encoder(self):
+        """Time the sender's encoder and keep it under ``max_bitrate``."""
+        if self.sender is None:
+            return
+        # Created by the sender on the first frame
+        encoder = getattr(self.sender, ENCODER_ATTRIBUTE)
+        if encoder is None:
+            return
+
+        if encoder is not self.encoder:
+            self.encoder = encoder
+            encode = encoder.encode
+
+            def timed_encode(*args, **kwargs):
+                start_time = time.perf_counter()
+                result = encode(*args, **kwargs)
+                self.encode_times.append((time.perf_counter() - start_time) * 1000)
+                return result
+
+            encoder.encode = timed_encode
+
+        if self.max_bitrate is not None:
+            if not hasattr(encoder, "target_bitrate"):
+                raise RuntimeError(
+                    f"{type(encoder).__name__} has no target bitrate to cap"
+                )
+            if encoder.target_bitrate > self.max_bitrate:
+                encoder.target_bitrate = self.max_bitrate
+
+    def stats(self):
+        """Frame rate since the last call, and mean get and encode times."""
+        now = time.perf_counter()
+        frames = self.frame_counter - self.stats_frames
+        fps = frames / (now - self.stats_start)
+        self.stats_frames = self.frame_counter
+        self.stats_start = now
+
+        encode_times = list(self.encode_times)
+        return {
+            "fps": round(fps, 1),
+            "get_frame_ms": (
+                round(sum(self.frame_times) / len(self.frame_times), 2)
+                if self.frame_times
+                else None
+            ),
+            "encode_ms": (
+                round(sum(encode_times) / len(encode_times), 2)
+                if encode_times
+                else None
+            ),
+            "target_bitrate": getattr(self.encoder, "target_bitrate", None),
+        }
@@ -0,0 +1,236 @@
+"""
+Binary serial link to the Arduino that drives the weapon ESC.
+
+Every frame is six bytes::
+
+    start     uint8    0xA5
+    type      uint8    FRAME_SETPOINT or FRAME_KEEPALIVE
+    sequence  uint8    wraps at 256
+    speed     uint16   weapon speed in 1/1000 (0-1000), little endian
+    checksum  uint8    XOR of the type, sequence and speed bytes
+
+A keepalive carries the current setpoint as well, so the Arduino can stop the
+weapon when frames stop arriving and resync after a corrupted frame.
+"""
+
+import asyncio
+import os
+import struct
+import threading
+
+import serial
+
+FRAME_START = 0xA5
+FRAME_SETPOINT = 0x01
+FRAME_KEEPALIVE = 0x02
+
+FRAME_FORMAT = "<BBBHB"
+FRAME_SIZE = struct.calcsize(FRAME_FORMAT)
+
+
+def checksum(data):
+    value = 0
+    for byte in data:
+        value ^= byte
+    return value
+
+
+def encode_frame(frame_type, sequence, speed):
+    speed = round(max(min(speed, 1), 0) * 1000)
+    body = struct.pack("<BBH", frame_type, sequence & 0xFF, speed)
+    return bytes((FRAME_START,)) + body + bytes((checksum(body),))
+
+
+def decode_frames(buffer):
+    """
+    Decode the complete frames in ``buffer``.
+
+    Bytes before a start byte and frames with a bad checksum are skipped.
+
+    Returns
+    -------
+    tuple
+        ``([(type, sequence, speed), ...], remaining_bytes)``
+    """
+    frames = []
+    buffer = bytes(buffer)
+    while True:
+        start = buffer.find(FRAME_START)
+        if start < 0:
+            return frames, b""
+        buffer = buffer[start:]
+        if len(buffer) < FRAME_SIZE:
+            return frames, buffer
+
+        _, frame_type, sequence, speed, check = struct.unpack(
+            FRAME_FORMAT, buffer[:FRAME_SIZE]
+        )
+        if check != checksum(buffer[1 : FRAME_SIZE - 1]):
+            buffer = buffer[1:]
+            continue
+
+        frames.append((frame_type, sequence, speed / 1000))
+        buffer = buffer[FRAME_SIZE:]
+
+
+class ArduinoPWMController:
+    """
+    Send the weapon speed to the Arduino from an asyncio writer thread.
+
+    ``update_speed`` can be called from any thread and only stores the newest
+    setpoint; the writer sends it as soon as the serial port can take it, so
+    setpoints that arrive while a frame is still going out are coalesced.
+    When the setpoint does not change a keepalive is sent every
+    ``keepalive_interval`` seconds.
+
+    ``stats`` tells apart updates that repeated the setpoint, which need no
+    frame, from changes that were coalesced into a later one.
+    """
+
+    def __init__(
+        self,
+        port="/dev/ttyACM0",
+        baudrate=115200,
+        keepalive_interval=0.1,
+        startup_delay=2,
+    ):
+        self.port = port
+        self.baudrate = baudrate
+        self.keepalive_interval = keepalive_interval
+        self.startup_delay = startup_delay  # the Arduino resets when opened
+        self.frame_time = FRAME_SIZE * 10 / baudrate  # 8N1
+        self.serial_connection = None
+
+        self.setpoint = 0.0
+        self.sent_setpoint = None
+        self.sequence = 0
+        self.loop = None
+        self.wakeup = None
+        self.thread = None
+        self.running = False
+
+        self.updates = 0
+        self.unchanged = 0
+        self.changes = 0
+        self.coalesced = 0
+        self.frames_sent = 0
+        self.keepalives_sent = 0
+
+    def connect(self):
+        try:
+            self.serial_connection = serial.Serial(
+                self.port, self.baudrate, timeout=0, write_timeout=0
+            )
+        except serial.SerialException as e:
+            print("Error connecting to Arduino:", e)
+            return
+
+        os.set_blocking(self.serial_connection.fileno(), False)
+        self.loop = asyncio.new_event_loop()
+        self.wakeup = asyncio.Event()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        print("Connected to Arduino on port", self.port)
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.writer())
+        except Exception as e:
+            print(f"Arduino writer stopped: {e}")
+        finally:
+            self.loop.close()
+
+    def update_speed(self, speed):
+        self.updates += 1
+        if speed == self.setpoint:
+            self.unchanged += 1
+        else:
+            self.changes += 1
+        self.setpoint = speed
+        if self.loop is not None and self.running:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    async def writer(self):
+        await asyncio.sleep(self.startup_delay)
+        fd = self.serial_connection.fileno()
+
+        last_sent = link_free = self.loop.time()
+        changes_sent = 0
+
+        while self.running:
+            timeout = last_sent + self.keepalive_interval - self.loop.time()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), max(timeout, 0))
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            if not self.running:
+                break
+
+            # Frames queued faster than the baud rate wait in the driver's
+            # buffer, so the newest setpoint would arrive late
+            delay = link_free - self.loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            changes = self.changes
+            setpoint = self.setpoint
+            if setpoint != self.sent_setpoint:
+                frame_type = FRAME_SETPOINT
+            elif self.loop.time() - last_sent >= self.keepalive_interval:
+                frame_type = FRAME_KEEPALIVE
+            else:
+                continue
+
+            self.sequence = (self.sequence + 1) & 0xFF
+            await self.write(fd, encode_frame(frame_type, self.sequence, setpoint))
+            self.sent_setpoint = setpoint
+            last_sent = self.loop.time()
+            link_free = max(link_free, last_sent) + self.frame_time
+            if frame_type == FRAME_SETPOINT:
+                self.frames_sent += 1
+                # Every change since the last setpoint frame but the newest
+                self.coalesced += max(changes - changes_sent - 1, 0)
+                changes_sent = changes
+            else:
+                self.keepalives_sent += 1
+
+    async def write(self, fd, data):
+        """Write all of ``data`` without blocking the loop."""
+        while data:
+            try:
+                written = os.write(fd, data)
+                data = data[written:]
+            except BlockingIOError:
+                pass
+            if data:
+                await self.writable(fd)
+
+    async def writable(self, fd):
+        ready = self.loop.create_future()
+        self.loop.add_writer(fd, ready.set_result, None)
+        try:
+            await ready
+        finally:
+            self.loop.remove_writer(fd)
+
+    def stats(self):
+        return {
+            "updates": self.updates,
+            "unchanged": self.unchanged,
+            "coalesced": self.coalesced,
+            "frames_sent": self.frames_sent,
+            "keepalives_sent": self.keepalives_sent,
+        }
+
+    def disconnect(self):
+        if self.running:
+            self.running = False
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+            self.thread.join(timeout=1)
+            self.thread = None
+        if self.serial_connection and self.serial_connection.is_open:
+            self.serial_connection.close()
+            print(f"Disconnected from Arduino: {self.stats()}")
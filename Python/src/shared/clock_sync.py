@@ -0,0 +1,112 @@
+"""
+Round-trip time and clock offset estimation from ping/pong messages.
+
+Both ends use ``time.perf_counter()`` timestamps. A ping carries the sender's
+send time ``t0``; the pong echoes it together with the receive time ``t1`` and
+send time ``t2`` on the other end, and the pinger notes the arrival ``t3``::
+
+    rtt    = (t3 - t0) - (t2 - t1)
+    offset = ((t1 - t0) + (t2 - t3)) / 2      # remote clock - local clock
+
+As in NTP, the offset is taken from the sample with the lowest RTT in the
+window, because that sample had the least queueing delay.
+"""
+
+from collections import deque
+from time import perf_counter
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class ClockSync:
+    def __init__(self, window=256):
+        self.samples = deque(maxlen=window)  # (rtt, offset) in seconds
+        self.best = None  # the sample with an offset and the lowest RTT
+        self.last_rtt = None
+
+    @staticmethod
+    def ping_message():
+        return {"ping": perf_counter()}
+
+    @staticmethod
+    def pong_message(ping, received):
+        """Answer a ping message that arrived at ``received``."""
+        return {"pong": ping["ping"], "received": received, "sent": perf_counter()}
+
+    def add_pong(self, pong, received):
+        """
+        Add the sample from a pong that arrived at ``received``.
+
+        Pongs from peers that only echo the ping time give an RTT without
+        offset and are not used for the offset estimate.
+
+        Returns
+        -------
+        float
+            The round-trip time of this sample in seconds.
+        """
+        t0 = pong["pong"]
+        if "received" in pong and "sent" in pong:
+            t1, t2 = pong["received"], pong["sent"]
+            rtt = (received - t0) - (t2 - t1)
+            offset = ((t1 - t0) + (t2 - received)) / 2
+        else:
+            rtt = received - t0
+            offset = None
+
+        self.last_rtt = rtt
+        sample = (rtt, offset)
+        full = len(self.samples) == self.samples.maxlen
+        evicted = self.samples[0] if full else None
+        self.samples.append(sample)
+
+        if offset is not None and (self.best is None or sample < self.best):
+            self.best = sample
+        elif evicted is not None and evicted == self.best:
+            # Only when the best sample leaves the window
+            self.best = min(
+                (sample for sample in self.samples if sample[1] is not None),
+                default=None,
+            )
+        return rtt
+
+    @property
+    def offset(self):
+        """Remote clock minus local clock in seconds, None until known."""
+        return None if self.best is None else self.best[1]
+
+    def to_local(self, remote_timestamp):
+        """Convert a timestamp from the remote clock to the local clock."""
+        offset = self.offset
+        if offset is None:
+            return None
+        return remote_timestamp - offset
+
+    def one_way_latency(self, remote_timestamp, received):
+        """Seconds between a remote send time and its local arrival."""
+        local_timestamp = self.to_local(remote_timestamp)
+        if local_timestamp is None:
+            return None
+        return received - local_timestamp
+
+    def rtt_percentiles(self):
+        """p50/p95/p99 round-trip time over the window, in milliseconds."""
+        rtts = [rtt * 1000 for rtt, _ in self.samples]
+        return {
+            "p50": percentile(rtts, 0.50),
+            "p95": percentile(rtts, 0.95),
+            "p99": percentile(rtts, 0.99),
+        }
+
+    def stats(self):
+        offset = self.offset
+        return {
+            "samples": len(self.samples),
+            "rtt_ms": self.rtt_percentiles(),
+            "offset_ms": None if offset is None else offset * 1000,
+        }
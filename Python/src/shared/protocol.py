@@ -0,0 +1,137 @@
+"""
+Wire format for the control messages that go from the client to the bot.
+
+Motion commands (x, y, speed, weapon_speed) are sent as a small fixed-layout
+binary packet instead of a JSON dict. Everything else (ping/pong, config,
+status messages) stays JSON, so a receiver only has to look at the message type:
+``bytes`` is a binary packet, ``str`` is JSON.
+
+Packet layout (network byte order, 30 bytes)::
+
+    version    uint8    PROTOCOL_VERSION
+    type       uint8    MSG_MOTION
+    sequence   uint32   wraps around at 2**32
+    x          float32
+    y          float32
+    speed      float32
+    weapon     float32
+    timestamp  float64  sender's ``time.perf_counter()`` at send time
+"""
+
+import json
+import struct
+from collections import namedtuple
+
+PROTOCOL_VERSION = 1
+
+# Reliable, ordered channel for ping/config/telemetry and an unordered channel
+# without retransmits for motion setpoints
+CONTROL_CHANNEL_LABEL = "dataChannel"
+MOTION_CHANNEL_LABEL = "motionChannel"
+
+MSG_MOTION = 1
+
+MOTION_STRUCT = struct.Struct("!BBIffffd")
+SEQUENCE_MODULO = 2**32
+
+MotionCommand = namedtuple(
+    "MotionCommand", ["x", "y", "speed", "weapon_speed", "sequence", "timestamp"]
+)
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+class SequenceFilter:
+    """
+    Drop motion packets that arrive after a newer one was already applied.
+
+    Sequence numbers are compared modulo 2**32, so a wrap-around counts as
+    newer. Packets without a sequence number (legacy JSON) are always accepted.
+    """
+
+    def __init__(self):
+        self.last_sequence = None
+        self.dropped = 0
+
+    def accept(self, sequence):
+        if sequence is None:
+            return True
+
+        if self.last_sequence is not None:
+            delta = (sequence - self.last_sequence) % SEQUENCE_MODULO
+            if delta == 0 or delta >= SEQUENCE_MODULO // 2:
+                self.dropped += 1
+                return False
+
+        self.last_sequence = sequence
+        return True
+
+    def reset(self):
+        self.last_sequence = None
+
+
+def is_motion_command(command):
+    """Return True when a command dict carries a complete motion setpoint."""
+    return (
+        "x" in command
+        and "y" in command
+        and "speed" in command
+        and "weapon_speed" in command
+    )
+
+
+def encode_motion(x, y, speed, weapon_speed, sequence, timestamp):
+    return MOTION_STRUCT.pack(
+        PROTOCOL_VERSION,
+        MSG_MOTION,
+        sequence % SEQUENCE_MODULO,
+        x,
+        y,
+        speed,
+        weapon_speed,
+        timestamp,
+    )
+
+
+def decode_motion(packet):
+    """
+    Decode a binary motion packet.
+
+    Raises
+    ------
+    ProtocolError
+        If the packet has the wrong size, version or message type.
+    """
+    if len(packet) != MOTION_STRUCT.size:
+        raise ProtocolError(f"Invalid motion packet size: {len(packet)} bytes")
+
+    version, msg_type, sequence, x, y, speed, weapon_speed, timestamp = (
+        MOTION_STRUCT.unpack(packet)
+    )
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version: {version}")
+    if msg_type != MSG_MOTION:
+        raise ProtocolError(f"Unsupported message type: {msg_type}")
+
+    return MotionCommand(x, y, speed, weapon_speed, sequence, timestamp)
+
+
+def decode_message(message):
+    """
+    Decode anything received on a control channel.
+
+    Returns a ``MotionCommand`` for binary packets and for legacy JSON motion
+    dicts (sequence and timestamp are ``None`` for the latter), and the plain
+    dict for every other JSON message.
+    """
+    if isinstance(message, (bytes, bytearray, memoryview)):
+        return decode_motion(bytes(message))
+
+    data = json.loads(message)
+    if isinstance(data, dict) and is_motion_command(data):
+        return MotionCommand(
+            data["x"], data["y"], data["speed"], data["weapon_speed"], None, None
+        )
+    return data
@@ -0,0 +1,56 @@
+"""
+Time from launching the aim assist process to its ready message, and the
+start-up breakdown it reports, over a few launches.
+
+Every launch is a fresh ``python -m src.client.aim_assist`` like the client
+starts, so imports are included. The first launch after a model change also
+fuses or exports the model; later ones load the cached file. The detection
+and backend come from docs/config.yaml.
+
+Run from the Python directory:
+
+    python -m tests.aim_assist_startup_benchmark --runs 3
+"""
+
+import argparse
+import subprocess
+import sys
+from time import perf_counter
+
+from src.client.frame_ring import connect_to_aim_assist
+
+
+def launch(port):
+    start = perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "src.client.aim_assist"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        sock, startup = connect_to_aim_assist(
+            port, alive=lambda: process.poll() is None
+        )
+        ready = perf_counter() - start
+        sock.close()
+    finally:
+        process.terminate()
+        process.wait()
+    return ready, startup
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=65432)
+    args = parser.parse_args()
+
+    for run in range(args.runs):
+        ready, startup = launch(args.port)
+        # What the process spent before AimAssist started: interpreter and imports
+        startup["before_s"] = round(ready - startup["total_s"], 3)
+        print(f"launch {run + 1}: ready after {ready:.2f} s, {startup}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Display rate and latency of VideoWindow while aim assist is slower than the
+camera.
+
+A stand-in aim assist process reads frames from the FrameRing and answers
+with a result after ``--detect-ms``, like YOLO at about 8 fps. Frames are fed
+to a VideoWindow at ``--fps``; ``show`` is replaced to record when a frame
+would be on screen.
+
+Before the metadata results, the window showed aim assist's annotated frame,
+so the display ran at aim assist's rate and every frame was at least one
+detection old.
+
+Run from the Python directory:
+
+    python -m tests.aim_overlay_benchmark --seconds 5
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import multiprocessing
+import socket
+from time import perf_counter
+
+import numpy as np
+from av import VideoFrame
+from src.client.frame_ring import (
+    MESSAGE_ATTACH,
+    MESSAGE_FRAME,
+    SEQUENCE,
+    FrameRing,
+    ready_message,
+    receive_message,
+    result_message,
+)
+from src.shared.clock_sync import percentile
+
+with contextlib.redirect_stdout(io.StringIO()):
+    from src.client.video import VideoWindow
+
+
+async def serve(port, detect_ms):
+    loop = asyncio.get_running_loop()
+    server = socket.create_server(("127.0.0.1", port))
+    server.setblocking(False)
+    sock, _ = await loop.sock_accept(server)
+    await loop.sock_sendall(sock, ready_message({}))
+    ring = None
+    while True:
+        try:
+            message_type, payload = await receive_message(loop, sock)
+        except ConnectionError:
+            break
+        if message_type == MESSAGE_ATTACH:
+            ring = FrameRing.attach(json.loads(payload)["frames"])
+        elif message_type == MESSAGE_FRAME:
+            sequence = SEQUENCE.unpack(payload)[0]
+            frame, _ = ring.read(sequence)
+            await asyncio.sleep(detect_ms / 1000)
+            result = {
+                "sequence": sequence,
+                "box": [100, 100, 80, 80],
+                "state": "tracking",
+                "position_ratio": 0.3,
+                "steering": True,
+            }
+            await loop.sock_sendall(sock, result_message(result))
+    ring.close()
+
+
+def aim_assist_stand_in(port, detect_ms):
+    asyncio.run(serve(port, detect_ms))
+
+
+class TimedWindow(VideoWindow):
+    def __init__(self, port):
+        super().__init__(rotation=0, aim_assist_port=port)
+        self.added = {}
+        self.latencies = []
+        self.shown = 0
+
+    async def add_frame_queue(self, frame):
+        self.added[frame.pts] = perf_counter()
+        await super().add_frame_queue(frame)
+
+    def show(self, frame):
+        self.shown += 1
+        return False
+
+
+async def run(args):
+    window = TimedWindow(args.port)
+    shown_pts = []
+
+    # Record which frame was shown from the ring sequence of its display
+    original_read = window.frame_ring.read
+
+    def read(sequence):
+        shown_pts.append((sequence, perf_counter()))
+        return original_read(sequence)
+
+    window.frame_ring.read = read
+
+    tasks = [
+        asyncio.create_task(coroutine)
+        for coroutine in (
+            window.process_frames(),
+            window.display_frame(),
+            window.receive_results(),
+        )
+    ]
+
+    image = np.zeros((720, 1280, 3), np.uint8)
+    frames = int(args.seconds * args.fps)
+    start = perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for index in range(frames):
+            frame = VideoFrame.from_ndarray(image, format="bgr24").reformat(
+                format="yuv420p"
+            )
+            frame.pts = index + 1  # the ring sequence of the frame
+            await window.add_frame_queue(frame)
+            delay = start + (index + 1) / args.fps - perf_counter()
+            await asyncio.sleep(max(delay, 0))
+    elapsed = perf_counter() - start
+    await asyncio.sleep(0.2)
+
+    for task in tasks:
+        task.cancel()
+    latencies = [
+        (shown - window.added[sequence]) * 1000
+        for sequence, shown in shown_pts
+        if sequence in window.added
+    ]
+    window.client_socket.close()
+    window.frame_ring.read = original_read
+    window.display_buffer = None
+    window.preprocess_executor.shutdown()
+    window.frame_ring.close()
+    return {
+        "display_fps": window.shown / elapsed,
+        "aim_assist_fps": window.aim_results / elapsed,
+        "latency_p50_ms": percentile(latencies, 0.50),
+        "latency_p99_ms": percentile(latencies, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fps", type=float, default=30, help="camera frame rate")
+    parser.add_argument("--detect-ms", type=float, default=125)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--port", type=int, default=65434)
+    args = parser.parse_args()
+
+    process = multiprocessing.Process(
+        target=aim_assist_stand_in, args=(args.port, args.detect_ms)
+    )
+    process.start()
+    result = asyncio.run(run(args))
+    process.join(timeout=5)
+    print(
+        f"camera {args.fps:.0f} fps, detection {args.detect_ms:.0f} ms: "
+        f"display {result['display_fps']:.1f} fps, "
+        f"aim assist {result['aim_assist_fps']:.1f} fps, "
+        f"frame to display p50={result['latency_p50_ms']:.2f} ms "
+        f"p99={result['latency_p99_ms']:.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Loopback comparison of the reliable and the unordered motion channel under
+simulated packet loss.
+
+Two peer connections are connected inside one process. Loss and one-way delay
+are injected below SCTP by wrapping the DTLS transport's send path, so the
+reliable channel has to retransmit (and holds back newer packets meanwhile)
+while the unordered channel just loses them. The receiver applies the same
+SequenceFilter as the bot.
+
+Run from the Python directory:
+
+    python -m tests.data_channel_loss_benchmark --loss 0.05 --delay 0.02
+"""
+
+import argparse
+import asyncio
+import random
+from time import perf_counter
+
+from aiortc import RTCPeerConnection
+from aiortc.rtcdtlstransport import RTCDtlsTransport
+from src.shared.protocol import (
+    CONTROL_CHANNEL_LABEL,
+    MOTION_CHANNEL_LABEL,
+    SequenceFilter,
+    decode_message,
+    encode_motion,
+)
+
+original_send_data = RTCDtlsTransport._send_data
+link = {"loss": 0.0, "delay": 0.0}
+
+
+async def lossy_send_data(self, data):
+    if random.random() < link["loss"]:
+        return
+
+    async def delayed():
+        await asyncio.sleep(link["delay"])
+        try:
+            await original_send_data(self, data)
+        except ConnectionError:
+            pass
+
+    asyncio.ensure_future(delayed())
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return float("nan")
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_mode(unordered, args):
+    link["loss"] = 0.0
+    link["delay"] = 0.0
+
+    sender = RTCPeerConnection()
+    receiver = RTCPeerConnection()
+
+    control_channel = sender.createDataChannel(CONTROL_CHANNEL_LABEL)
+    if unordered:
+        motion_channel = sender.createDataChannel(
+            MOTION_CHANNEL_LABEL, ordered=False, maxRetransmits=0
+        )
+    else:
+        motion_channel = control_channel
+
+    latencies = []
+    sequence_filter = SequenceFilter()
+    opened = asyncio.Event()
+
+    def on_message(message):
+        command = decode_message(message)
+        if sequence_filter.accept(command.sequence):
+            latencies.append((perf_counter() - command.timestamp) * 1000)
+
+    @receiver.on("datachannel")
+    def on_datachannel(channel):
+        channel.on("message", on_message)
+
+    @motion_channel.on("open")
+    def on_open():
+        opened.set()
+
+    await sender.setLocalDescription(await sender.createOffer())
+    await receiver.setRemoteDescription(sender.localDescription)
+    await receiver.setLocalDescription(await receiver.createAnswer())
+    await sender.setRemoteDescription(receiver.localDescription)
+    await asyncio.wait_for(opened.wait(), 10)
+
+    # Only degrade the link once the connection is up
+    link["loss"] = args.loss
+    link["delay"] = args.delay
+
+    interval = 1 / args.rate
+    count = int(args.duration * args.rate)
+    for sequence in range(1, count + 1):
+        motion_channel.send(encode_motion(0.0, 1.0, 0.5, 0.0, sequence, perf_counter()))
+        await asyncio.sleep(interval)
+
+    # Give retransmissions time to finish
+    await asyncio.sleep(2)
+    link["loss"] = 0.0
+
+    await sender.close()
+    await receiver.close()
+
+    return {
+        "sent": count,
+        "applied": len(latencies),
+        "out_of_order_dropped": sequence_filter.dropped,
+        "p50_ms": percentile(latencies, 0.50),
+        "p99_ms": percentile(latencies, 0.99),
+        "max_ms": max(latencies, default=float("nan")),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--loss", type=float, default=0.05)
+    parser.add_argument("--delay", type=float, default=0.02)
+    parser.add_argument("--rate", type=float, default=100, help="commands/sec")
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    args = parser.parse_args()
+
+    RTCDtlsTransport._send_data = lossy_send_data
+
+    print(f"loss={args.loss:.0%} one-way delay={args.delay * 1000:.0f} ms")
+    for unordered in (False, True):
+        result = await run_mode(unordered, args)
+        label = "unordered" if unordered else "reliable"
+        print(
+            f"{label:<10} sent={result['sent']} applied={result['applied']} "
+            f"dropped={result['out_of_order_dropped']} "
+            f"p50={result['p50_ms']:.1f} ms p99={result['p99_ms']:.1f} ms "
+            f"max={result['max_ms']:.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,160 @@
+"""
+Cost per frame of the old aim assist loop, which ran the detector on every
+frame and the tracker on top, against the DetectionScheduler.
+
+Synthetic 640x360 frames show a yellow square moving across a gradient that
+disappears for a while in the middle. The detector is the colour detection
+of AimAssist, padded to ``--detect-ms`` to stand in for YOLO on a CPU; the
+tracker is the real Nano tracker with the models in docs/, which also reports
+the confidence the scheduler uses.
+
+Run from the Python directory:
+
+    python -m tests.detection_schedule_benchmark --frames 300 --detect-ms 120
+"""
+
+import argparse
+import os
+import time
+from time import perf_counter
+
+import cv2
+import numpy as np
+from src.client.detection_scheduler import DETECT, DetectionScheduler
+
+WIDTH, HEIGHT, SIDE = 640, 360, 60
+LOWER = np.array([15, 100, 60], dtype=np.uint8)
+UPPER = np.array([35, 255, 255], dtype=np.uint8)
+DOCS = os.path.join(os.path.dirname(__file__), "..", "..", "docs")
+
+
+def create_tracker():
+    params = cv2.TrackerNano_Params()
+    params.backbone = os.path.join(DOCS, "nanotrack_backbone.onnx")
+    params.neckhead = os.path.join(DOCS, "nanotrack_head.onnx")
+    return cv2.TrackerNano_create(params)
+
+
+def make_frames(count):
+    gradient = np.tile(np.linspace(40, 200, WIDTH, dtype=np.uint8), (HEIGHT, 1))
+    background = np.repeat(gradient[:, :, np.newaxis], 3, axis=2)
+    frames, boxes = [], []
+    for index in range(count):
+        frame = background.copy()
+        x = int((WIDTH - SIDE) * (0.5 + 0.45 * np.sin(index / 40)))
+        y = int((HEIGHT - SIDE) * (0.5 + 0.3 * np.cos(index / 55)))
+        # Out of sight for a tenth of the run
+        if not 0.45 * count <= index < 0.55 * count:
+            frame[y : y + SIDE, x : x + SIDE] = (0, 220, 220)  # yellow in BGR
+            boxes.append((x, y, SIDE, SIDE))
+        else:
+            boxes.append(None)
+        frames.append(frame)
+    return frames, boxes
+
+
+def detect(frame, detect_ms):
+    start = perf_counter()
+    mask = cv2.inRange(cv2.cvtColor(frame, cv2.COLOR_BGR2HSV), LOWER, UPPER)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    delay = detect_ms / 1000 - (perf_counter() - start)
+    if delay > 0:
+        time.sleep(delay)
+    if contours:
+        biggest = max(contours, key=cv2.contourArea)
+        if cv2.contourArea(biggest) > 500:
+            return cv2.boundingRect(biggest)
+    return None
+
+
+def iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    w = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    h = max(0, min(ay + ah, by + bh) - max(ay, by))
+    return w * h / (aw * ah + bw * bh - w * h)
+
+
+def run_old(frames, detect_ms, tracked_frames):
+    """The old process_loop: detect, then start or update the tracker."""
+    tracker, tracking, tracker_frames = create_tracker(), False, 0
+    boxes, times = [], []
+    for frame in frames:
+        start = perf_counter()
+        box = detect(frame, detect_ms)
+        if box is not None and not tracking:
+            tracker.init(frame, box)
+            tracking, tracker_frames = True, 0
+        elif box is not None:
+            success, tracked = tracker.update(frame)
+            box = tuple(map(int, tracked)) if success else None
+            tracker_frames -= 1
+            if not success or tracker_frames < -tracked_frames:
+                tracking = False
+        boxes.append(box)
+        times.append(perf_counter() - start)
+    return boxes, times, None
+
+
+def run_scheduled(frames, detect_ms, tracked_frames, lost_frames, budget):
+    scheduler = DetectionScheduler(tracked_frames, lost_frames, budget)
+    tracker = create_tracker()
+    boxes, times = [], []
+    for frame in frames:
+        start = perf_counter()
+        decision = scheduler.decide()
+        if decision == DETECT:
+            box = detect(frame, detect_ms)
+            if box is not None:
+                tracker.init(frame, box)
+            scheduler.detected(box is not None)
+        else:
+            success, tracked = tracker.update(frame)
+            scheduler.tracked(success, tracker.getTrackingScore())
+            box = tuple(map(int, tracked)) if success else None
+        scheduler.record(decision, perf_counter() - start)
+        boxes.append(box)
+        times.append(perf_counter() - start)
+    return boxes, times, scheduler.stats()
+
+
+def summarize(name, boxes, times, truth, stats):
+    visible = [i for i, box in enumerate(truth) if box is not None]
+    found = [i for i in visible if boxes[i] is not None]
+    overlap = [iou(boxes[i], truth[i]) for i in found]
+    hidden = [i for i, box in enumerate(truth) if box is None]
+    phantom = sum(boxes[i] is not None for i in hidden)
+    mean_ms = sum(times) / len(times) * 1000
+    print(
+        f"{name:<9} {mean_ms:7.2f} ms/frame ({1000 / mean_ms:5.1f} fps), "
+        f"target boxed in {len(found) / len(visible):.0%} of visible frames, "
+        f"mean IoU {sum(overlap) / max(len(overlap), 1):.2f}, "
+        f"boxes while hidden {phantom}/{len(hidden)}" + (f", {stats}" if stats else "")
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--detect-ms", type=float, default=120)
+    parser.add_argument("--tracked-frames", type=int, default=30)
+    parser.add_argument("--lost-frames", type=int, default=6)
+    parser.add_argument("--budget-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    cv2.utils.logging.setLogLevel(cv2.utils.logging.LOG_LEVEL_ERROR)
+    frames, truth = make_frames(args.frames)
+    boxes, times, _ = run_old(frames, args.detect_ms, args.tracked_frames)
+    summarize("old", boxes, times, truth, None)
+    boxes, times, stats = run_scheduled(
+        frames,
+        args.detect_ms,
+        args.tracked_frames,
+        args.lost_frames,
+        args.budget_ms / 1000,
+    )
+    summarize("scheduled", boxes, times, truth, stats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Round trip of a frame to the aim assist process and back, JPEG over the
+localhost socket against the shared memory FrameRing.
+
+The old path JPEG-encoded every frame on the client, decoded it in aim
+assist, encoded the annotated frame again and decoded it on the client. With
+the ring only the sequence number crosses the socket, aim assist copies the
+frame out once and answers with a result message. The stand-in aim assist
+draws a rectangle, like the tracker box, and answers.
+
+Run from the Python directory:
+
+    python -m tests.frame_ring_benchmark --frames 300
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import socket
+import struct
+from time import perf_counter
+
+import cv2
+import numpy as np
+from src.client.frame_ring import (
+    MESSAGE_ATTACH,
+    MESSAGE_FRAME,
+    SEQUENCE,
+    FrameRing,
+    attach_message,
+    frame_message,
+    receive_message,
+    result_message,
+)
+from src.shared.clock_sync import percentile
+
+
+async def receive_jpeg(loop, sock):
+    data = await loop.sock_recv(sock, 4)
+    if not data:
+        return None
+    frame_length = struct.unpack("!I", data)[0]
+    frame_data = b""
+    while len(frame_data) < frame_length:
+        frame_data += await loop.sock_recv(sock, frame_length - len(frame_data))
+    return cv2.imdecode(np.frombuffer(frame_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+async def send_jpeg(loop, sock, frame):
+    _, encoded_frame = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), 90])
+    data = encoded_frame.tobytes()
+    await loop.sock_sendall(sock, struct.pack("!I", len(data)) + data)
+
+
+def annotate(frame):
+    cv2.rectangle(frame, (100, 100), (200, 200), (0, 255, 0), 2)
+
+
+async def serve(port, mode):
+    loop = asyncio.get_running_loop()
+    server = socket.create_server(("127.0.0.1", port))
+    server.setblocking(False)
+    sock, _ = await loop.sock_accept(server)
+    ring = None
+    private = None
+    while True:
+        if mode == "jpeg":
+            frame = await receive_jpeg(loop, sock)
+            if frame is None:
+                break
+            annotate(frame)
+            await send_jpeg(loop, sock, frame)
+            continue
+
+        try:
+            message_type, payload = await receive_message(loop, sock)
+        except ConnectionError:
+            break
+        if message_type == MESSAGE_ATTACH:
+            ring = FrameRing.attach(json.loads(payload)["frames"])
+        elif message_type == MESSAGE_FRAME:
+            sequence = SEQUENCE.unpack(payload)[0]
+            frame, token = ring.read(sequence)
+            if private is None:
+                private = np.empty_like(frame)
+            np.copyto(private, frame)
+            annotate(private)
+            result = {"sequence": sequence, "box": [100, 100, 100, 100]}
+            await loop.sock_sendall(sock, result_message(result))
+    if ring is not None:
+        ring.close()
+
+
+def aim_assist_stand_in(port, mode):
+    asyncio.run(serve(port, mode))
+
+
+async def run(mode, frames, port):
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    for _ in range(100):
+        try:
+            sock.connect(("127.0.0.1", port))
+            break
+        except ConnectionRefusedError:
+            await asyncio.sleep(0.05)
+    frame_ring = None
+    if mode == "ring":
+        frame_ring = FrameRing(create=True)
+        sock.sendall(attach_message(frame_ring))
+    sock.setblocking(False)
+
+    round_trips = []
+    for index, image in enumerate(frames):
+        start = perf_counter()
+        if mode == "jpeg":
+            await send_jpeg(loop, sock, image)
+            result = await receive_jpeg(loop, sock)
+        else:
+            sequence, slot = frame_ring.begin_write(image.shape)
+            np.copyto(slot, image)  # stands in for the preprocessor's output
+            frame_ring.commit(sequence)
+            await loop.sock_sendall(sock, frame_message(sequence))
+            _, payload = await receive_message(loop, sock)
+            result = json.loads(payload)
+        round_trips.append((perf_counter() - start) * 1000)
+        assert result is not None
+
+    sock.close()
+    if mode == "ring":
+        del slot
+        frame_ring.close()
+    return round_trips
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=360)
+    parser.add_argument("--port", type=int, default=65433)
+    args = parser.parse_args()
+
+    gradient = np.tile(
+        np.linspace(0, 255, args.width, dtype=np.uint8), (args.height, 1)
+    )
+    frames = []
+    for index in range(args.frames):
+        image = np.repeat(gradient[:, :, np.newaxis], 3, axis=2)
+        x = (index * 4) % (args.width - 80)
+        image[100:180, x : x + 80] = (0, 0, 255)
+        frames.append(image)
+
+    for mode in ("jpeg", "ring"):
+        process = multiprocessing.Process(
+            target=aim_assist_stand_in, args=(args.port, mode)
+        )
+        process.start()
+        round_trips = asyncio.run(run(mode, frames, args.port))
+        process.join(timeout=5)
+        print(
+            f"{mode:<5} {args.width}x{args.height}: round trip "
+            f"mean={sum(round_trips) / len(round_trips):.3f} ms "
+            f"p50={percentile(round_trips, 0.50):.3f} ms "
+            f"p99={percentile(round_trips, 0.99):.3f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
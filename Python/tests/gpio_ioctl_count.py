@@ -0,0 +1,140 @@
+"""
+Count the gpiod ioctls MotorController makes per action, with a mocked gpiod.
+
+Before the single line request, every action set the direction and enable
+line of both motors with a separate set_value call on a request per line,
+whether the values changed or not. ``LegacyLines`` replays those calls
+through the same counting gpiod. Now all lines are one request and one
+set_values call updates whatever changed.
+
+The last part releases the request behind the controller's back to check the
+re-request path: the next action requests the lines again once, with the
+current values, instead of retrying recursively.
+
+Run from the Python directory:
+
+    python -m tests.gpio_ioctl_count
+"""
+
+from src.server.sim import Simulation
+
+counts = {"request_lines": 0, "set_value": 0, "set_values": 0}
+
+
+def install_counting_gpiod():
+    import gpiod
+
+    class CountingLineRequest:
+        def __init__(self, config):
+            self.config = config
+            self.released = False
+
+        def set_value(self, offset, value):
+            if self.released:
+                raise gpiod.exception.RequestReleasedError()
+            counts["set_value"] += 1
+
+        def set_values(self, values):
+            if self.released:
+                raise gpiod.exception.RequestReleasedError()
+            counts["set_values"] += 1
+
+        def release(self):
+            self.released = True
+
+    def request_lines(path, consumer, config):
+        counts["request_lines"] += 1
+        return CountingLineRequest(config)
+
+    gpiod.request_lines = request_lines
+
+
+class LegacyLines:
+    """The old MotorController's GPIO writes, one request per line."""
+
+    def __init__(self, motor_controller):
+        import gpiod
+        from gpiod.line import Direction, Value
+
+        self.motor_controller = motor_controller
+        self.requests = {
+            name: gpiod.request_lines(
+                motor_controller.CHIP_NAME,
+                consumer=name,
+                config={
+                    motor_controller.pins[name]: gpiod.LineSettings(
+                        direction=Direction.OUTPUT, output_value=Value.INACTIVE
+                    )
+                },
+            )
+            for name in ("motor1_dir", "motor2_dir", "motor1_en", "motor2_en")
+        }
+
+    def action(self, x, y, speed, weapon_speed):
+        from gpiod.line import Value
+
+        pins = self.motor_controller.pins
+        frequencies = self.motor_controller.target_frequencies(x, y, speed)
+        for motor, frequency in frequencies.items():
+            direction = Value.ACTIVE if frequency < 0 else Value.INACTIVE
+            # Active low, set on every speed update
+            enable = Value.ACTIVE if frequency == 0 else Value.INACTIVE
+            self.requests[f"{motor}_dir"].set_value(pins[f"{motor}_dir"], direction)
+            self.requests[f"{motor}_en"].set_value(pins[f"{motor}_en"], enable)
+
+
+def run_actions(motor_controller, commands):
+    counts["set_value"] = counts["set_values"] = 0
+    for x, y, speed, weapon_speed in commands:
+        motor_controller.action(x, y, speed, weapon_speed)
+    return (counts["set_value"] + counts["set_values"]) / len(commands)
+
+
+def main():
+    simulation = Simulation()
+    simulation.install()
+    install_counting_gpiod()
+
+    from src.server.motor_controller import MotorController
+
+    # Driving forward, turning, reversing, stopping
+    commands = (
+        [(0, -1, 1.0, 0)] * 20
+        + [(0.6, -1, 1.0, 0)] * 20
+        + [(0, 1, 0.5, 0)] * 20
+        + [(0, 0, 0, 0)] * 20
+    )
+
+    motor_controller = MotorController(
+        motor1_step=13,
+        motor1_dir=17,
+        motor2_step=12,
+        motor2_dir=20,
+        motor1_en=27,
+        motor2_en=1,
+        weapon_speed=18,
+        pwm_sysfs_root=simulation.pwm_root,
+        ramp_rate=None,
+    )
+    motor_controller.weapon_data = lambda speed: None
+    print(f"line requests at start: {counts['request_lines']}")
+
+    legacy_per_action = run_actions(LegacyLines(motor_controller), commands)
+    per_action = run_actions(motor_controller, commands)
+    print(f"old: {legacy_per_action:.2f} ioctls/action (set_value per line)")
+    print(f"new: {per_action:.2f} ioctls/action")
+
+    # Re-request after the lines were released elsewhere
+    motor_controller.lines.release()
+    counts["request_lines"] = 0
+    run_actions(motor_controller, [(0, -1, 1.0, 0)])
+    lines = motor_controller.lines.config
+    print(f"re-requests after release: {counts['request_lines']}")
+    print(f"motor1_dir after re-request: {lines[17].get('output_value')}")
+
+    motor_controller.cleanup()
+    simulation.cleanup()
+
+
+if __name__ == "__main__":
+    main()
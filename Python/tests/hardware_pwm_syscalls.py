@@ -0,0 +1,122 @@
+"""
+Count the sysfs syscalls HardwarePWM makes per MotorController.action.
+
+The PWM chip and gpiod are the simulated hardware of ``src.server.sim``, so
+this runs on any Linux machine. The weapon goes over serial and is not part
+of the count.
+
+The old HardwarePWM opened, wrote and closed the attribute file on every
+change, and the old StepController changed the period and the duty cycle of
+both motors on every action; ``LegacyStepWrites`` replays those writes on
+the same files. The new one makes a single pwrite, and none at all when the
+value did not change. Opens are counted with an audit hook and writes from
+the kernel's syscw counter in /proc/self/io; every old open is closed again.
+The fstat and ioctl Python's open adds are not counted, so the old figure is
+a lower bound.
+
+Run from the Python directory:
+
+    python -m tests.hardware_pwm_syscalls
+"""
+
+import contextlib
+import io
+import os
+import sys
+
+from src.server.sim import Simulation
+
+opens = [0]
+
+
+def count_opens(event, args):
+    if event == "open":
+        opens[0] += 1
+
+
+def write_syscalls():
+    with open("/proc/self/io") as f:
+        return int(f.read().split("syscw:")[1].split()[0])
+
+
+def syscalls(target, commands):
+    """Opens and write syscalls of ``target.action`` over ``commands``."""
+    writes = write_syscalls()
+    opens[0] = 0  # reading /proc/self/io opens it too
+    with contextlib.redirect_stdout(io.StringIO()):
+        for x, y, speed, weapon_speed in commands:
+            target.action(x, y, speed, weapon_speed)
+    opened = opens[0]
+    return opened, write_syscalls() - writes
+
+
+class LegacyStepWrites:
+    """The old StepController.update_speed writes of both motors."""
+
+    def __init__(self, motor_controller):
+        self.motor_controller = motor_controller
+
+    def action(self, x, y, speed, weapon_speed):
+        frequencies = self.motor_controller.target_frequencies(x, y, speed)
+        for motor, frequency in frequencies.items():
+            pwm_dir = self.motor_controller.step_controllers[motor].pwm.pwm_dir
+            period = int(1e9 / max(abs(frequency), 10))
+            self.echo(period, os.path.join(pwm_dir, "period"))
+            duty_cycle = period // 2 if frequency else 0
+            self.echo(duty_cycle, os.path.join(pwm_dir, "duty_cycle"))
+
+    def echo(self, message, file):
+        with open(file, "w") as f:
+            f.write(f"{message}\n")
+
+
+def main():
+    simulation = Simulation()
+    simulation.install()
+
+    from src.server.motor_controller import MotorController
+
+    sys.addaudithook(count_opens)
+
+    motor_controller = MotorController(
+        motor1_step=13,
+        motor1_dir=17,
+        motor2_step=12,
+        motor2_dir=20,
+        motor1_en=27,
+        motor2_en=1,
+        weapon_speed=18,
+        pwm_sysfs_root=simulation.pwm_root,
+        ramp_rate=None,  # apply every action directly
+    )
+    motor_controller.weapon_data = lambda speed: None
+
+    # Driving forward, holding the stick, turning, holding, stopping
+    commands = (
+        [(0, -1, 1.0, 0)] * 20
+        + [(0.6, -1, 1.0, 0)] * 20
+        + [(0, -1, 0.5, 0)] * 20
+        + [(0, 0, 0, 0)] * 20
+    )
+
+    legacy_opens, legacy_writes = syscalls(LegacyStepWrites(motor_controller), commands)
+    new_opens, new_writes = syscalls(motor_controller, commands)
+
+    motor_controller.cleanup()
+    simulation.cleanup()
+
+    actions = len(commands)
+    legacy_syscalls = 2 * legacy_opens + legacy_writes  # open + write + close
+    print(f"actions: {actions}")
+    print(
+        f"old HardwarePWM: {legacy_syscalls / actions:.2f} syscalls/action "
+        f"({legacy_opens} opens, {legacy_writes} writes)"
+    )
+    print(
+        f"new HardwarePWM: {(new_opens + new_writes) / actions:.2f} syscalls/action "
+        f"({new_opens} opens, {new_writes} writes)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Input-to-send latency of the old 10 ms polling loop against the event-driven
+ApplicationController.
+
+A scripted controller changes its stick state from a background thread at
+random intervals, like a driver would. The benchmark records when each change
+happened and when the matching command was handed to the network client. It
+also measures the CPU time used while the sticks are idle.
+
+Run from the Python directory:
+
+    python -m tests.input_latency_benchmark
+"""
+
+import asyncio
+import random
+import threading
+import time
+from time import perf_counter
+
+from src.client.inputs import InputController
+from src.client.logic import ApplicationController
+
+
+class ScriptedController(InputController):
+    def __init__(self, changes, mean_interval):
+        super().__init__()
+        self.changes = changes
+        self.mean_interval = mean_interval
+        self.state = (0, 0, 0, 0)
+        self.change_times = {}
+        self.done = threading.Event()
+
+    def get_input(self):
+        return self.state
+
+    def start(self, loop=None, events=None):
+        if events is not None:
+            self.attach(loop, events)
+        threading.Thread(target=self.drive, daemon=True).start()
+
+    def drive(self):
+        for step in range(1, self.changes + 1):
+            time.sleep(random.expovariate(1 / self.mean_interval))
+            self.state = (round(step / self.changes, 4), 1, 0.5, 0)
+            self.change_times[self.state] = perf_counter()
+            self.publish(self.state)
+        self.done.set()
+
+
+class RecordingNetClient:
+    def __init__(self):
+        self.send_times = {}
+
+    async def send_command(self, command):
+        state = (command["x"], command["y"], command["speed"], command["weapon_speed"])
+        self.send_times.setdefault(state, perf_counter())
+
+
+class BenchApplicationController(ApplicationController):
+    def __init__(self, controller, **kwargs):
+        self.bench_controller = controller
+        super().__init__(None, "bench", None, **kwargs)
+
+    def get_control_input(self):
+        self.controller = self.bench_controller
+
+    def set_net_client(self, uri):
+        self.net_client = RecordingNetClient()
+
+    def record_input_latency(self, latency):
+        pass
+
+
+async def polling_loop(controller, net_client):
+    # The loop ApplicationController.run used before
+    old_data = ""
+    controller.start()
+    while True:
+        x, y, speed, weapon_speed = controller.get_input()
+        data = f"{x}, {y}, {speed}, {weapon_speed}"
+        if old_data != data:
+            await net_client.send_command(
+                {"x": x, "y": y, "speed": speed, "weapon_speed": weapon_speed}
+            )
+            old_data = data
+        await asyncio.sleep(0.01)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return float("nan")
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+async def run_mode(event_driven, changes, mean_interval, idle_seconds):
+    controller = ScriptedController(changes, mean_interval)
+    if event_driven:
+        app = BenchApplicationController(controller)
+        net_client = app.net_client
+        task = asyncio.create_task(app.forward_input())
+    else:
+        net_client = RecordingNetClient()
+        task = asyncio.create_task(polling_loop(controller, net_client))
+
+    while not controller.done.is_set():
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(0.1)
+
+    # CPU used while nothing changes
+    cpu_start = time.process_time()
+    await asyncio.sleep(idle_seconds)
+    idle_cpu = time.process_time() - cpu_start
+
+    task.cancel()
+
+    latencies = [
+        (net_client.send_times[state] - changed) * 1000
+        for state, changed in controller.change_times.items()
+        if state in net_client.send_times
+    ]
+    return {
+        "changes": changes,
+        "sent": len(latencies),
+        "p50_ms": percentile(latencies, 0.50),
+        "p99_ms": percentile(latencies, 0.99),
+        "idle_cpu_ms_per_s": idle_cpu / idle_seconds * 1000,
+    }
+
+
+async def main():
+    for event_driven in (False, True):
+        result = await run_mode(
+            event_driven, changes=300, mean_interval=0.03, idle_seconds=3
+        )
+        label = "event-driven" if event_driven else "10 ms polling"
+        print(
+            f"{label:<14} changes={result['changes']} sent={result['sent']} "
+            f"p50={result['p50_ms']:.2f} ms p99={result['p99_ms']:.2f} ms "
+            f"idle cpu={result['idle_cpu_ms_per_s']:.2f} ms/s"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,185 @@
+"""
+Time the event loop spends on motor commands, with the MotorController
+called on the loop against the ActuatorThread.
+
+The loop runs a simulated video stream (30 fps of frame work in the default
+executor, like CameraStreamTrack) and a stream of changing motor commands.
+For every command the benchmark records how long the call held the loop,
+which is what the actuator thread is there to remove, and how long it took
+until the MotorController had applied it. A monitor task sleeps 1 ms at a
+time and records how late it wakes up, the overall loop stall including the
+video load.
+
+The MotorController runs against the simulated sysfs tree and gpiod of
+``src.server.sim`` with the ramp scheduler off, so every command writes to
+the PWM files. Each write and ioctl is given a blocking cost to stand in for
+the real kernel calls. Every mode runs ``--repeats`` times, to show the
+spread between runs.
+
+Run from the Python directory:
+
+    python -m tests.loop_stall_benchmark --write-cost-ms 0.1 --repeats 3
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from time import perf_counter
+
+import numpy as np
+from src.server.sim import Simulation
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return float("nan")
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+async def monitor_stalls(stalls, stop):
+    while not stop.is_set():
+        start = perf_counter()
+        await asyncio.sleep(0.001)
+        stalls.append(max(0.0, perf_counter() - start - 0.001) * 1000)
+
+
+async def video_load(stop):
+    loop = asyncio.get_running_loop()
+    frame = np.random.randint(0, 255, (720, 1280, 3), dtype=np.uint8)
+    while not stop.is_set():
+        # Stand-in for capture plus encode off the loop, and the frame
+        # conversion that happens on it
+        await loop.run_in_executor(None, np.flip, frame.copy(), 0)
+        frame[::4, ::4] += 1
+        await asyncio.sleep(1 / 30)
+
+
+async def send_commands(target, rate, duration, sent_at):
+    """Send commands at ``rate``, returning how long each call held the loop."""
+    interval = 1 / rate
+    start = perf_counter()
+    step = 0
+    blocked = []
+    while perf_counter() - start < duration:
+        step += 1
+        speed = 0.3 + 0.7 * ((step % 50) / 50)
+        sent_at[0] = perf_counter()
+        target.action(0, -1 if step % 100 < 50 else 1, speed, 0)
+        blocked.append((perf_counter() - sent_at[0]) * 1000)
+        await asyncio.sleep(interval)
+    return blocked
+
+
+async def run_mode(use_thread, simulation, args):
+    from src.server.actuator import ActuatorThread
+    from src.server.motor_controller import MotorController
+
+    motor_controller = MotorController(
+        motor1_step=13,
+        motor1_dir=17,
+        motor2_step=12,
+        motor2_dir=20,
+        motor1_en=27,
+        motor2_en=1,
+        weapon_speed=18,
+        pwm_sysfs_root=simulation.pwm_root,
+        ramp_rate=None,
+    )
+    motor_controller.weapon_data = lambda speed: None
+
+    # From sending the newest command to the controller having applied it
+    sent_at = [None]
+    applied = []
+    action = motor_controller.action
+
+    def timed_action(*args):
+        action(*args)
+        applied.append((perf_counter() - sent_at[0]) * 1000)
+
+    motor_controller.action = timed_action
+
+    if use_thread:
+        target = ActuatorThread(motor_controller)
+        target.start()
+    else:
+        target = motor_controller
+
+    stalls = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(monitor_stalls(stalls, stop))
+    video = asyncio.create_task(video_load(stop))
+    blocked = await send_commands(target, args.rate, args.duration, sent_at)
+    stop.set()
+    await asyncio.gather(monitor, video)
+
+    if use_thread:
+        target.cleanup()
+    else:
+        motor_controller.cleanup()
+
+    return {
+        "blocked_total_ms": sum(blocked),
+        "blocked_p99_ms": percentile(blocked, 0.99),
+        "blocked_max_ms": max(blocked),
+        "applied_p50_ms": percentile(applied, 0.50),
+        "applied_p99_ms": percentile(applied, 0.99),
+        "stall_total_ms": sum(stalls),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=200, help="commands/sec")
+    parser.add_argument("--duration", type=float, default=5, help="seconds")
+    parser.add_argument(
+        "--write-cost-ms", type=float, default=0.1, help="blocking cost per write"
+    )
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    simulation = Simulation()
+    simulation.install()
+    import gpiod
+
+    cost = args.write_cost_ms / 1000
+    original_pwrite = os.pwrite
+
+    def slow_pwrite(fd, data, offset):
+        time.sleep(cost)
+        return original_pwrite(fd, data, offset)
+
+    def slow_request_lines(path, consumer, config):
+        request = original_request_lines(path, consumer, config)
+        original_set_values = request.set_values
+
+        def set_values(values):
+            time.sleep(cost)
+            original_set_values(values)
+
+        request.set_values = set_values
+        return request
+
+    original_request_lines = gpiod.request_lines
+    gpiod.request_lines = slow_request_lines
+    os.pwrite = slow_pwrite
+
+    print(f"{args.rate:.0f} commands/s, {args.write_cost_ms} ms per write/ioctl")
+    for use_thread in (False, True):
+        label = "actuator thread" if use_thread else "on the loop"
+        for _ in range(args.repeats):
+            result = await run_mode(use_thread, simulation, args)
+            print(
+                f"{label:<16} commands held the loop {result['blocked_total_ms']:.0f} "
+                f"ms in total (p99={result['blocked_p99_ms']:.3f} ms "
+                f"max={result['blocked_max_ms']:.2f} ms), applied after "
+                f"p50={result['applied_p50_ms']:.2f} ms "
+                f"p99={result['applied_p99_ms']:.2f} ms, "
+                f"loop stall {result['stall_total_ms']:.0f} ms"
+            )
+    simulation.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
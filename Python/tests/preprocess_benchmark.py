@@ -0,0 +1,151 @@
+"""
+Per-stage cost of turning a received frame into the image aim assist gets,
+the old VideoWindow.process_frames stages against FramePreprocessor.
+
+The old path ran to_ndarray("yuv420p"), cvtColor, a slice, flip and resize,
+each allocating a full-size array, on the event loop. FramePreprocessor
+runs on a worker thread and writes into reused buffers: OpenCV converts and
+scales mono frames, one swscale pass converts and scales packed stereo ones.
+The loop stall is the longest a 1 ms ticker on the event loop was held up
+while frames were processed.
+
+Run from the Python directory:
+
+    python -m tests.preprocess_benchmark --frames 300
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import cv2
+import numpy as np
+from av import VideoFrame
+
+with contextlib.redirect_stdout(io.StringIO()):
+    from src.client.video import FramePreprocessor, stereo_eye
+
+LEGACY_STAGES = ("to_ndarray", "cvtColor", "slice", "flip", "resize", "total")
+
+
+def make_frames(count, width=1280, height=720):
+    """Gradient frames with a moving square, like the simulated cameras."""
+    frames = []
+    gradient = np.tile(np.linspace(0, 255, width, dtype=np.uint8), (height, 1))
+    for index in range(count):
+        image = np.repeat(gradient[:, :, np.newaxis], 3, axis=2)
+        x = (index * 8) % (width - height // 4)
+        image[height // 3 : height // 3 + height // 4, x : x + height // 4] = 255
+        frames.append(
+            VideoFrame.from_ndarray(image, format="bgr24").reformat(format="yuv420p")
+        )
+    return frames
+
+
+def legacy_process(frame, stereo, rotation, timings):
+    start = perf_counter()
+    img_yuv = frame.to_ndarray(format="yuv420p")
+    t1 = perf_counter()
+    img_rgb = cv2.cvtColor(img_yuv, cv2.COLOR_YUV2RGB_I420)
+    t2 = perf_counter()
+    dim = (int(img_rgb.shape[1] * 0.5), int(img_rgb.shape[0] * 0.5))
+    img_rgb = stereo_eye(img_rgb, stereo, 0)
+    t3 = perf_counter()
+    if rotation == 180:
+        img_rgb = cv2.flip(img_rgb, -1)
+    t4 = perf_counter()
+    img_rgb = cv2.resize(img_rgb, dim, interpolation=cv2.INTER_AREA)
+    t5 = perf_counter()
+
+    for stage, (begin, end) in zip(
+        LEGACY_STAGES,
+        ((start, t1), (t1, t2), (t2, t3), (t3, t4), (t4, t5), (start, t5)),
+    ):
+        timings[stage].append((end - begin) * 1000)
+    return img_rgb
+
+
+async def measure_stall(process, frames):
+    """Process every frame while a ticker measures how late it runs."""
+    stall = 0
+    running = True
+
+    async def ticker():
+        nonlocal stall
+        while running:
+            before = perf_counter()
+            await asyncio.sleep(0.001)
+            stall = max(stall, perf_counter() - before - 0.001)
+
+    task = asyncio.create_task(ticker())
+    for frame in frames:
+        await process(frame)
+        await asyncio.sleep(0)
+    running = False
+    await task
+    return stall * 1000
+
+
+def mean(values):
+    return sum(values) / len(values)
+
+
+async def run(frames, stereo, rotation):
+    timings = {stage: [] for stage in LEGACY_STAGES}
+
+    async def legacy(frame):
+        legacy_process(frame, stereo, rotation, timings)
+
+    legacy_stall = await measure_stall(legacy, frames)
+
+    preprocessor = FramePreprocessor(scale=0.5)
+    executor = ThreadPoolExecutor(max_workers=1)
+    loop = asyncio.get_running_loop()
+
+    async def fused(frame):
+        await loop.run_in_executor(
+            executor, preprocessor.process, frame, stereo, rotation
+        )
+
+    fused_stall = await measure_stall(fused, frames)
+    executor.shutdown()
+
+    # Same picture both ways
+    old = legacy_process(frames[-1], stereo, rotation, timings)
+    new = preprocessor.process(frames[-1], stereo, rotation)
+    difference = np.abs(old.astype(np.int16) - new.astype(np.int16)).mean()
+
+    legacy = {stage: mean(times) for stage, times in timings.items()}
+    return legacy, preprocessor.stats(), legacy_stall, fused_stall, difference
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=300)
+    args = parser.parse_args()
+
+    frames = make_frames(args.frames)
+    for stereo in ("mono", "side_by_side"):
+        for rotation in (0, 180):
+            legacy, fused, legacy_stall, fused_stall, difference = asyncio.run(
+                run(frames, stereo, rotation)
+            )
+            print(f"{stereo}, rotation {rotation}:")
+            print(
+                "  old   "
+                + " ".join(f"{stage}={legacy[stage]:.3f}" for stage in LEGACY_STAGES)
+                + f" ms, loop stall {legacy_stall:.1f} ms"
+            )
+            print(
+                "  fused "
+                + " ".join(f"{stage}={value:.3f}" for stage, value in fused.items())
+                + f" ms, loop stall {fused_stall:.1f} ms, "
+                f"mean pixel difference {difference:.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
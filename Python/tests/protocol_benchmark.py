@@ -0,0 +1,72 @@
+"""
+Micro-benchmark of the control packet format against the old JSON dicts.
+
+Run from the Python directory:
+
+    python -m tests.protocol_benchmark
+"""
+
+import json
+import timeit
+from time import perf_counter
+
+from src.shared.protocol import decode_message, encode_motion
+
+ITERATIONS = 200_000
+
+COMMAND = {"x": -0.7312, "y": 1, "speed": 0.8124, "weapon_speed": 0.4}
+
+
+def json_encode():
+    return json.dumps(COMMAND)
+
+
+def json_decode(message):
+    # What the server did before: json.loads plus the four key checks
+    data = json.loads(message)
+    if "x" in data and "y" in data and "speed" in data and "weapon_speed" in data:
+        return data["x"], data["y"], data["speed"], data["weapon_speed"]
+
+
+def binary_encode(sequence=1):
+    return encode_motion(
+        COMMAND["x"],
+        COMMAND["y"],
+        COMMAND["speed"],
+        COMMAND["weapon_speed"],
+        sequence,
+        perf_counter(),
+    )
+
+
+def binary_decode(packet):
+    command = decode_message(packet)
+    return command.x, command.y, command.speed, command.weapon_speed
+
+
+def measure(label, func, *args):
+    seconds = min(timeit.repeat(lambda: func(*args), number=ITERATIONS, repeat=5))
+    per_call_us = seconds / ITERATIONS * 1_000_000
+    print(f"{label:<16} {per_call_us:8.3f} us/call")
+    return per_call_us
+
+
+def main():
+    json_message = json_encode()
+    binary_packet = binary_encode()
+
+    print(f"Payload size: json={len(json_message)} bytes, ", end="")
+    print(f"binary={len(binary_packet)} bytes")
+    print("(json size excludes the sequence number and timestamp)\n")
+
+    json_enc = measure("json encode", json_encode)
+    json_dec = measure("json decode", json_decode, json_message)
+    bin_enc = measure("binary encode", binary_encode)
+    bin_dec = measure("binary decode", binary_decode, binary_packet)
+
+    print(f"\nencode speed-up: {json_enc / bin_enc:.2f}x")
+    print(f"decode speed-up: {json_dec / bin_dec:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+YOLO inference time on the whole frame against the crop ``search_region``
+picks around the last known target.
+
+The frames are 640x360 like the ones aim assist gets from the client, with
+the target moving up to ``--speed`` pixels per frame; the crop is taken
+around its box in the previous frame, as in AimAssist. Besides the time, the
+benchmark counts how often the target was still fully inside the crop.
+``--backend`` and ``--int8`` pick the detector like ``docs/config.yaml``.
+
+Run from the Python directory (needs ultralytics, and onnxruntime for that
+backend):
+
+    python -m tests.roi_detection_benchmark --model ../Models/BotModel.pt
+    python -m tests.roi_detection_benchmark --backend onnxruntime --int8
+"""
+
+import argparse
+from time import perf_counter
+
+import numpy as np
+from src.client.detection_scheduler import search_region
+from src.client.detectors import BACKENDS, create_detector
+from src.shared.clock_sync import percentile
+
+WIDTH, HEIGHT, SIDE = 640, 360, 60
+
+
+def make_frames(count, speed):
+    gradient = np.tile(np.linspace(40, 200, WIDTH, dtype=np.uint8), (HEIGHT, 1))
+    background = np.repeat(gradient[:, :, np.newaxis], 3, axis=2)
+    rng = np.random.default_rng(0)
+    x, y = WIDTH // 2, HEIGHT // 2
+    frames, boxes = [], []
+    for _ in range(count):
+        x = int(np.clip(x + rng.integers(-speed, speed + 1), 0, WIDTH - SIDE))
+        y = int(np.clip(y + rng.integers(-speed, speed + 1), 0, HEIGHT - SIDE))
+        frame = background.copy()
+        frame[y : y + SIDE, x : x + SIDE] = (0, 220, 220)
+        frames.append(frame)
+        boxes.append((x, y, SIDE, SIDE))
+    return frames, boxes
+
+
+def inside(box, region):
+    x, y, w, h = box
+    left, top, width, height = region
+    return left <= x and top <= y and x + w <= left + width and y + h <= top + height
+
+
+def time_inference(model, frames, boxes, size, padding):
+    full, roi, contained = [], [], 0
+    for index in range(1, len(frames)):
+        frame = frames[index]
+
+        start = perf_counter()
+        model(frame)
+        full.append((perf_counter() - start) * 1000)
+
+        left, top, width, height = region = search_region(
+            boxes[index - 1], frame.shape, size, padding
+        )
+        start = perf_counter()
+        model(frame[top : top + height, left : left + width], imgsz=size)
+        roi.append((perf_counter() - start) * 1000)
+        contained += inside(boxes[index], region)
+    return full, roi, contained
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="yolov8n.pt")
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--size", type=int, default=320)
+    parser.add_argument("--padding", type=float, default=2.0)
+    parser.add_argument("--speed", type=int, default=20, help="pixels per frame")
+    parser.add_argument("--backend", choices=BACKENDS, default="torch")
+    parser.add_argument("--int8", action="store_true")
+    args = parser.parse_args()
+
+    model = create_detector(args.model, args.backend, args.int8)
+    frames, boxes = make_frames(args.frames + 1, args.speed)
+    # The first inference at every input size is the slowest
+    model(frames[0])
+    model(frames[0][: args.size, : args.size], imgsz=args.size)
+
+    full, roi, contained = time_inference(model, frames, boxes, args.size, args.padding)
+    for name, times in (("full frame", full), (f"roi {args.size}", roi)):
+        print(
+            f"{name:<10} p50={percentile(times, 0.50):.1f} ms "
+            f"p99={percentile(times, 0.99):.1f} ms"
+        )
+    print(
+        f"speed-up {percentile(full, 0.50) / percentile(roi, 0.50):.1f}x, target "
+        f"inside the crop in {contained}/{len(roi)} frames"
+    )
+
+
+if __name__ == "__main__":
+    main()
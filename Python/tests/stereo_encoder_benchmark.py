@@ -0,0 +1,154 @@
+"""
+Encoder reinitialisations and encode time per stereo layout, on the simulated
+cameras.
+
+The old Camera sent a 1280 wide frame nine times out of ten and a 2560 wide
+hconcat of both cameras every tenth frame. aiortc's H264Encoder recreates its
+codec context whenever the frame size changes, so that happened twice every
+ten frames. The packed layouts keep the frame size constant. With the
+``tracks`` layout each camera is encoded on its own, the second at its low
+frame rate, so the encode budget is the sum of both tracks' ms per second.
+
+A reinitialisation is counted whenever the encoder's codec object changes.
+
+Run from the Python directory:
+
+    python -m tests.stereo_encoder_benchmark --frames 150
+"""
+
+import argparse
+import fractions
+import time
+from time import perf_counter
+
+import cv2
+from av import VideoFrame
+from src.server.sim import Simulation
+from src.shared.clock_sync import percentile
+
+
+class LegacyFrames:
+    """The old get_frame: the second camera hconcat'ed every tenth frame."""
+
+    def __init__(self):
+        from picamera2 import Picamera2
+        from src.server.video import CaptureThread
+
+        self.captures = []
+        for camera_num in (0, 1):
+            camera = Picamera2(camera_num)
+            camera.configure(
+                camera.create_video_configuration(
+                    main={"size": (1280, 720), "format": "RGB888"}
+                )
+            )
+            self.captures.append(CaptureThread(camera))
+        self.counter = 0
+
+    def start(self):
+        for capture in self.captures:
+            capture.start()
+
+    def get_video_frame(self):
+        frame = self.captures[0].latest()
+        if frame is None:
+            return None
+        self.counter += 1
+        if self.counter % 10 == 0:
+            frame2 = self.captures[1].latest()
+            if frame2 is not None:
+                frame = cv2.hconcat([frame, frame2])
+        return VideoFrame.from_ndarray(frame, format="bgr24")
+
+    def stop(self):
+        for capture in self.captures:
+            capture.stop()
+
+
+class CameraSource:
+    def __init__(self, camera, eye=None):
+        self.camera = camera
+        self.eye = eye
+
+    def start(self):
+        self.camera.is_camera_available()
+        self.camera.start()
+
+    def get_video_frame(self):
+        return self.camera.get_video_frame(self.eye)
+
+    def stop(self):
+        self.camera.stop()
+
+
+def run(source, frames, fps=30):
+    from aiortc.codecs.h264 import H264Encoder
+
+    encoder = H264Encoder()
+    codec = None
+    reinits = 0
+    encode_times = []
+    time_base = fractions.Fraction(1, 90000)
+
+    source.start()
+    for index in range(frames):
+        time.sleep(1 / fps)
+        video_frame = source.get_video_frame()
+        while video_frame is None:
+            time.sleep(0.005)
+            video_frame = source.get_video_frame()
+        video_frame.pts = index * 90000 // fps
+        video_frame.time_base = time_base
+
+        start = perf_counter()
+        encoder.encode(video_frame)
+        encode_times.append((perf_counter() - start) * 1000)
+
+        if encoder.codec is not codec:
+            reinits += 1
+            codec = encoder.codec
+    source.stop()
+
+    return {
+        "reinits": reinits - 1,  # the first frame always creates the codec
+        "size": f"{video_frame.width}x{video_frame.height}",
+        "mean_ms": sum(encode_times) / len(encode_times),
+        "ms_per_sec": sum(encode_times) / len(encode_times) * fps,
+        "p50_ms": percentile(encode_times, 0.50),
+        "p99_ms": percentile(encode_times, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=150)
+    args = parser.parse_args()
+
+    Simulation().install()
+    from src.server.video import Camera
+
+    camera2_fps = 3
+    sources = {
+        "old (mono + hconcat)": (LegacyFrames, 30),
+        "mono": (lambda: CameraSource(Camera(stereo="mono")), 30),
+        "side_by_side": (lambda: CameraSource(Camera(stereo="side_by_side")), 30),
+        "top_bottom": (lambda: CameraSource(Camera(stereo="top_bottom")), 30),
+        "tracks camera1": (lambda: CameraSource(Camera(stereo="tracks"), 0), 30),
+        "tracks camera2": (
+            lambda: CameraSource(Camera(stereo="tracks", stereo_fps=camera2_fps), 1),
+            camera2_fps,
+        ),
+    }
+    for name, (make_source, fps) in sources.items():
+        frames = max(args.frames * fps // 30, 10)
+        result = run(make_source(), frames, fps)
+        print(
+            f"{name:<22} {result['size']:>9} @ {fps:>2} fps: "
+            f"{result['reinits']} reinits, "
+            f"encode mean={result['mean_ms']:.2f} ms p50={result['p50_ms']:.2f} ms "
+            f"p99={result['p99_ms']:.2f} ms, {result['ms_per_sec']:.0f} ms/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
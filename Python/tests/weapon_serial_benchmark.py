@@ -0,0 +1,172 @@
+"""
+Weapon setpoint latency over serial, old text protocol against the binary
+ArduinoPWMController, with a pty standing in for the Arduino.
+
+The Arduino side reads the pty master at the rate the baud rate allows
+(10 bits per byte). Setpoints are produced at a fixed rate with increasing
+values, so an arrival can be matched to the time its value was first set.
+
+The old controller wrote ``"{speed},{duty}\\n"`` at 9600 baud with a blocking
+write and a print per setpoint, so at high command rates the serial buffer
+fills and every setpoint arrives later than the one before. The new one
+coalesces to the newest setpoint and only sends what the link can carry.
+
+Run from the Python directory:
+
+    python -m tests.weapon_serial_benchmark --rate 200
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import threading
+import time
+import tty
+from time import perf_counter
+
+import serial
+from src.server.weapon_serial import (
+    FRAME_SETPOINT,
+    ArduinoPWMController,
+    decode_frames,
+)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return float("nan")
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class LegacyTextController:
+    """The old ArduinoPWMController write path."""
+
+    def __init__(self, port, baudrate=9600):
+        self.serial_connection = serial.Serial(port, baudrate, timeout=1)
+
+    def update_speed(self, speed):
+        data = f"{speed:.3f},50\n"
+        self.serial_connection.write(data.encode())
+        print(f"Sent: {data.strip()}")
+
+    def disconnect(self):
+        self.serial_connection.close()
+
+
+class ArduinoStandIn(threading.Thread):
+    """Read the pty master no faster than the baud rate allows."""
+
+    def __init__(self, fd, baudrate, binary):
+        super().__init__(daemon=True)
+        self.fd = fd
+        self.byte_time = 10 / baudrate
+        self.binary = binary
+        self.arrivals = []  # (perf_counter, speed)
+        self.running = True
+
+    def run(self):
+        buffer = b""
+        chunk = 16
+        while self.running:
+            try:
+                data = os.read(self.fd, chunk)
+            except OSError:
+                break
+            time.sleep(len(data) * self.byte_time)
+            now = perf_counter()
+            buffer += data
+
+            if self.binary:
+                frames, buffer = decode_frames(buffer)
+                for frame_type, _, speed in frames:
+                    if frame_type == FRAME_SETPOINT:
+                        self.arrivals.append((now, speed))
+            else:
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    self.arrivals.append((now, float(line.split(b",")[0])))
+
+
+def run(binary, args):
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    port = os.ttyname(slave)
+
+    if binary:
+        baudrate = args.baudrate
+        controller = ArduinoPWMController(port, baudrate, startup_delay=0)
+        controller.connect()
+    else:
+        baudrate = 9600
+        controller = LegacyTextController(port, baudrate)
+
+    arduino = ArduinoStandIn(master, baudrate, binary)
+    arduino.start()
+
+    set_times = {}
+    call_times = []
+    interval = 1 / args.rate
+    count = int(args.rate * args.duration)
+    next_send = perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(1, count + 1):
+            speed = round(i / count, 3)
+            start = perf_counter()
+            set_times.setdefault(speed, start)
+            controller.update_speed(speed)
+            call_times.append((perf_counter() - start) * 1000)
+
+            next_send += interval
+            delay = next_send - perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    time.sleep(args.drain)
+    arduino.running = False
+    controller.disconnect()
+    os.close(master)
+    os.close(slave)
+
+    latencies = [
+        (arrival - set_times[speed]) * 1000
+        for arrival, speed in arduino.arrivals
+        if speed in set_times
+    ]
+    final_speed = arduino.arrivals[-1][1] if arduino.arrivals else None
+    return {
+        "baudrate": baudrate,
+        "delivered": len(latencies),
+        "sent": count,
+        "final_speed": final_speed,
+        "p50_ms": percentile(latencies, 0.50),
+        "p99_ms": percentile(latencies, 0.99),
+        "call_p99_ms": percentile(call_times, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=200, help="setpoints/sec")
+    parser.add_argument("--duration", type=float, default=3, help="seconds")
+    parser.add_argument("--baudrate", type=int, default=115200)
+    parser.add_argument(
+        "--drain", type=float, default=1, help="seconds to wait for the tail"
+    )
+    args = parser.parse_args()
+
+    for binary in (False, True):
+        result = run(binary, args)
+        label = "binary" if binary else "text"
+        print(
+            f"{label:<6} {result['baudrate']:>6} baud: "
+            f"{result['delivered']}/{result['sent']} setpoints delivered, "
+            f"last={result['final_speed']}, "
+            f"latency p50={result['p50_ms']:.1f} ms p99={result['p99_ms']:.1f} ms, "
+            f"update_speed p99={result['call_p99_ms']:.3f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Localhost benchmark of the WebSocket control path: stop-and-wait against
+pipelined sends with cumulative acks.
+
+The server runs with a motor controller that only counts commands, so the
+numbers show the protocol cost. Latency is the time from sending a command to
+receiving its status reply (stop-and-wait) or the ack covering it (pipelined).
+``--rtt`` routes the connection through a local proxy that delays every
+chunk, to get closer to the arena Wi-Fi than plain localhost.
+
+Run from the Python directory:
+
+    python -m tests.websocket_pipeline_benchmark --duration 5 --rtt 0.02
+"""
+
+import argparse
+import asyncio
+from time import perf_counter
+
+import websockets
+from src.client.communications import WebSocketClient
+from src.server.communications import MotorWebSocketServer
+
+
+class CountingMotorController:
+    def __init__(self):
+        self.actions = 0
+
+    def action(self, x, y, speed, weapon_speed):
+        self.actions += 1
+
+    def stop(self):
+        pass
+
+
+async def start_delay_proxy(target_port, one_way_delay):
+    async def pump(reader, writer):
+        queue = asyncio.Queue()
+
+        async def deliver():
+            while True:
+                deliver_at, data = await queue.get()
+                await asyncio.sleep(max(0, deliver_at - perf_counter()))
+                if not data:
+                    writer.close()
+                    return
+                writer.write(data)
+                await writer.drain()
+
+        deliver_task = asyncio.create_task(deliver())
+        while True:
+            data = await reader.read(65536)
+            await queue.put((perf_counter() + one_way_delay, data))
+            if not data:
+                break
+        await deliver_task
+
+    async def handle(client_reader, client_writer):
+        server_reader, server_writer = await asyncio.open_connection(
+            "127.0.0.1", target_port
+        )
+        await asyncio.gather(
+            pump(client_reader, server_writer),
+            pump(server_reader, client_writer),
+            return_exceptions=True,
+        )
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return float("nan")
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+async def run_mode(pipelined, args):
+    motor_controller = CountingMotorController()
+    server = MotorWebSocketServer(
+        motor_controller, "127.0.0.1", 0, ack_interval=args.ack_interval
+    )
+    async with websockets.serve(server.handle_client, "127.0.0.1", 0) as ws_server:
+        port = ws_server.sockets[0].getsockname()[1]
+        if args.rtt:
+            proxy = await start_delay_proxy(port, args.rtt / 2)
+            port = proxy.sockets[0].getsockname()[1]
+
+        client = WebSocketClient(f"ws://127.0.0.1:{port}", pipelined=pipelined)
+        client.latencies = []  # keep every sample for the percentiles
+        connect_task = asyncio.create_task(client.connect())
+        while not client.connected:
+            await asyncio.sleep(0.01)
+
+        interval = 1 / args.rate if args.rate else 0
+        sent = 0
+        start = perf_counter()
+        while perf_counter() - start < args.duration:
+            await client.send_command(
+                {"x": sent % 2, "y": 1, "speed": 0.5, "weapon_speed": 0}
+            )
+            sent += 1
+            await asyncio.sleep(interval)
+        elapsed = perf_counter() - start
+
+        # Wait for the last acks
+        await asyncio.sleep(args.ack_interval * 5)
+        await client.websocket.close()
+        await connect_task
+        if args.rtt:
+            proxy.close()
+
+    return {
+        "sent": sent,
+        "applied": motor_controller.actions,
+        "commands_per_sec": motor_controller.actions / elapsed,
+        "p50_ms": percentile(client.latencies, 0.50),
+        "p99_ms": percentile(client.latencies, 0.99),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=5, help="seconds")
+    parser.add_argument("--rtt", type=float, default=0, help="seconds")
+    parser.add_argument("--ack-interval", type=float, default=0.02, help="seconds")
+    parser.add_argument(
+        "--rate", type=float, default=0, help="commands/sec, 0 sends flat out"
+    )
+    args = parser.parse_args()
+
+    print(
+        f"rtt={args.rtt * 1000:.0f} ms ack interval={args.ack_interval * 1000:.0f} ms"
+    )
+    for pipelined in (False, True):
+        result = await run_mode(pipelined, args)
+        label = "pipelined" if pipelined else "stop-and-wait"
+        print(
+            f"{label:<14} sent={result['sent']} applied={result['applied']} "
+            f"{result['commands_per_sec']:.0f} cmd/s "
+            f"p50={result['p50_ms']:.2f} ms p99={result['p99_ms']:.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())